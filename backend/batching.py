@@ -0,0 +1,218 @@
+import logging
+import re
+import threading
+import time
+
+from utils import normalize_url
+
+logger = logging.getLogger(__name__)
+
+# One line per event in a batched answer, e.g. "Event 2: positive"
+BATCH_VERDICT = re.compile(r"^[\s*#>-]*Event\s+(\d+)\s*:\s*\**\s*(positive|negative|neutral)\b\**[ \t]*", re.IGNORECASE | re.MULTILINE)
+
+
+def batch_prompt(url, events):
+    """
+    Build the prompt that checks several events on one page in a single agent session.
+
+    Args:
+        url (str): The page every event is about.
+        events (list[str]): The event descriptions, numbered from 1 in the prompt.
+
+    Returns:
+        str: The prompt.
+    """
+    numbered = "\n".join(f"{number}. {event}" for number, event in enumerate(events, start=1))
+    return (
+        f"Visit this {url} and check whether each of the following events occurred:\n"
+        f"{numbered}\n"
+        "Carefully explore all visible sections, links, banners, and interactive elements on the page. "
+        "Ensure you gather as much relevant information as possible related to every event. "
+        "Do not navigate to external websites or perform searches outside this page. "
+        "Once you have checked every event, answer each one on its own line starting with "
+        "'Event <number>: positive' if it occurred, 'Event <number>: negative' if it did not occur, "
+        "or 'Event <number>: neutral' if unsure, followed by your detailed findings for that event."
+    )
+
+
+def parse_batch_verdicts(text, count):
+    """
+    Split a batched answer into one result per event, in the format single checks return.
+
+    Args:
+        text (str): The agent's final answer to ``batch_prompt``.
+        count (int): The number of events asked about.
+
+    Returns:
+        list[str]: For each event, 'Answer Type: <verdict>' followed by its findings.
+        Events the answer has no verdict for are neutral.
+    """
+    matches = [match for match in BATCH_VERDICT.finditer(text) if 1 <= int(match.group(1)) <= count]
+    results = [None] * count
+    for index, match in enumerate(matches):
+        end = matches[index + 1].start() if index + 1 < len(matches) else len(text)
+        findings = text[match.end():end].strip(" \t:-")
+        number = int(match.group(1))
+        if results[number - 1] is None:
+            results[number - 1] = f"Answer Type: {match.group(2).lower()}\n{findings.strip()}".strip()
+    return [
+        result or f"Answer Type: neutral\nThe batched check returned no verdict for this event.\n{text}".strip()
+        for result in results
+    ]
+
+
+def batch_is_decisive(count):
+    """Return a check for whether a batched answer has a positive or negative verdict for every event."""
+    def decisive(text):
+        numbers = {
+            int(match.group(1)) for match in BATCH_VERDICT.finditer(text)
+            if match.group(2).lower() != "neutral"
+        }
+        return numbers >= set(range(1, count + 1))
+    return decisive
+
+
+class ListenerBatcher:
+    """
+    Holds due listeners briefly so that listeners watching the same page run as one agent session.
+
+    Listeners are grouped by normalized URL. A group is dispatched ``window`` seconds after
+    its first listener arrived, or straight away once it holds ``max_size`` listeners.
+    Groups of one are dispatched like any other. With ``has_companion``, a group is
+    dispatched as soon as a listener arrives that no other listener on its page will
+    follow, so a listener alone on its page never waits, and a group stops waiting once
+    everyone due on its page has joined.
+
+    Args:
+        dispatch (callable): Called with each group, a list of listener rows.
+        window (float): Seconds a listener may wait for others on its page.
+        max_size (int): The most listeners in one group.
+        clock (callable, optional): Monotonic time source. Defaults to ``time.monotonic``.
+        has_companion (callable, optional): Called with each arriving listener; returns whether
+            another listener on its page is due within the window, such as
+            ``ListenerScheduler.has_companion``. Without it every group waits out its window.
+    """
+
+    def __init__(self, dispatch, window=2.0, max_size=8, clock=time.monotonic, has_companion=None):
+        self.dispatch = dispatch
+        self.window = window
+        self.max_size = max_size
+        self.clock = clock
+        self.has_companion = has_companion
+        # Normalized URL -> (deadline, listeners); the window is fixed, so insertion order is deadline order
+        self._groups = {}
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self._groups_dispatched = 0
+        self._batches = 0
+        self._batched_listeners = 0
+        self._immediate = 0
+
+    def add(self, listener):
+        """Queue a due listener, dispatching its group if this fills it or no other listener will join it."""
+        key = normalize_url(listener["url"])
+        last = self.has_companion is not None and not self.has_companion(listener)
+        with self._condition:
+            group, full = self._join(key, listener)
+            if last and not full:
+                del self._groups[key]
+                self._immediate += 1
+                full = True
+        if full:
+            self._dispatch(group)
+
+    def flush(self):
+        """Dispatch every waiting group now. Returns the number of groups dispatched."""
+        with self._condition:
+            groups = [group for _, group in self._groups.values()]
+            self._groups.clear()
+        for group in groups:
+            self._dispatch(group)
+        return len(groups)
+
+    def metrics(self):
+        """
+        Return batching counters.
+
+        Returns:
+            dict: Listeners waiting now, and lifetime totals of groups dispatched, groups of
+            more than one listener, the listeners in those, and groups dispatched before
+            their window closed because no other listener would join them.
+        """
+        with self._condition:
+            return {
+                "waiting": sum(len(group) for _, group in self._groups.values()),
+                "immediate": self._immediate,
+                "groups": self._groups_dispatched,
+                "batches": self._batches,
+                "batched_listeners": self._batched_listeners,
+            }
+
+    def start(self):
+        """Start dispatching groups as their windows close, from a background thread."""
+        if self._thread is not None:
+            return
+        with self._condition:
+            self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="listener-batcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and dispatch the groups still waiting."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and not self._due_groups():
+                    timeout = None
+                    if self._groups:
+                        timeout = max(0.0, next(iter(self._groups.values()))[0] - self.clock())
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+                due = self._pop_due()
+            for group in due:
+                self._dispatch(group)
+
+    def _join(self, key, listener):
+        # Called with the condition held; returns the group and whether it is ready to dispatch
+        deadline, group = self._groups.setdefault(key, (self.clock() + self.window, []))
+        group.append(listener)
+        full = len(group) >= self.max_size
+        if full:
+            del self._groups[key]
+        elif len(group) == 1:
+            self._condition.notify()
+        return group, full
+
+    def _due_groups(self):
+        return bool(self._groups) and next(iter(self._groups.values()))[0] <= self.clock()
+
+    def _pop_due(self):
+        now = self.clock()
+        due = []
+        for key, (deadline, group) in list(self._groups.items()):
+            if deadline > now:
+                break
+            del self._groups[key]
+            due.append(group)
+        return due
+
+    def _dispatch(self, group):
+        with self._condition:
+            self._groups_dispatched += 1
+            if len(group) > 1:
+                self._batches += 1
+                self._batched_listeners += len(group)
+        try:
+            self.dispatch(group)
+        except Exception as e:
+            logger.error(f"Error dispatching {len(group)} listeners on {group[0]['url']}: {e}")
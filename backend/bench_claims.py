@@ -0,0 +1,150 @@
+"""
+Check lease-based claiming across nodes, and how throughput scales with the node count.
+
+A ``FakeSupabase`` shared through ``FakeSupabase.serve`` stands in for the listener
+table, seeded with listeners that are all due now. Each node is a separate process with
+its own ``ListenerScheduler`` and ``ListenerLeases``, as a backend node would have; the
+agent run is simulated by a sleep, after which the node records the run in a 'runs'
+table and reschedules the listener a day out. The run repeats for each node count.
+
+With ``--kill-after`` one node is killed that many seconds in, while it holds leases;
+its listeners must be reclaimed by the others once the leases run out.
+
+Reported per node count: listeners run, listeners run more than once, listeners never
+run, wall time and listeners per second.
+
+Usage:
+    python bench_claims.py [--listeners 400] [--nodes 1,2,4] [--capacity 8] [--work 0.5]
+                           [--lease 3] [--db-latency 0.005] [--kill-after 2]
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from fakes import FakeSupabase, RemoteFakeSupabase
+from listener_leases import ListenerLeases
+from scheduler import ListenerScheduler
+
+
+def seed_rows(count):
+    now = datetime.now(timezone.utc).isoformat()
+    return [
+        {
+            "id": index,
+            "event": f"Check whether item {index} is back in stock",
+            "url": f"https://shop.example.com/items/{index}",
+            "interval": "1-day",
+            "notification_type": "email",
+            "status": "pending",
+            "trigger_status": "pending",
+            "next_trigger_at": now,
+            "lease_owner": None,
+            "user_id": f"user-{index % 100}",
+        }
+        for index in range(1, count + 1)
+    ]
+
+
+def run_node(address, args, stop_signal):
+    """One backend node: claim due listeners, 'run' them and reschedule them until told to stop."""
+    logging.basicConfig(level=args.log_level)
+    supabase = RemoteFakeSupabase(address, latency=args.db_latency)
+    leases = ListenerLeases(
+        supabase, lease_seconds=args.lease, heartbeat_interval=args.lease / 3, max_held=args.capacity
+    )
+    pool = ThreadPoolExecutor(max_workers=args.capacity)
+
+    def work(listener):
+        time.sleep(args.work)
+        supabase.table("runs").insert({"listener_id": listener["id"], "node": os.getpid()}).execute()
+        scheduler.reschedule(listener)
+
+    scheduler = ListenerScheduler(
+        supabase, dispatch=lambda listener: pool.submit(work, listener), sync_interval=0.5, leases=leases
+    )
+    leases.start()
+    scheduler.load()
+    scheduler.start()
+    stop_signal.recv()
+    scheduler.stop()
+    pool.shutdown(wait=True)
+    leases.stop()
+
+
+def measure(nodes, args):
+    manager, address = FakeSupabase(tables={"event_listeners": seed_rows(args.listeners), "runs": []}).serve()
+    try:
+        client = RemoteFakeSupabase(address)
+        # A pipe per node rather than one Event, which a killed node could leave locked
+        pipes = [multiprocessing.Pipe(duplex=False) for _ in range(nodes)]
+        processes = [
+            multiprocessing.Process(target=run_node, args=(address, args, reader), daemon=True)
+            for reader, _ in pipes
+        ]
+        started = time.perf_counter()
+        for process in processes:
+            process.start()
+
+        killed = None
+        deadline = started + args.timeout
+        while time.perf_counter() < deadline:
+            if len({row["listener_id"] for row in client.rows("runs")}) >= args.listeners:
+                break
+            if args.kill_after and killed is None and nodes > 1 and time.perf_counter() - started >= args.kill_after:
+                killed = processes[0]
+                killed.kill()
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - started
+
+        for process, (_, writer) in zip(processes, pipes):
+            if process is not killed:
+                writer.send(None)
+        for process in processes:
+            process.join(timeout=30)
+        runs = Counter(row["listener_id"] for row in client.rows("runs"))
+    finally:
+        manager.shutdown()
+    return {
+        "nodes": nodes,
+        "run": len(runs),
+        "duplicates": sum(1 for times in runs.values() if times > 1),
+        "missing": args.listeners - len(runs),
+        "seconds": elapsed,
+        "per_second": len(runs) / elapsed,
+        "killed": killed is not None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--listeners", type=int, default=400)
+    parser.add_argument("--nodes", default="1,2,4", help="comma-separated node counts to run")
+    parser.add_argument("--capacity", type=int, default=8, help="listeners each node runs at once")
+    parser.add_argument("--work", type=float, default=0.5, help="seconds per simulated listener run")
+    parser.add_argument("--lease", type=float, default=3.0, help="lease length in seconds")
+    parser.add_argument("--db-latency", type=float, default=0.005, help="seconds per fake Supabase query")
+    parser.add_argument("--kill-after", type=float, default=0, help="kill one node this many seconds in")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--log-level", default="ERROR")
+    args = parser.parse_args()
+
+    print(f"{args.listeners} listeners, {args.capacity} at a time per node, {args.work}s each")
+    baseline = None
+    for nodes in (int(count) for count in args.nodes.split(",")):
+        result = measure(nodes, args)
+        baseline = baseline or result["per_second"] / nodes
+        print(
+            f"{nodes:>3} nodes  {result['per_second']:7.1f} listeners/s  "
+            f"({result['per_second'] / (baseline * nodes):4.0%} of linear)  {result['seconds']:6.1f}s  "
+            f"run {result['run']}  duplicates {result['duplicates']}  missing {result['missing']}"
+            + ("  (one node killed)" if result["killed"] else "")
+        )
+
+
+if __name__ == "__main__":
+    main()
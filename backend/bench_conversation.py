@@ -0,0 +1,159 @@
+"""
+Benchmark conversation-state bookkeeping over long agent sessions.
+
+Compares the previous approach (base64 screenshots kept in a plain message list and a
+full rescan of the history before every request) with ``Conversation``. Each turn adds
+an assistant tool call and a screenshot result, prunes old screenshots and serializes
+the request payload. No model or VM is involved.
+
+Every turn gets a freshly encoded screenshot, as it would from the computer tool.
+Timings include tracemalloc overhead, so compare them relative to each other.
+
+Usage:
+    python bench_conversation.py [--turns 150] [--image-kb 150] [--jpeg-quality 70]
+"""
+import argparse
+import base64
+import random
+import time
+import tracemalloc
+from io import BytesIO
+from types import SimpleNamespace
+
+from conversation import Conversation
+
+
+def legacy_filter(messages, images_to_keep, min_removal_threshold):
+    """The image filter sampling_loop ran before every request until Conversation replaced it."""
+    tool_result_blocks = [
+        item
+        for message in messages
+        for item in (message["content"] if isinstance(message["content"], list) else [])
+        if isinstance(item, dict) and item.get("type") == "tool_result"
+    ]
+    total_images = sum(
+        1
+        for tool_result in tool_result_blocks
+        for content in tool_result.get("content", [])
+        if isinstance(content, dict) and content.get("type") == "image"
+    )
+    images_to_remove = total_images - images_to_keep
+    images_to_remove -= images_to_remove % min_removal_threshold
+    for tool_result in tool_result_blocks:
+        if isinstance(tool_result.get("content"), list):
+            new_content = []
+            for content in tool_result.get("content", []):
+                if isinstance(content, dict) and content.get("type") == "image":
+                    if images_to_remove > 0:
+                        images_to_remove -= 1
+                        continue
+                new_content.append(content)
+            tool_result["content"] = new_content
+
+
+def assistant_turn(turn):
+    return [
+        {"type": "text", "text": f"Scrolling down, step {turn}."},
+        {"type": "tool_use", "id": f"toolu_{turn}", "name": "computer", "input": {"action": "screenshot"}},
+    ]
+
+
+def synthetic_screenshot(image_kb):
+    """Return PNG bytes that look like a page: a photo-like banner over text-like marks, about image_kb in size."""
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (1024, 768), "white")
+    rng = random.Random(0)
+    banner = Image.effect_noise((1024, 160), 12).convert("RGB")
+    gradient = Image.linear_gradient("L").resize((1024, 160)).convert("RGB")
+    image.paste(Image.blend(banner, gradient, 0.6), (0, 0))
+    draw = ImageDraw.Draw(image)
+    while True:
+        for _ in range(200):
+            x, y = rng.randrange(1000), rng.randrange(170, 760)
+            draw.rectangle((x, y, x + rng.randrange(4, 60), y + rng.randrange(2, 8)), fill=tuple(rng.randrange(256) for _ in range(3)))
+        output = BytesIO()
+        image.save(output, format="PNG")
+        if output.tell() >= image_kb * 1024:
+            return output.getvalue()
+
+
+def run_legacy(turns, screenshot, jpeg_quality=None):
+    messages = [{"role": "user", "content": [{"type": "text", "text": "Check the page."}]}]
+    for turn in range(turns):
+        legacy_filter(messages, 2, 2)
+        payload = list(messages)
+        messages.append({"role": "assistant", "content": assistant_turn(turn)})
+        messages.append({"role": "user", "content": [{
+            "type": "tool_result",
+            "tool_use_id": f"toolu_{turn}",
+            "is_error": False,
+            "content": [{
+                "type": "image",
+                "source": {"type": "base64", "media_type": "image/png", "data": base64.b64encode(screenshot).decode("ascii")},
+            }],
+        }]})
+    return messages, payload
+
+
+def run_conversation(turns, screenshot, jpeg_quality=None):
+    conversation = Conversation(images_to_keep=2, min_removal_threshold=2, jpeg_quality=jpeg_quality)
+    conversation.add_user_text("Check the page.")
+    for turn in range(turns):
+        payload = conversation.to_params()
+        conversation.add_assistant(assistant_turn(turn))
+        result = SimpleNamespace(output=None, error=None, base64_image=base64.b64encode(screenshot).decode("ascii"))
+        conversation.add_tool_results([(f"toolu_{turn}", result)])
+    return conversation, payload
+
+
+def payload_bytes(payload):
+    return sum(
+        len(item["source"]["data"])
+        for message in payload
+        for block in message["content"]
+        if block.get("type") == "tool_result" and isinstance(block["content"], list)
+        for item in block["content"]
+        if item.get("type") == "image"
+    )
+
+
+def measure(fn, turns, screenshot, jpeg_quality=None):
+    tracemalloc.start()
+    started = time.perf_counter()
+    state, payload = fn(turns, screenshot, jpeg_quality)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    request_bytes = payload_bytes(payload)
+    del payload
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, retained, peak, request_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=150)
+    parser.add_argument("--image-kb", type=int, default=150)
+    parser.add_argument("--jpeg-quality", type=int, default=70)
+    args = parser.parse_args()
+
+    screenshot = synthetic_screenshot(args.image_kb)
+
+    print(f"{args.turns} turns, {len(screenshot) // 1024} KB PNG screenshots")
+    runs = (
+        ("legacy list + rescan", run_legacy, None),
+        ("Conversation", run_conversation, None),
+        (f"Conversation JPEG q{args.jpeg_quality}", run_conversation, args.jpeg_quality),
+    )
+    for name, fn, jpeg_quality in runs:
+        elapsed, retained, peak, request_bytes = measure(fn, args.turns, screenshot, jpeg_quality)
+        print(
+            f"{name:<26} {elapsed / args.turns * 1e6:9.1f} us/turn  "
+            f"history {retained / 1024:8.1f} KiB  peak {peak / 1024:8.1f} KiB  "
+            f"last request images {request_bytes / 1024:7.1f} KiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
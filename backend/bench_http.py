@@ -0,0 +1,196 @@
+"""
+Compare request throughput of the development server and gunicorn.
+
+Each server runs the real app from ``create_app`` in a subprocess, with Supabase, Resend
+and Scrapybara replaced by the fakes in fakes.py and the listener table seeded with
+synthetic rows. Client processes then send a mix of /manage-listeners pages, each over
+a new connection, and the requests per second and latency percentiles are reported for
+both servers. The metrics routes are left out: under gunicorn only the leader answers them.
+
+Extra gunicorn workers only add throughput with extra CPUs to run them on; on a single
+CPU both servers are bound by the same core, and workers beyond it cost throughput. With
+the defaults below on one CPU, the dev server served 92 req/s, gunicorn 1x16 88 req/s and
+gunicorn 4x16 67 req/s, with twice the p95 latency. gunicorn.conf.py therefore starts one
+worker per CPU; gunicorn's gain is in using several CPUs, and in its process management.
+
+Listeners are seeded far in the future, so no agent runs during the measurement.
+
+Usage:
+    python bench_http.py [--requests 3000] [--clients 16] [--workers N] [--threads 16] [--listeners 5000]
+                         [--db-latency 0.02]
+"""
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from bench_load import summarize
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Request paths, sent round-robin by every client
+REQUEST_MIX = (
+    "/manage-listeners?limit=100",
+    "/manage-listeners?limit=100&status=pending&fields=id,status,next_trigger_at",
+    "/manage-listeners?limit=500&user_id=user-3",
+    "/manage-listeners?limit=20&user_id=user-7&fields=id,status",
+)
+
+
+def create_bench_app():
+    """App factory for the benchmark servers: the real app over seeded fakes."""
+    from fakes import FakeEmailProvider, FakeScrapybara, FakeSupabase
+    from server import create_app
+
+    listeners = int(os.getenv("BENCH_LISTENERS", "5000"))
+    db_latency = float(os.getenv("BENCH_DB_LATENCY", "0"))
+    next_trigger_at = (datetime.now(timezone.utc) + timedelta(days=365)).isoformat()
+    rows = [
+        {
+            "id": index,
+            "event": f"Check whether item {index} is back in stock",
+            "url": f"https://shop.example.com/items/{index}",
+            "interval": "1-day",
+            "notification_type": "email",
+            "status": "pending",
+            "trigger_status": "pending",
+            "last_triggered_at": None,
+            "next_trigger_at": next_trigger_at,
+            "user_id": f"user-{index % 100}",
+            "retry_count": 0,
+            "max_retries": 3,
+        }
+        for index in range(1, listeners + 1)
+    ]
+    return create_app(
+        supabase_client=FakeSupabase(latency=db_latency, tables={"event_listeners": rows}),
+        email_provider=FakeEmailProvider(),
+        scrapybara_client=FakeScrapybara(),
+    )
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, port, args):
+    env = dict(
+        os.environ,
+        BENCH_LISTENERS=str(args.listeners),
+        BENCH_DB_LATENCY=str(args.db_latency),
+        CLAUDE_API_KEY=os.getenv("CLAUDE_API_KEY", "bench"),
+        INSTANCE_POOL_WARM_SPARES="0",
+        PRECHECK_ENABLED="false",
+    )
+    if kind == "gunicorn":
+        env["LEADER_LOCK_PATH"] = os.path.join(tempfile.mkdtemp(), "leader.lock")
+        command = [
+            sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+            "--bind", f"127.0.0.1:{port}", "--workers", str(args.workers), "--threads", str(args.threads),
+            "--log-level", "warning", "bench_http:create_bench_app()",
+        ]
+    else:
+        command = [
+            sys.executable, "-c",
+            f"import bench_http; bench_http.create_bench_app().run(host='127.0.0.1', port={port}, threaded=True)",
+        ]
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_until_ready(port, process)
+    return process
+
+
+def wait_until_ready(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            get(port, "/manage-listeners?limit=1")
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("Server did not start in time")
+
+
+def get(port, path):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def run_client(port, client_index, requests):
+    """Send ``requests`` requests one after another. Returns their latencies and the error count."""
+    latencies, errors = [], 0
+    for index in range(requests):
+        path = REQUEST_MIX[(client_index + index) % len(REQUEST_MIX)]
+        started = time.perf_counter()
+        try:
+            status = get(port, path)
+        except OSError:
+            status = None
+        latencies.append(time.perf_counter() - started)
+        errors += status != 200
+    return latencies, errors
+
+
+def measure(kind, args):
+    port = free_port()
+    process = start_server(kind, port, args)
+    try:
+        # Warm up every worker before measuring
+        run_client(port, 0, 5 * args.workers)
+        per_client = args.requests // args.clients
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.clients) as pool:
+            results = list(pool.map(run_client, [port] * args.clients, range(args.clients), [per_client] * args.clients))
+        elapsed = time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+    latencies = [latency for client_latencies, _ in results for latency in client_latencies]
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors for _, errors in results),
+        "requests_per_second": len(latencies) / elapsed,
+        "latency_seconds": summarize(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--clients", type=int, default=16, help="concurrent client processes")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="gunicorn worker processes; defaults to the CPUs"
+    )
+    parser.add_argument("--threads", type=int, default=16, help="threads per gunicorn worker")
+    parser.add_argument("--listeners", type=int, default=5000, help="rows seeded in the fake listener table")
+    parser.add_argument("--db-latency", type=float, default=0.02, help="seconds per fake Supabase query")
+    args = parser.parse_args()
+
+    print(f"{args.requests} requests from {args.clients} clients, {os.cpu_count()} CPUs")
+    for kind, label in (("dev", "flask dev server"), ("gunicorn", f"gunicorn {args.workers}x{args.threads}")):
+        result = measure(kind, args)
+        latency = result["latency_seconds"]
+        print(
+            f"{label:<22} {result['requests_per_second']:8.1f} req/s  "
+            f"p50 {latency['p50'] * 1000:7.1f} ms  p95 {latency['p95'] * 1000:7.1f} ms  "
+            f"p99 {latency['p99'] * 1000:7.1f} ms  errors {result['errors']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""
+Load-test the listener pipeline offline, from /trigger to each listener's final status.
+
+Scrapybara, the Anthropic messages endpoint, Supabase and Resend are replaced by the
+fakes in fakes.py, each with its own latency and failure rate. The app is built by
+``server.create_app`` over the fakes, and synthetic listeners are posted to /trigger
+through Flask's test client by a few client threads, so the real scheduler, worker pool,
+agent loop, status writer and notification dispatcher process them. Requests shed with a
+429 are retried after a short pause, as the extension would. Listeners are seen to finish
+on the app's /listener-events stream.
+
+Reported: end-to-end latency per listener (from its /trigger request to its 'completed'
+or 'failed' status) and /trigger latency at p50/p95/p99, throughput, peak RSS, peak
+thread count and the components' counters. ``--json`` also writes the report to a file
+so runs before and after a change can be compared.
+
+With ``--pages`` several listeners watch each page, and ``--batch-window`` lets the ones
+on the same page share an agent session; compare 'model_requests' with and without it.
+
+The HTTP pre-check would fetch real pages, so it is turned off. Settings that are read
+from the environment at import time are set before the backend is imported.
+
+Usage:
+    python bench_load.py [--listeners 2000] [--concurrency 50] [--model-latency 0.2]
+                         [--model-failure-rate 0.02] [--vm-action-delay 0.05] [--pages 100]
+                         [--batch-window 0.5] [--json report.json]
+"""
+import argparse
+import json
+import os
+import queue
+import resource
+import sys
+import threading
+import time
+
+from fakes import FakeEmailProvider, FakeMessagesServer, FakeScrapybara, FakeSupabase
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers, or None if it is empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values, default=None),
+    }
+
+
+class CompletionTracker:
+    """
+    Notes when each listener reaches a final status, from the app's /listener-events stream.
+
+    The stream is read from a background thread until the app shuts down and closes it.
+    """
+
+    def __init__(self):
+        self.finished_at = {}
+        self.statuses = {}
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def follow(self, client):
+        """Subscribe to every user's events and start reading them. Returns once subscribed."""
+        subscribed = queue.Queue()
+
+        def read():
+            response = client.get("/listener-events", buffered=False)
+            subscribed.put(response.status_code)
+            for frame in response.response:
+                self._read_frame(frame.decode("utf-8") if isinstance(frame, bytes) else frame)
+
+        self._thread = threading.Thread(target=read, name="completion-tracker", daemon=True)
+        self._thread.start()
+        if subscribed.get() != 200:
+            raise RuntimeError("Could not subscribe to /listener-events")
+
+    def _read_frame(self, frame):
+        fields = dict(line.split(": ", 1) for line in frame.splitlines() if ": " in line and not line.startswith(":"))
+        if fields.get("event") != "status":
+            return
+        data = json.loads(fields["data"])
+        if data.get("status") not in ("completed", "failed"):
+            return
+        with self._condition:
+            self.finished_at.setdefault(data["listener_id"], time.perf_counter())
+            self.statuses[data["listener_id"]] = data["status"]
+            self._condition.notify_all()
+
+    def wait_for(self, count, timeout):
+        """Wait until ``count`` listeners have finished. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while len(self.finished_at) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+
+class ThreadSampler:
+    """Samples the process's thread count from a background thread and keeps the peak."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="thread-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+
+def configure_environment(args, model_base_url):
+    """Set the settings Config reads at import time."""
+    os.environ.update({
+        "CLAUDE_API_KEY": os.getenv("CLAUDE_API_KEY", "bench"),
+        "SCRAPYBARA_API_KEY": os.getenv("SCRAPYBARA_API_KEY", "bench"),
+        "ANTHROPIC_BASE_URL": model_base_url,
+        "PRECHECK_ENABLED": "false",
+        "WORKER_CONCURRENCY": str(args.concurrency),
+        "WORKER_QUEUE_SIZE": str(args.queue_size),
+        "WORKER_RETRY_AFTER": "1",
+        "INSTANCE_POOL_MAX_SIZE": str(args.vms or args.concurrency),
+        "INSTANCE_POOL_WARM_SPARES": str(args.vms or args.concurrency),
+        "STATUS_WRITER_FLUSH_INTERVAL": str(args.flush_interval),
+        "NOTIFICATION_POLL_INTERVAL": "1",
+        "NOTIFICATION_COALESCE_WINDOW": "0",
+        "METRICS_ENABLED": "true" if args.metrics else "false",
+        "LISTENER_BATCH_WINDOW": str(args.batch_window),
+        "LISTENER_BATCH_MAX_SIZE": str(args.batch_max_size),
+        # The completion tracker must never be dropped as a slow subscriber
+        "STATUS_EVENTS_BUFFER_SIZE": str(max(256, 8 * args.listeners)),
+        "SHUTDOWN_TIMEOUT": "5",
+    })
+
+
+def drive_triggers(client_factory, listeners, clients, retry_pause):
+    """
+    Post every listener to /trigger from ``clients`` threads.
+
+    Returns:
+        tuple: ``{listener_id: request start}``, /trigger latencies, 429 count and error count.
+    """
+    started_at, trigger_seconds = {}, []
+    counters = {"shed": 0, "errors": 0}
+    lock = threading.Lock()
+    pending = iter(listeners)
+
+    def post_all():
+        client = client_factory()
+        while True:
+            with lock:
+                payload = next(pending, None)
+            if payload is None:
+                return
+            request_started = time.perf_counter()
+            while True:
+                sent_at = time.perf_counter()
+                response = client.post("/trigger", json=payload)
+                if response.status_code != 429:
+                    break
+                with lock:
+                    counters["shed"] += 1
+                time.sleep(retry_pause)
+            with lock:
+                trigger_seconds.append(time.perf_counter() - sent_at)
+                if response.status_code == 200:
+                    started_at[response.get_json()["listener_id"]] = request_started
+                else:
+                    counters["errors"] += 1
+
+    threads = [threading.Thread(target=post_all, name=f"bench-client-{index}") for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return started_at, trigger_seconds, counters["shed"], counters["errors"]
+
+
+def run(args):
+    model = FakeMessagesServer(
+        tool_turns=args.tool_turns,
+        latency=args.model_latency,
+        failure_rate=args.model_failure_rate,
+        positive_rate=args.positive_rate,
+    ).start()
+    configure_environment(args, model.base_url)
+
+    # Imported only now, so Config sees the settings above
+    import logging
+
+    import metrics
+    from server import create_app
+
+    logging.getLogger().setLevel(args.log_level)
+
+    supabase = FakeSupabase(latency=args.db_latency, failure_rate=args.db_failure_rate)
+    scrapybara = FakeScrapybara(
+        start_delay=args.vm_start_delay,
+        action_delay=args.vm_action_delay,
+        failure_rate=args.vm_failure_rate,
+    )
+    email_provider = FakeEmailProvider(latency=args.email_latency, failure_rate=args.email_failure_rate)
+    app = create_app(supabase_client=supabase, email_provider=email_provider, scrapybara_client=scrapybara)
+    tracker = CompletionTracker()
+    tracker.follow(app.test_client())
+
+    listeners = [
+        {
+            "event": f"Check whether item {index % args.distinct_events} is back in stock",
+            "url": f"https://shop.example.com/items/{index % (args.pages or args.listeners)}",
+            "interval": "1-day",
+            "notificationType": "email",
+            "userId": f"user-{index % args.users}",
+        }
+        for index in range(args.listeners)
+    ]
+
+    sampler = ThreadSampler()
+    sampler.start()
+    started = time.perf_counter()
+    started_at, trigger_seconds, shed, trigger_errors = drive_triggers(
+        app.test_client, listeners, args.clients, args.retry_pause
+    )
+    tracker.wait_for(len(started_at), args.timeout)
+    elapsed = time.perf_counter() - started
+    sampler.stop()
+
+    app.extensions["shutdown"]()
+    model.stop()
+    components = metrics.REGISTRY.collect()
+
+    end_to_end = [tracker.finished_at[listener_id] - at for listener_id, at in started_at.items()
+                  if listener_id in tracker.finished_at]
+    statuses = list(tracker.statuses.values())
+    return {
+        "settings": vars(args),
+        "listeners": {
+            "accepted": len(started_at),
+            "trigger_errors": trigger_errors,
+            "shed_429": shed,
+            "completed": statuses.count("completed"),
+            "failed": statuses.count("failed"),
+            "unfinished": len(started_at) - len(end_to_end),
+        },
+        "elapsed_seconds": elapsed,
+        "throughput_per_second": len(end_to_end) / elapsed if elapsed else 0.0,
+        "end_to_end_seconds": summarize(end_to_end),
+        "trigger_seconds": summarize(trigger_seconds),
+        # ru_maxrss is in KiB on Linux and bytes on macOS
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024),
+        "peak_threads": sampler.peak,
+        "fakes": {
+            "model_requests": len(model.requests),
+            "vms_started": len(scrapybara.instances),
+            "supabase_queries": len(supabase.calls),
+            "email_batches": len(email_provider.batches),
+            "emails_sent": len(email_provider.sent),
+        },
+        "worker": components["worker"],
+        "status_writer": components["status_writer"],
+        "notifications": components["notifications"],
+        "batching": components.get("batching", {}),
+    }
+
+
+def print_report(report):
+    listeners = report["listeners"]
+    print(
+        f"{listeners['accepted']} listeners accepted ({listeners['shed_429']} 429s retried, "
+        f"{listeners['trigger_errors']} errors): {listeners['completed']} completed, "
+        f"{listeners['failed']} failed, {listeners['unfinished']} unfinished"
+    )
+    print(f"elapsed {report['elapsed_seconds']:.1f}s  throughput {report['throughput_per_second']:.1f} listeners/s")
+    for name in ("end_to_end_seconds", "trigger_seconds"):
+        stats = report[name]
+        if not stats["count"]:
+            continue
+        print(
+            f"{name:<20} p50 {stats['p50'] * 1000:9.1f} ms  p95 {stats['p95'] * 1000:9.1f} ms  "
+            f"p99 {stats['p99'] * 1000:9.1f} ms  max {stats['max'] * 1000:9.1f} ms"
+        )
+    print(f"peak RSS {report['peak_rss_mib']:.1f} MiB  peak threads {report['peak_threads']}")
+    for name in ("fakes", "worker", "status_writer", "notifications", "batching"):
+        print(f"{name:<14} " + "  ".join(f"{key}={value}" for key, value in report[name].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--listeners", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--distinct-events", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=0, help="distinct URLs watched; defaults to one per listener")
+    parser.add_argument("--batch-window", type=float, default=0, help="seconds to group listeners on the same page")
+    parser.add_argument("--batch-max-size", type=int, default=8)
+    parser.add_argument("--clients", type=int, default=8, help="threads posting to /trigger")
+    parser.add_argument("--retry-pause", type=float, default=0.05, help="seconds before retrying a 429")
+    parser.add_argument("--concurrency", type=int, default=50, help="worker pool size")
+    parser.add_argument("--queue-size", type=int, default=100)
+    parser.add_argument("--vms", type=int, default=0, help="instance pool size; defaults to --concurrency")
+    parser.add_argument("--tool-turns", type=int, default=2)
+    parser.add_argument("--positive-rate", type=float, default=0.1)
+    parser.add_argument("--model-latency", type=float, default=0.2)
+    parser.add_argument("--model-failure-rate", type=float, default=0.02)
+    parser.add_argument("--vm-start-delay", type=float, default=0.0)
+    parser.add_argument("--vm-action-delay", type=float, default=0.05)
+    parser.add_argument("--vm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--db-latency", type=float, default=0.01)
+    parser.add_argument("--db-failure-rate", type=float, default=0.0)
+    parser.add_argument("--email-latency", type=float, default=0.05)
+    parser.add_argument("--email-failure-rate", type=float, default=0.0)
+    parser.add_argument("--flush-interval", type=float, default=1.0, help="status writer flush interval")
+    parser.add_argument("--metrics", action="store_true", help="record spans and counters during the run")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for listeners to finish")
+    parser.add_argument("--log-level", default="ERROR")
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(report, output, indent=2)
+    return 0 if not report["listeners"]["unfinished"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
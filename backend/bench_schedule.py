@@ -0,0 +1,182 @@
+"""
+Simulate a synthetic listener population under fixed intervals and under the scheduling policy.
+
+Listeners are created in a few bursts, as after a launch or a shared link, with the
+interval mix users pick from the extension. Each page changes at random, most rarely and
+some often, and a change is positive now and then. A check of an unchanged page is a
+quick pre-check; a changed page runs the agent. Every listener is rescheduled when its
+check finishes, exactly as ``ListenerScheduler.reschedule`` does: with
+``calculate_next_trigger_time`` for fixed intervals, or with a ``SchedulingPolicy`` fed
+the outcome 'last_outcome' would hold. A share of listeners has interval bounds, from half
+to four times their interval, for the policy to adapt within.
+
+Checks run without a worker limit, so concurrency is what the schedule asks of the VMs
+and model. Each listener's first check runs on creation under either schedule and is
+left out of the figures.
+
+Reported per schedule: checks and agent runs, peak and 99th percentile concurrency, the
+most checks starting in one minute, and how long after a page changed a check saw it.
+
+Usage:
+    python bench_schedule.py [--listeners 5000] [--days 3] [--bursts 4] [--bounded-share 0.5]
+                             [--max-starts-per-minute 25] [--jitter 0.1] [--seed 1]
+"""
+import argparse
+import heapq
+import random
+from datetime import datetime, timedelta, timezone
+
+from bench_load import summarize
+from scheduling_policy import SchedulingPolicy
+from utils import calculate_next_trigger_time, parse_interval
+
+# Intervals and how often users pick them
+INTERVAL_MIX = (("30-minutes", 0.1), ("1-hour", 0.2), ("12-hours", 0.15), ("1-day", 0.4), ("1-week", 0.15))
+
+
+def build_population(args, start):
+    rng = random.Random(args.seed)
+    bursts = [start + timedelta(hours=rng.uniform(0, 24)) for _ in range(args.bursts)]
+    intervals, weights = zip(*INTERVAL_MIX)
+    population = []
+    for index in range(1, args.listeners + 1):
+        if rng.random() < args.burst_share:
+            created = rng.choice(bursts) + timedelta(seconds=rng.uniform(0, 60))
+        else:
+            created = start + timedelta(seconds=rng.uniform(0, 24 * 3600))
+        interval = rng.choices(intervals, weights)[0]
+        minutes = int(parse_interval(interval).total_seconds() // 60)
+        bounded = rng.random() < args.bounded_share
+        volatile = rng.random() < args.volatile_share
+        population.append({
+            "id": index,
+            "url": f"https://shop{index}.example/",
+            "interval": interval,
+            "min_interval": f"{max(minutes // 2, 1)}-minutes" if bounded else None,
+            "max_interval": f"{minutes * 4}-minutes" if bounded else None,
+            "created": created,
+            # Mean seconds between page changes
+            "change_every": args.volatile_change_hours * 3600 if volatile else args.static_change_days * 86400,
+        })
+    return population
+
+
+def simulate(population, args, policy=None):
+    """Run every listener's checks until ``args.days`` have passed. Returns the measurements."""
+    rng = random.Random(args.seed + 1)
+    end = min(listener["created"] for listener in population) + timedelta(days=args.days)
+    listeners = {listener["id"]: dict(listener) for listener in population}
+    next_change = {
+        listener_id: listener["created"] + timedelta(seconds=rng.expovariate(1 / listener["change_every"]))
+        for listener_id, listener in listeners.items()
+    }
+    queue = [(listener["created"], listener_id, True) for listener_id, listener in listeners.items()]
+    heapq.heapify(queue)
+
+    runs, detection_delays, positives = [], [], 0
+    while queue:
+        started, listener_id, first = heapq.heappop(queue)
+        if started >= end:
+            break
+        listener = listeners[listener_id]
+        changed_at = next_change[listener_id]
+        changed = changed_at <= started
+        positive = changed and rng.random() < args.positive_rate
+        if changed:
+            next_change[listener_id] = started + timedelta(seconds=rng.expovariate(1 / listener["change_every"]))
+            if not first:
+                detection_delays.append((started - changed_at).total_seconds())
+            positives += positive
+        duration = args.agent_seconds if changed or first else args.precheck_seconds
+        finished = started + timedelta(seconds=duration)
+        if not first:
+            runs.append((started.timestamp(), finished.timestamp(), changed))
+
+        if policy is None:
+            next_run = calculate_next_trigger_time(listener["interval"], now=finished)
+        else:
+            listener["last_outcome"] = "positive" if positive else "changed" if changed else "unchanged"
+            next_run, fields = policy.next_trigger_time(listener, finished)
+            listener.update(fields)
+        heapq.heappush(queue, (next_run, listener_id, False))
+
+    return measure(runs, detection_delays, positives)
+
+
+def measure(runs, detection_delays, positives):
+    # Concurrency is sampled at every start, where it peaks
+    edges = sorted([(start, 1) for start, _, _ in runs] + [(finish, -1) for _, finish, _ in runs])
+    running, samples = 0, []
+    for _, step in edges:
+        running += step
+        if step > 0:
+            samples.append(running)
+    starts_per_minute = {}
+    for start, _, _ in runs:
+        starts_per_minute[int(start // 60)] = starts_per_minute.get(int(start // 60), 0) + 1
+    concurrency = summarize(samples) if samples else {"p99": 0, "max": 0}
+    return {
+        "checks": len(runs),
+        "agent_runs": sum(1 for _, _, changed in runs if changed),
+        "peak_concurrency": concurrency["max"],
+        "p99_concurrency": concurrency["p99"],
+        "peak_starts_per_minute": max(starts_per_minute.values(), default=0),
+        "detection_seconds": summarize(detection_delays) if detection_delays else None,
+        "positives": positives,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--listeners", type=int, default=5000)
+    parser.add_argument("--days", type=float, default=3, help="simulated time")
+    parser.add_argument("--bursts", type=int, default=4, help="minutes in which most listeners are created")
+    parser.add_argument("--burst-share", type=float, default=0.7, help="fraction of listeners created in bursts")
+    parser.add_argument("--bounded-share", type=float, default=0.5, help="fraction of listeners with interval bounds")
+    parser.add_argument("--volatile-share", type=float, default=0.2, help="fraction of pages that change often")
+    parser.add_argument(
+        "--volatile-change-hours", type=float, default=2, help="mean hours between changes of volatile pages"
+    )
+    parser.add_argument("--static-change-days", type=float, default=7, help="mean days between changes of other pages")
+    parser.add_argument("--positive-rate", type=float, default=0.05, help="fraction of changes that are positive")
+    parser.add_argument("--precheck-seconds", type=float, default=2, help="length of a check of an unchanged page")
+    parser.add_argument("--agent-seconds", type=float, default=90, help="length of a check that runs the agent")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--growth", type=float, default=1.5)
+    parser.add_argument("--shrink", type=float, default=0.5)
+    parser.add_argument("--max-starts-per-minute", type=int, default=25, help="0 is unlimited")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    population = build_population(args, start)
+    schedules = (
+        ("fixed intervals", None),
+        ("policy, no cap", SchedulingPolicy(jitter=args.jitter, growth=args.growth, shrink=args.shrink)),
+        ("policy", SchedulingPolicy(
+            jitter=args.jitter, growth=args.growth, shrink=args.shrink,
+            max_starts_per_slot=args.max_starts_per_minute or None,
+        )),
+    )
+    print(
+        f"{args.listeners} listeners over {args.days:g} days, {args.burst_share:.0%} created in {args.bursts} bursts, "
+        f"{args.bounded_share:.0%} with interval bounds; first checks left out"
+    )
+    print(
+        f"{'schedule':<18}{'checks':>9}{'agent runs':>12}{'peak conc':>11}{'p99 conc':>10}"
+        f"{'peak starts/min':>17}{'detect p50':>12}{'detect p95':>12}{'positives':>11}"
+    )
+    for label, policy in schedules:
+        result = simulate(population, args, policy)
+        detection = result["detection_seconds"] or {"p50": 0, "p95": 0}
+        print(
+            f"{label:<18}{result['checks']:>9}{result['agent_runs']:>12}{result['peak_concurrency']:>11.0f}"
+            f"{result['p99_concurrency']:>10.0f}{result['peak_starts_per_minute']:>17}"
+            f"{detection['p50'] / 60:>10.0f}m{detection['p95'] / 60:>11.0f}m{result['positives']:>11}"
+        )
+        if policy is not None:
+            print(f"{'':<18}{policy.metrics()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+from config import Config
+
+# Optional per-listener overrides of the agent budget; null columns use the Config defaults
+BUDGET_COLUMNS = ("agent_max_turns", "agent_max_tokens", "agent_max_screenshots", "agent_max_seconds")
+
+
+class AgentBudget:
+    """
+    Limits for one agent session. A limit of None is unlimited.
+
+    Args:
+        max_turns (int, optional): Model requests.
+        max_tokens (int, optional): Input (cached or not) plus output tokens over all requests.
+        max_screenshots (int, optional): Screenshots returned by tools.
+        max_seconds (float, optional): Wall-clock time; in-flight tool calls are cancelled when it runs out.
+    """
+
+    def __init__(self, max_turns=None, max_tokens=None, max_screenshots=None, max_seconds=None):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.max_screenshots = max_screenshots
+        self.max_seconds = max_seconds
+
+    @classmethod
+    def default(cls):
+        """The budget configured for every listener."""
+        return cls(
+            max_turns=Config.AGENT_MAX_TURNS,
+            max_tokens=Config.AGENT_MAX_TOKENS,
+            max_screenshots=Config.AGENT_MAX_SCREENSHOTS,
+            max_seconds=Config.AGENT_MAX_SECONDS,
+        )
+
+    @classmethod
+    def for_listener(cls, listener):
+        """The default budget with any overrides set on the listener row."""
+        budget = cls.default()
+        for column in BUDGET_COLUMNS:
+            if listener.get(column) is not None:
+                setattr(budget, column[len("agent_"):], listener[column])
+        return budget
+
+    @classmethod
+    def for_listeners(cls, listeners):
+        """The budget for one session checking several listeners: the most generous of theirs."""
+        budgets = [cls.for_listener(listener) for listener in listeners]
+        budget = cls()
+        for column in BUDGET_COLUMNS:
+            limit = column[len("agent_"):]
+            values = [getattr(each, limit) for each in budgets]
+            setattr(budget, limit, None if None in values else max(values))
+        return budget
+
+    def exhausted(self, stats):
+        """
+        Check whether a session has used up a countable limit.
+
+        Args:
+            stats (SessionStats): The session's usage so far.
+
+        Returns:
+            str or None: 'turns', 'tokens' or 'screenshots' if that limit is reached.
+        """
+        if self.max_turns is not None and len(stats.turns) >= self.max_turns:
+            return "turns"
+        if self.max_tokens is not None and stats.total_tokens >= self.max_tokens:
+            return "tokens"
+        if self.max_screenshots is not None and stats.screenshots >= self.max_screenshots:
+            return "screenshots"
+        return None
+
+    def to_dict(self):
+        return {
+            "max_turns": self.max_turns,
+            "max_tokens": self.max_tokens,
+            "max_screenshots": self.max_screenshots,
+            "max_seconds": self.max_seconds,
+        }
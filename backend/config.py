@@ -9,3 +9,110 @@ class Config:
     SUPABASE_URL = os.getenv("SUPABASE_URL")
     SUPABASE_KEY = os.getenv("SUPABASE_KEY")
     RESEND_API_KEY = os.getenv("RESEND_API_KEY")
+
+    # Worker pool sizing; keep concurrency within VM and model API quotas
+    WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+    WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "100"))
+    WORKER_RETRY_AFTER = int(os.getenv("WORKER_RETRY_AFTER", "30"))
+
+    # Due listeners wait up to LISTENER_BATCH_WINDOW seconds for others on the same page due by
+    # then, and each group is checked in one agent session; a listener no other will join is
+    # dispatched at once. 0 checks every listener on its own
+    LISTENER_BATCH_WINDOW = float(os.getenv("LISTENER_BATCH_WINDOW", "2"))
+    LISTENER_BATCH_MAX_SIZE = int(os.getenv("LISTENER_BATCH_MAX_SIZE", "8"))
+
+    # Multi-process serving; with a lock path, only the process holding the lock runs the
+    # scheduler and worker pool, and the others pick up their status changes by polling
+    LEADER_LOCK_PATH = os.getenv("LEADER_LOCK_PATH") or None
+    LEADER_RETRY_INTERVAL = float(os.getenv("LEADER_RETRY_INTERVAL", "5"))
+    SCHEDULER_SYNC_INTERVAL = float(os.getenv("SCHEDULER_SYNC_INTERVAL", "2"))
+    STATUS_POLL_INTERVAL = float(os.getenv("STATUS_POLL_INTERVAL", "2"))
+    # /metrics and /worker-metrics describe the process running listeners, so with a lock path
+    # only the leader answers them; it also serves them on METRICS_BIND ('host:port') when set
+    METRICS_BIND = os.getenv("METRICS_BIND") or None
+    # Lease-based claiming, so several nodes can share the listener table; a claim lasts
+    # LISTENER_LEASE_SECONDS unless heartbeats extend it, then other nodes may reclaim it.
+    # Needs migrations/007_listener_leases.sql
+    LISTENER_LEASES_ENABLED = os.getenv("LISTENER_LEASES_ENABLED", "false").lower() == "true"
+    LISTENER_LEASE_SECONDS = float(os.getenv("LISTENER_LEASE_SECONDS", "120"))
+    LISTENER_HEARTBEAT_INTERVAL = float(os.getenv("LISTENER_HEARTBEAT_INTERVAL", "30"))
+    # Scheduling policy. Each run moves by up to SCHEDULE_JITTER of its interval, deterministically per
+    # page and interval; listeners with interval bounds check more often after changes and positive results
+    # and less often while their page stays the same. At most SCHEDULE_MAX_STARTS_PER_MINUTE starts are
+    # booked in any minute, the listeners on one page sharing a start (0 is unlimited); the default assumes runs average 30 seconds, pre-check
+    # skips included, so the schedule stays within WORKER_CONCURRENCY
+    SCHEDULE_JITTER = float(os.getenv("SCHEDULE_JITTER", "0.1"))
+    SCHEDULE_INTERVAL_GROWTH = float(os.getenv("SCHEDULE_INTERVAL_GROWTH", "1.5"))
+    SCHEDULE_INTERVAL_SHRINK = float(os.getenv("SCHEDULE_INTERVAL_SHRINK", "0.5"))
+    SCHEDULE_MAX_STARTS_PER_MINUTE = int(os.getenv("SCHEDULE_MAX_STARTS_PER_MINUTE", str(WORKER_CONCURRENCY * 2)))
+    # Seconds to wait for running listeners on shutdown; keep above AGENT_MAX_SECONDS
+    SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "330"))
+
+    # Scrapybara instance pool; each running listener leases its own VM
+    INSTANCE_POOL_MAX_SIZE = int(os.getenv("INSTANCE_POOL_MAX_SIZE", str(WORKER_CONCURRENCY)))
+    INSTANCE_POOL_WARM_SPARES = int(os.getenv("INSTANCE_POOL_WARM_SPARES", "1"))
+    INSTANCE_POOL_IDLE_TIMEOUT = int(os.getenv("INSTANCE_POOL_IDLE_TIMEOUT", "600"))
+    INSTANCE_POOL_ACQUIRE_TIMEOUT = int(os.getenv("INSTANCE_POOL_ACQUIRE_TIMEOUT", "300"))
+
+    # HTTP pre-check; the agent only runs when the page content changed
+    PRECHECK_ENABLED = os.getenv("PRECHECK_ENABLED", "true").lower() == "true"
+    PRECHECK_TIMEOUT = float(os.getenv("PRECHECK_TIMEOUT", "10"))
+
+    # Agent result cache; the TTL must stay below the shortest listener interval (30 minutes)
+    RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "600"))
+    RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024"))
+    RESULT_CACHE_PERSISTENT = os.getenv("RESULT_CACHE_PERSISTENT", "false").lower() == "true"
+
+    # Write-behind buffer for listener status updates
+    STATUS_WRITER_BATCH_SIZE = int(os.getenv("STATUS_WRITER_BATCH_SIZE", "100"))
+    STATUS_WRITER_FLUSH_INTERVAL = float(os.getenv("STATUS_WRITER_FLUSH_INTERVAL", "1.0"))
+
+    # Server-sent status events; slow subscribers are dropped once their buffer fills
+    STATUS_EVENTS_BUFFER_SIZE = int(os.getenv("STATUS_EVENTS_BUFFER_SIZE", "256"))
+    STATUS_EVENTS_HISTORY_SIZE = int(os.getenv("STATUS_EVENTS_HISTORY_SIZE", "10000"))
+    STATUS_EVENTS_HEARTBEAT = float(os.getenv("STATUS_EVENTS_HEARTBEAT", "15"))
+
+    # Notifications; positive results to one recipient within the coalesce window go out as one digest
+    NOTIFICATION_EMAIL = os.getenv("NOTIFICATION_EMAIL", "karandikarshreyash@gmail.com")
+    NOTIFICATION_SENDER = os.getenv("NOTIFICATION_SENDER", "onboarding@resend.dev")
+    NOTIFICATION_RATE_LIMIT = float(os.getenv("NOTIFICATION_RATE_LIMIT", "2"))
+    NOTIFICATION_COALESCE_WINDOW = float(os.getenv("NOTIFICATION_COALESCE_WINDOW", "60"))
+    NOTIFICATION_MAX_ATTEMPTS = int(os.getenv("NOTIFICATION_MAX_ATTEMPTS", "5"))
+    NOTIFICATION_POLL_INTERVAL = float(os.getenv("NOTIFICATION_POLL_INTERVAL", "5"))
+
+    # Model API; point ANTHROPIC_BASE_URL at a local mock of the messages endpoint for testing
+    ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL") or None
+    MODEL_MAX_RETRIES = int(os.getenv("MODEL_MAX_RETRIES", "5"))
+    PROMPT_CACHING = os.getenv("PROMPT_CACHING", "true").lower() == "true"
+
+    # Default agent budget per listener check; listeners can override each limit
+    AGENT_MAX_TURNS = int(os.getenv("AGENT_MAX_TURNS", "25"))
+    AGENT_MAX_TOKENS = int(os.getenv("AGENT_MAX_TOKENS", "400000"))
+    AGENT_MAX_SCREENSHOTS = int(os.getenv("AGENT_MAX_SCREENSHOTS", "30"))
+    AGENT_MAX_SECONDS = float(os.getenv("AGENT_MAX_SECONDS", "300"))
+    # Times a session moves to a fresh VM when its VM fails, keeping its conversation and budget
+    AGENT_MAX_INSTANCE_RESTARTS = int(os.getenv("AGENT_MAX_INSTANCE_RESTARTS", "1"))
+
+    # Replay the tool calls of a listener's last successful check and ask the model only for the
+    # verdict; a replayed screenshot differing from the recorded one by more than the threshold
+    # (mean pixel difference, 0 to 1) falls back to the full agent. Recordings expire after
+    # TRAJECTORY_MAX_AGE seconds. Needs migrations/008_listener_trajectories.sql
+    TRAJECTORY_REPLAY_ENABLED = os.getenv("TRAJECTORY_REPLAY_ENABLED", "false").lower() == "true"
+    TRAJECTORY_DIVERGENCE_THRESHOLD = float(os.getenv("TRAJECTORY_DIVERGENCE_THRESHOLD", "0.1"))
+    TRAJECTORY_STEP_DELAY = float(os.getenv("TRAJECTORY_STEP_DELAY", "1"))
+    TRAJECTORY_MAX_AGE = int(os.getenv("TRAJECTORY_MAX_AGE", str(7 * 24 * 3600)))
+
+    # Listener runs that fail transiently are retried up to the listener's max_retries, with backoff
+    LISTENER_RETRY_BASE_DELAY = float(os.getenv("LISTENER_RETRY_BASE_DELAY", "30"))
+    LISTENER_RETRY_MAX_DELAY = float(os.getenv("LISTENER_RETRY_MAX_DELAY", "1800"))
+
+    # Screenshots kept in the agent's history, optionally re-encoded as JPEG to cut memory and payload size
+    SCREENSHOTS_TO_KEEP = int(os.getenv("SCREENSHOTS_TO_KEEP", "2"))
+    SCREENSHOT_JPEG_QUALITY = int(os.getenv("SCREENSHOT_JPEG_QUALITY")) if os.getenv("SCREENSHOT_JPEG_QUALITY") else None
+
+    # Prometheus metrics at /metrics, and an optional per-listener span trace stored on the row
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    LISTENER_TRACE_ENABLED = os.getenv("LISTENER_TRACE_ENABLED", "false").lower() == "true"
+
+    # Write every agent screenshot to this directory for debugging; unset on servers
+    SCREENSHOT_DIR = os.getenv("SCREENSHOT_DIR") or None
@@ -0,0 +1,256 @@
+import base64
+from collections import deque
+from io import BytesIO
+
+from metrics import span
+
+# Marks the end of a request prefix the API should cache
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+class Screenshot:
+    """
+    A screenshot held as the base64 string the computer tool returned.
+
+    Requests carry images as base64, so keeping the string means a screenshot is never
+    decoded or encoded again for each request that includes it; only re-encoding with
+    ``reencode_screenshot`` decodes it.
+    """
+
+    __slots__ = ("data", "media_type")
+
+    def __init__(self, data, media_type="image/png"):
+        self.data = data
+        self.media_type = media_type
+
+    @classmethod
+    def from_base64(cls, base64_image):
+        # JPEG data starts with FF D8, which encodes as '/9j/'; everything else is taken as PNG
+        media_type = "image/jpeg" if base64_image.startswith("/9j/") else "image/png"
+        return cls(base64_image, media_type)
+
+    @property
+    def size(self):
+        """The decoded image size in bytes."""
+        return len(self.data) * 3 // 4 - self.data.count("=", -2)
+
+    def to_param(self):
+        return {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": self.media_type,
+                "data": self.data,
+            },
+        }
+
+
+def reencode_screenshot(screenshot, max_size=None, jpeg_quality=None):
+    """
+    Downscale and/or re-encode a screenshot as JPEG to shrink memory and request size.
+
+    Downscaling changes the coordinate space the model sees, so only use ``max_size``
+    when the computer tool is configured with the same display size.
+
+    Args:
+        screenshot (Screenshot): The screenshot to shrink.
+        max_size (tuple[int, int], optional): The largest width and height to keep.
+        jpeg_quality (int, optional): Re-encode as JPEG at this quality.
+
+    Returns:
+        Screenshot: The re-encoded screenshot, or the original if nothing was requested.
+    """
+    if max_size is None and jpeg_quality is None:
+        return screenshot
+
+    from PIL import Image
+
+    image = Image.open(BytesIO(base64.b64decode(screenshot.data)))
+    if max_size is not None and (image.size[0] > max_size[0] or image.size[1] > max_size[1]):
+        image.thumbnail(max_size, Image.Resampling.LANCZOS)
+
+    output = BytesIO()
+    if jpeg_quality is not None:
+        image.convert("RGB").save(output, format="JPEG", quality=jpeg_quality)
+        return Screenshot(base64.b64encode(output.getvalue()).decode("ascii"), "image/jpeg")
+    image.save(output, format="PNG")
+    return Screenshot(base64.b64encode(output.getvalue()).decode("ascii"), "image/png")
+
+
+class _ImageSlot:
+    """Placeholder for an image inside a tool result; emptied in place when evicted."""
+
+    __slots__ = ("screenshot", "message_index")
+
+    def __init__(self, screenshot, message_index):
+        self.screenshot = screenshot
+        self.message_index = message_index
+
+
+class Conversation:
+    """
+    Message history for one agent session with bounded screenshot memory.
+
+    Image blocks are indexed in arrival order as they are appended, so keeping only the
+    most recent ``images_to_keep`` screenshots costs O(1) per evicted image instead of a
+    rescan of the whole history each turn. Serialized messages are cached and only the
+    few that still hold images, or just lost one, are rebuilt for the next request. Like
+    the original filter, images are evicted in chunks of ``min_removal_threshold`` so the
+    request prefix stays stable for several turns at a time.
+
+    Args:
+        images_to_keep (int, optional): Screenshots to keep in the history. None keeps all.
+        min_removal_threshold (int): Evict images in multiples of this many.
+        max_image_size (tuple[int, int], optional): Downscale screenshots to fit this size.
+        jpeg_quality (int, optional): Re-encode screenshots as JPEG at this quality.
+    """
+
+    def __init__(self, images_to_keep=2, min_removal_threshold=2, max_image_size=None, jpeg_quality=None):
+        self.images_to_keep = images_to_keep
+        self.min_removal_threshold = max(1, min_removal_threshold)
+        self.max_image_size = max_image_size
+        self.jpeg_quality = jpeg_quality
+        self.messages = []
+        self._serialized = []
+        self._stale = set()
+        self._images = deque()
+        self.image_bytes = 0
+
+    def __len__(self):
+        return len(self.messages)
+
+    @property
+    def image_count(self):
+        return len(self._images)
+
+    def add_user_text(self, text):
+        self._append({"role": "user", "content": [{"type": "text", "text": text}]})
+
+    def add_assistant(self, content):
+        """Append the assistant's response, given as content block params."""
+        self._append({"role": "assistant", "content": content})
+
+    def add_tool_results(self, results):
+        """
+        Append one user message holding the results of the last turn's tool calls.
+
+        Args:
+            results (list): ``(tool_use_id, ToolResult)`` pairs in the order the calls were issued.
+        """
+        index = len(self.messages)
+        blocks = []
+        for tool_use_id, result in results:
+            if result.error:
+                blocks.append({
+                    "type": "tool_result",
+                    "content": result.error,
+                    "tool_use_id": tool_use_id,
+                    "is_error": True,
+                })
+                continue
+
+            content = []
+            if result.output:
+                content.append({"type": "text", "text": result.output})
+            if result.base64_image:
+                content.append(self._add_image(result.base64_image, index))
+            blocks.append({
+                "type": "tool_result",
+                "content": content,
+                "tool_use_id": tool_use_id,
+                "is_error": False,
+            })
+
+        self._append({"role": "user", "content": blocks})
+        self._evict_images()
+
+    def to_params(self, cache_breakpoints=0):
+        """
+        Serialize the history into message params for the next request.
+
+        Only messages holding live images, or that lost one since the last call, are
+        rebuilt; images are base64-encoded here and not kept in that form.
+
+        Args:
+            cache_breakpoints (int): Mark the last block of this many of the latest user
+                messages with ``cache_control``, so the API caches the history prefix.
+
+        Returns:
+            list[dict]: The messages.
+        """
+        live = {slot.message_index for slot in self._images}
+        for index in self._stale | live:
+            self._serialized[index] = self._serialize_message(self.messages[index])
+        # Messages that held images but no longer do won't change again; keep one copy of them
+        for index in self._stale - live:
+            self.messages[index] = self._serialized[index]
+        self._stale = set()
+        params = list(self._serialized)
+        # Don't keep base64 copies of live images around between requests
+        for index in live:
+            self._serialized[index] = None
+            self._stale.add(index)
+        if cache_breakpoints:
+            self._add_cache_breakpoints(params, cache_breakpoints)
+        return params
+
+    def _append(self, message):
+        self.messages.append(message)
+        self._serialized.append(message)
+
+    def _add_image(self, base64_image, message_index):
+        screenshot = Screenshot.from_base64(base64_image)
+        if self.max_image_size is not None or self.jpeg_quality is not None:
+            with span("screenshot", "decode"):
+                screenshot = reencode_screenshot(
+                    screenshot, max_size=self.max_image_size, jpeg_quality=self.jpeg_quality
+                )
+        slot = _ImageSlot(screenshot, message_index)
+        self._images.append(slot)
+        self.image_bytes += screenshot.size
+        return slot
+
+    def _evict_images(self):
+        if self.images_to_keep is None:
+            return
+        to_remove = len(self._images) - self.images_to_keep
+        to_remove -= to_remove % self.min_removal_threshold
+        for _ in range(max(0, to_remove)):
+            slot = self._images.popleft()
+            self.image_bytes -= slot.screenshot.size
+            slot.screenshot = None
+            self._stale.add(slot.message_index)
+
+    @staticmethod
+    def _add_cache_breakpoints(params, count):
+        # Copies only the marked messages; the cached serializations stay unmarked
+        for index in range(len(params) - 1, -1, -1):
+            if count == 0:
+                return
+            message = params[index]
+            if message["role"] != "user" or not message["content"]:
+                continue
+            content = list(message["content"])
+            content[-1] = {**content[-1], "cache_control": CACHE_CONTROL}
+            params[index] = {**message, "content": content}
+            count -= 1
+
+    @staticmethod
+    def _serialize_message(message):
+        content = message["content"]
+        if message["role"] != "user" or not any(block.get("type") == "tool_result" for block in content):
+            return message
+
+        blocks = []
+        for block in content:
+            if block.get("type") == "tool_result" and isinstance(block["content"], list):
+                block = {
+                    **block,
+                    "content": [
+                        item.screenshot.to_param() if isinstance(item, _ImageSlot) else item
+                        for item in block["content"]
+                        if not (isinstance(item, _ImageSlot) and item.screenshot is None)
+                    ],
+                }
+            blocks.append(block)
+        return {"role": message["role"], "content": blocks}
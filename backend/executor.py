@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when a task is submitted while the executor's job queue is full."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Job queue is full, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class TaskExecutor:
+    """
+    A single long-lived asyncio event loop that runs listener tasks with bounded concurrency.
+
+    Tasks are submitted from any thread. At most ``concurrency`` tasks run at once and at
+    most ``max_queue_size`` wait for a worker; further submissions raise ``QueueFullError``.
+
+    Args:
+        concurrency (int): The number of tasks allowed to run at the same time.
+        max_queue_size (int): The number of tasks allowed to wait for a free worker.
+        retry_after (int): Seconds callers are told to wait when the queue is full.
+    """
+
+    def __init__(self, concurrency=4, max_queue_size=100, retry_after=30):
+        self.concurrency = concurrency
+        self.max_queue_size = max_queue_size
+        self.retry_after = retry_after
+        self.loop = None
+        self._queue = None
+        self._workers = []
+        self._thread = None
+        self._started = threading.Event()
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+
+    def start(self):
+        """Start the event loop thread and its workers."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run_loop, name="task-executor", daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def has_capacity(self):
+        """Return True if a submitted task would be accepted right now."""
+        with self._lock:
+            return self._queued < self.max_queue_size
+
+    def submit(self, coro_fn, *args, **kwargs):
+        """
+        Queue a coroutine function to run on the executor's event loop.
+
+        Args:
+            coro_fn (callable): An async function.
+            *args: Positional arguments for ``coro_fn``.
+            **kwargs: Keyword arguments for ``coro_fn``.
+
+        Returns:
+            concurrent.futures.Future: Resolves with the coroutine's result.
+
+        Raises:
+            QueueFullError: If the job queue is full.
+            RuntimeError: If the executor has not been started.
+        """
+        if self.loop is None:
+            raise RuntimeError("TaskExecutor has not been started")
+
+        with self._lock:
+            if self._queued >= self.max_queue_size:
+                self._rejected += 1
+                raise QueueFullError(self.retry_after)
+            self._queued += 1
+
+        future = Future()
+        self.loop.call_soon_threadsafe(self._queue.put_nowait, (coro_fn, args, kwargs, future))
+        return future
+
+    def metrics(self):
+        """
+        Return a snapshot of the executor's queue and worker counters.
+
+        Returns:
+            dict: Queue depth, in-flight tasks, limits and lifetime totals.
+        """
+        with self._lock:
+            return {
+                "queue_depth": self._queued,
+                "in_flight": self._in_flight,
+                "concurrency": self.concurrency,
+                "max_queue_size": self.max_queue_size,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        Stop the executor.
+
+        Args:
+            wait (bool): Drain queued and in-flight tasks before stopping.
+            timeout (float, optional): The longest to wait for the drain, in seconds.
+        """
+        if self._thread is None:
+            return
+
+        if wait:
+            drain = asyncio.run_coroutine_threadsafe(self._queue.join(), self.loop)
+            try:
+                drain.result(timeout)
+            except Exception:
+                logger.warning("Timed out draining the task executor; cancelling remaining tasks.")
+
+        asyncio.run_coroutine_threadsafe(self._cancel_workers(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self._thread = None
+        self._started.clear()
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._queue = asyncio.Queue()
+        self._workers = [self.loop.create_task(self._worker()) for _ in range(self.concurrency)]
+        self._started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+            self.loop = None
+
+    async def _worker(self):
+        while True:
+            coro_fn, args, kwargs, future = await self._queue.get()
+            with self._lock:
+                self._queued -= 1
+                self._in_flight += 1
+            try:
+                if future.set_running_or_notify_cancel():
+                    result = await coro_fn(*args, **kwargs)
+                    future.set_result(result)
+                with self._lock:
+                    self._completed += 1
+            except asyncio.CancelledError as e:
+                # A running concurrent future can't be cancelled, so fail it with the cancellation.
+                # Only a worker that is itself being cancelled stops; a task cancelling itself doesn't
+                if not future.done():
+                    future.set_exception(e)
+                if asyncio.current_task().cancelling():
+                    raise
+                with self._lock:
+                    self._failed += 1
+            except Exception as e:
+                logger.error(f"Task {getattr(coro_fn, '__name__', coro_fn)} failed: {e}")
+                future.set_exception(e)
+                with self._lock:
+                    self._failed += 1
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                self._queue.task_done()
+
+    async def _cancel_workers(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
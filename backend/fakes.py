@@ -0,0 +1,584 @@
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.managers import BaseManager
+
+# Tables whose rows get 'updated_at' stamped on every write, as migrations/010_listener_updated_at.sql does
+TOUCHED_TABLES = ("event_listeners",)
+
+# A 1x1 transparent PNG returned by fake screenshots
+BLANK_PNG_BASE64 = (
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+
+class FakeInstance:
+    """
+    Local stand-in for a Scrapybara instance.
+
+    Args:
+        start_delay (float): Seconds to block when the instance is created.
+        action_delay (float): Seconds to block for every computer action.
+        screenshot (str): Base64 image returned by screenshots.
+        failure_rate (float): Fraction of computer actions that raise as if the VM dropped the connection.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, start_delay=0.0, action_delay=0.0, screenshot=BLANK_PNG_BASE64, failure_rate=0.0):
+        time.sleep(start_delay)
+        self.id = f"fake-{next(self._ids)}"
+        self.action_delay = action_delay
+        self.failure_rate = failure_rate
+        self.screenshot_base64 = screenshot
+        self.healthy = True
+        self.stopped = False
+        self.actions = []
+
+    def _check_alive(self):
+        if self.stopped:
+            raise RuntimeError(f"Instance {self.id} is stopped")
+        if not self.healthy:
+            raise ConnectionError(f"Instance {self.id} is unreachable")
+
+    def screenshot(self):
+        self._check_alive()
+        return {"base64_image": self.screenshot_base64}
+
+    def computer(self, **kwargs):
+        self._check_alive()
+        time.sleep(self.action_delay)
+        if random.random() < self.failure_rate:
+            raise ConnectionError(f"Instance {self.id} dropped the connection")
+        self.actions.append(kwargs)
+        return {"output": "", "error": None, "base64_image": self.screenshot_base64}
+
+    def stop(self):
+        self.stopped = True
+
+
+class FakeScrapybara:
+    """
+    Local stand-in for the Scrapybara client that starts ``FakeInstance`` objects.
+
+    Args:
+        **instance_kwargs: Passed to every ``FakeInstance``.
+    """
+
+    def __init__(self, **instance_kwargs):
+        self.instance_kwargs = instance_kwargs
+        self.instances = []
+
+    def start(self, instance_type="medium"):
+        instance = FakeInstance(**self.instance_kwargs)
+        self.instances.append(instance)
+        return instance
+
+
+class FakeEmailProvider:
+    """
+    Stand-in for ``notifications.ResendProvider`` that records batches instead of sending them.
+
+    Args:
+        latency (float): Seconds to block per batch request.
+        failure_rate (float): Fraction of batch requests that raise.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.batches = []
+        self._lock = threading.Lock()
+
+    @property
+    def sent(self):
+        return [email for batch in self.batches for email in batch]
+
+    def send_batch(self, emails):
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise ConnectionError("Fake email provider failure")
+        with self._lock:
+            self.batches.append(list(emails))
+        return {"data": [{"id": f"email-{len(self.batches)}-{index}"} for index in range(len(emails))]}
+
+
+class FakeSupabase:
+    """
+    In-memory stand-in for the Supabase client, covering the query builder calls the backend makes.
+
+    Tables are lists of row dicts keyed by name in ``tables``. Every executed query is
+    appended to ``calls`` as ``(table, operation, row_count)``. Queries are built as plain
+    data and run by ``execute_query`` under one lock, so each is atomic; ``serve`` shares
+    one instance with other processes.
+
+    Args:
+        latency (float): Seconds to block on every executed query.
+        tables (dict, optional): Initial rows per table.
+        failure_rate (float): Fraction of executed queries that raise instead of running.
+    """
+
+    def __init__(self, latency=0.0, tables=None, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.tables = {name: [dict(row) for row in rows] for name, rows in (tables or {}).items()}
+        self.calls = []
+        self._ids = itertools.count(1 + max((row.get("id", 0) for rows in self.tables.values() for row in rows), default=0))
+        self._lock = threading.Lock()
+
+    def table(self, name):
+        return _FakeQuery(self, name)
+
+    def rows(self, name):
+        """Return a copy of a table's rows."""
+        with self._lock:
+            return [dict(row) for row in self.tables.get(name, [])]
+
+    def execute_query(self, table, query):
+        """Run a query built by ``_FakeQuery`` and return the affected rows."""
+        with self._lock:
+            rows = self.tables.setdefault(table, [])
+            if table in TOUCHED_TABLES and query["operation"] in ("insert", "update", "upsert"):
+                query = {**query, "payload": _touch(query["payload"])}
+            data = getattr(self, f"_execute_{query['operation']}")(rows, query)
+            self.calls.append((table, query["operation"], len(data)))
+            return data
+
+    def serve(self, address=("127.0.0.1", 0), authkey=b"fake-supabase"):
+        """
+        Share this fake with other processes from a server process.
+
+        The server process starts with a copy of this fake's tables, so read the shared
+        state back through a ``RemoteFakeSupabase``.
+
+        Returns:
+            tuple: The manager, to ``shutdown()`` when done, and the address clients connect to.
+        """
+        manager = _FakeSupabaseManager(address=address, authkey=authkey)
+        with self._lock:
+            tables = {name: [dict(row) for row in rows] for name, rows in self.tables.items()}
+        manager.start(_install_shared_fake, (tables,))
+        return manager, manager.address
+
+    @staticmethod
+    def _matching(rows, query):
+        return [
+            row for row in rows
+            if all(_FILTERS[name](row.get(column), value) != negate for name, column, value, negate in query["filters"])
+        ]
+
+    def _execute_select(self, rows, query):
+        matched = self._matching(rows, query)
+        for column, desc in reversed(query["ordering"]):
+            matched.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+        if query["bounds"]:
+            matched = matched[query["bounds"][0]:query["bounds"][1]]
+        if query["columns"] is None:
+            return [dict(row) for row in matched]
+        return [{column: row.get(column) for column in query["columns"]} for row in matched]
+
+    def _execute_insert(self, rows, query):
+        inserted = []
+        payload = query["payload"]
+        for values in payload if isinstance(payload, list) else [payload]:
+            row = dict(values)
+            row.setdefault("id", next(self._ids))
+            rows.append(row)
+            inserted.append(dict(row))
+        return inserted
+
+    def _execute_update(self, rows, query):
+        matched = self._matching(rows, query)
+        for row in matched:
+            row.update(query["payload"])
+        return [dict(row) for row in matched]
+
+    def _execute_upsert(self, rows, query):
+        key = query["on_conflict"]
+        by_key = {row.get(key): row for row in rows}
+        written = []
+        payload = query["payload"]
+        for values in payload if isinstance(payload, list) else [payload]:
+            row = by_key.get(values.get(key))
+            if row is None:
+                row = dict(values)
+                rows.append(row)
+                by_key[row.get(key)] = row
+            else:
+                row.update(values)
+            written.append(dict(row))
+        return written
+
+    def _execute_delete(self, rows, query):
+        matched = self._matching(rows, query)
+        deleted = {id(row) for row in matched}
+        rows[:] = [row for row in rows if id(row) not in deleted]
+        return [dict(row) for row in matched]
+
+
+class RemoteFakeSupabase:
+    """
+    Client for a ``FakeSupabase`` shared by ``FakeSupabase.serve``, usable from any process.
+
+    Args:
+        address (tuple): The address returned by ``serve``.
+        authkey (bytes): The key passed to ``serve``.
+        latency (float): Seconds to block on every executed query.
+        failure_rate (float): Fraction of executed queries that raise instead of running.
+    """
+
+    def __init__(self, address, authkey=b"fake-supabase", latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        manager = _FakeSupabaseManager(address=address, authkey=authkey)
+        manager.connect()
+        self._shared = manager.get_fake()
+
+    def table(self, name):
+        return _FakeQuery(self, name)
+
+    def rows(self, name):
+        return self._shared.rows(name)
+
+    def execute_query(self, table, query):
+        return self._shared.execute_query(table, query)
+
+
+class _FakeSupabaseManager(BaseManager):
+    pass
+
+
+_shared_fake = None
+
+
+def _install_shared_fake(tables):
+    global _shared_fake
+    _shared_fake = FakeSupabase(tables=tables)
+
+
+def _get_shared_fake():
+    return _shared_fake
+
+
+_FakeSupabaseManager.register("get_fake", callable=_get_shared_fake, exposed=("execute_query", "rows"))
+
+
+class _FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+# Filter operators: (stored value, filter value) -> bool
+def _touch(payload):
+    updated_at = datetime.now(timezone.utc).isoformat()
+    if isinstance(payload, list):
+        return [{**values, "updated_at": updated_at} for values in payload]
+    return {**payload, "updated_at": updated_at}
+
+
+_FILTERS = {
+    "eq": lambda actual, value: actual == value,
+    "neq": lambda actual, value: actual != value,
+    "gt": lambda actual, value: actual is not None and actual > value,
+    "gte": lambda actual, value: actual is not None and actual >= value,
+    "lt": lambda actual, value: actual is not None and actual < value,
+    "lte": lambda actual, value: actual is not None and actual <= value,
+    "in": lambda actual, value: actual in value,
+    "is": lambda actual, value: actual is None if value in (None, "null") else actual == value,
+}
+
+
+class _FakeQuery:
+    def __init__(self, fake, table):
+        self.fake = fake
+        self.table = table
+        self.query = {
+            "operation": "select",
+            "columns": None,
+            "payload": None,
+            "on_conflict": "id",
+            "filters": [],
+            "ordering": [],
+            "bounds": None,
+        }
+        self._negate = False
+
+    def select(self, columns="*", count=None):
+        self.query["operation"] = "select"
+        self.query["columns"] = None if columns.strip() == "*" else [column.strip() for column in columns.split(",")]
+        return self
+
+    def insert(self, payload):
+        self.query.update(operation="insert", payload=payload)
+        return self
+
+    def update(self, payload):
+        self.query.update(operation="update", payload=payload)
+        return self
+
+    def upsert(self, payload, on_conflict="id", **kwargs):
+        self.query.update(operation="upsert", payload=payload, on_conflict=on_conflict)
+        return self
+
+    def delete(self):
+        self.query["operation"] = "delete"
+        return self
+
+    @property
+    def not_(self):
+        self._negate = True
+        return self
+
+    def _filter(self, name, column, value):
+        negate, self._negate = self._negate, False
+        self.query["filters"].append((name, column, value, negate))
+        return self
+
+    def eq(self, column, value):
+        return self._filter("eq", column, value)
+
+    def neq(self, column, value):
+        return self._filter("neq", column, value)
+
+    def gt(self, column, value):
+        return self._filter("gt", column, value)
+
+    def gte(self, column, value):
+        return self._filter("gte", column, value)
+
+    def lt(self, column, value):
+        return self._filter("lt", column, value)
+
+    def lte(self, column, value):
+        return self._filter("lte", column, value)
+
+    def in_(self, column, values):
+        return self._filter("in", column, list(values))
+
+    def is_(self, column, value):
+        return self._filter("is", column, value)
+
+    def order(self, column, desc=False):
+        self.query["ordering"].append((column, desc))
+        return self
+
+    def range(self, start, end):
+        self.query["bounds"] = (start, end + 1)
+        return self
+
+    def limit(self, count):
+        start = self.query["bounds"][0] if self.query["bounds"] else 0
+        self.query["bounds"] = (start, start + count)
+        return self
+
+    def execute(self):
+        time.sleep(self.fake.latency)
+        if random.random() < self.fake.failure_rate:
+            raise ConnectionError(f"Fake Supabase failure on {self.table}")
+        return _FakeResponse(self.fake.execute_query(self.table, self.query))
+
+
+class FakeMessagesServer:
+    """
+    Local mock of the Anthropic messages endpoint, for pointing ANTHROPIC_BASE_URL at.
+
+    Each conversation asks for a screenshot ``tool_turns`` times and then answers with
+    ``final_text``, or with a positive verdict for a ``positive_rate`` fraction of
+    conversations. A prompt listing numbered events, as ``batching.batch_prompt`` does, gets
+    an 'Event <n>: <verdict>' line per event instead. Both streaming (SSE) and non-streaming requests are served. Prompt
+    caching is simulated: a prefix ending at a ``cache_control`` breakpoint is written on
+    first sight and read by later requests that repeat it. Token counts are estimated as
+    four characters per token.
+
+    Args:
+        tool_turns (int): Tool-using turns before the final answer.
+        final_text (str): The text of the final answer.
+        latency (float): Seconds to wait before answering each request.
+        failure_rate (float): Fraction of requests answered with a 429 rate-limit error.
+        positive_rate (float): Fraction of final answers that report the event as having occurred.
+    """
+
+    def __init__(
+        self,
+        tool_turns=2,
+        final_text="Answer Type: negative\nNothing changed.",
+        latency=0.0,
+        failure_rate=0.0,
+        positive_rate=0.0,
+    ):
+        self.tool_turns = tool_turns
+        self.final_text = final_text
+        self.positive_rate = positive_rate
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = []
+        self._ids = itertools.count(1)
+        self._cached_prefixes = set()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Start serving on a free local port. Returns the server for chaining."""
+        handler = type("FakeMessagesHandler", (_FakeMessagesHandler,), {"fake": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-messages", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def content_for(self, body):
+        """Return the content blocks of the next response for a request body."""
+        turn = sum(1 for message in body.get("messages", []) if message["role"] == "assistant")
+        if turn < self.tool_turns:
+            return [
+                {"type": "text", "text": "Let me look at the page."},
+                {
+                    "type": "tool_use",
+                    "id": f"toolu_{next(self._ids)}",
+                    "name": "computer",
+                    "input": {"action": "screenshot"},
+                },
+            ]
+        questions = self._questions(body)
+        if questions > 1:
+            return [{"type": "text", "text": "\n".join(
+                f"Event {number}: positive\nThe event occurred." if random.random() < self.positive_rate
+                else f"Event {number}: negative\nNothing changed."
+                for number in range(1, questions + 1)
+            )}]
+        if random.random() < self.positive_rate:
+            return [{"type": "text", "text": "Answer Type: positive\nThe event occurred."}]
+        return [{"type": "text", "text": self.final_text}]
+
+    @staticmethod
+    def _questions(body):
+        # Numbered events in the first user message
+        messages = body.get("messages", [])
+        if not messages:
+            return 0
+        content = messages[0]["content"]
+        text = content if isinstance(content, str) else " ".join(block.get("text", "") for block in content)
+        return len(re.findall(r"^\d+\. ", text, re.MULTILINE))
+
+    def message_for(self, body):
+        content = self.content_for(body)
+        return {
+            "id": f"msg_{next(self._ids)}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "fake-model"),
+            "content": content,
+            "stop_reason": "tool_use" if any(block["type"] == "tool_use" for block in content) else "end_turn",
+            "stop_sequence": None,
+            "usage": {**self.usage_for(body), "output_tokens": 20},
+        }
+
+    def usage_for(self, body):
+        """Return the input token usage of a request, with simulated prompt caching."""
+        # The prompt is laid out as tools, then system, then messages, as the API caches it
+        blocks = list(body.get("tools", []))
+        system = body.get("system", [])
+        blocks += [{"type": "text", "text": system}] if isinstance(system, str) else system
+        for message in body.get("messages", []):
+            content = message["content"]
+            blocks += [{"type": "text", "text": content}] if isinstance(content, str) else content
+
+        # Breakpoints move between requests, so they are not part of the cached content
+        length, breakpoints, digest = 0, [], hashlib.sha256()
+        for block in blocks:
+            encoded = json.dumps({key: value for key, value in block.items() if key != "cache_control"}, sort_keys=True)
+            length += len(encoded)
+            digest.update(encoded.encode("utf-8"))
+            if "cache_control" in block:
+                breakpoints.append((length, digest.copy().hexdigest()))
+
+        cached = max((end for end, key in breakpoints if key in self._cached_prefixes), default=0)
+        written = max((end for end, _ in breakpoints), default=0)
+        self._cached_prefixes.update(key for _, key in breakpoints)
+        written = max(0, written - cached)
+        return {
+            "input_tokens": (length - cached - written) // 4,
+            "cache_read_input_tokens": cached // 4,
+            "cache_creation_input_tokens": written // 4,
+        }
+
+
+class _FakeMessagesHandler(BaseHTTPRequestHandler):
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        self.fake.requests.append(body)
+        time.sleep(self.fake.latency)
+
+        if random.random() < self.fake.failure_rate:
+            self._send_json(429, {
+                "type": "error",
+                "error": {"type": "rate_limit_error", "message": "Fake rate limit"},
+            }, {"retry-after": "0"})
+            return
+
+        message = self.fake.message_for(body)
+        if not body.get("stream"):
+            self._send_json(200, message)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        content, usage = message["content"], message["usage"]
+        self._send_event("message_start", {
+            "type": "message_start",
+            "message": {**message, "content": [], "stop_reason": None, "usage": {**usage, "output_tokens": 1}},
+        })
+        for index, block in enumerate(content):
+            if block["type"] == "text":
+                start, delta = {"type": "text", "text": ""}, {"type": "text_delta", "text": block["text"]}
+            else:
+                start = {**block, "input": {}}
+                delta = {"type": "input_json_delta", "partial_json": json.dumps(block["input"])}
+            self._send_event("content_block_start", {"type": "content_block_start", "index": index, "content_block": start})
+            self._send_event("content_block_delta", {"type": "content_block_delta", "index": index, "delta": delta})
+            self._send_event("content_block_stop", {"type": "content_block_stop", "index": index})
+        self._send_event("message_delta", {
+            "type": "message_delta",
+            "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+            "usage": {"output_tokens": usage["output_tokens"]},
+        })
+        self._send_event("message_stop", {"type": "message_stop"})
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_event(self, name, payload):
+        self.wfile.write(f"event: {name}\ndata: {json.dumps(payload)}\n\n".encode("utf-8"))
+        self.wfile.flush()
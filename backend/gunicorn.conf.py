@@ -0,0 +1,42 @@
+"""
+Gunicorn settings for serving the backend with several worker processes:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Every worker builds the app, but only the one holding LEADER_LOCK_PATH runs the
+scheduler, worker pool, VM pool and notification sender; the others serve requests and
+take over if it exits (see leader.py). Workers are threaded so open event streams don't
+tie up a whole process. /metrics and /worker-metrics answer 503 in every worker but the
+leader; set METRICS_BIND for the leader to serve them on a port of their own to scrape.
+
+On SIGTERM each worker stops accepting requests and, at the same time, ends its event
+streams and drains its running listener tasks. graceful_timeout must cover that drain.
+"""
+import os
+import signal
+import tempfile
+import threading
+
+# Read by config.Config when the workers import the app
+os.environ.setdefault("LEADER_LOCK_PATH", os.path.join(tempfile.gettempdir(), "event-listener-leader.lock"))
+
+bind = os.getenv("BIND", "0.0.0.0:5001")
+# One process per CPU: requests mostly wait on Supabase, which the threads cover, and processes beyond the
+# CPUs only contend for them. On one CPU, 4 workers served 27% fewer requests than 1 (see bench_http.py)
+workers = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+keepalive = 5
+graceful_timeout = int(float(os.getenv("SHUTDOWN_TIMEOUT", "330"))) + 30
+# Recycling workers would restart the leader and interrupt its listeners
+max_requests = 0
+
+
+def post_worker_init(worker):
+    handle_exit = worker.handle_exit
+
+    def drain_and_exit(sig, frame):
+        threading.Thread(target=worker.wsgi.extensions["shutdown"], name="shutdown", daemon=True).start()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, drain_and_exit)
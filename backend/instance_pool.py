@@ -0,0 +1,286 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class PoolExhaustedError(Exception):
+    """Raised when no instance could be leased before the acquire timeout."""
+
+
+def screenshot_health_check(instance):
+    """Treat an instance as healthy if it can still take a screenshot."""
+    instance.screenshot()
+    return True
+
+
+class InstancePool:
+    """
+    A pool of reusable VM instances handed out as exclusive leases.
+
+    Instances are started on demand up to ``max_size`` and returned to the pool after use,
+    so the cold-start cost is paid once per instance rather than once per run. Idle
+    instances are health-checked before being reused, and a maintenance thread keeps
+    ``warm_spares`` idle instances ready while stopping ones idle for longer than
+    ``idle_timeout``.
+
+    Args:
+        factory (callable): Starts and returns a new instance.
+        max_size (int): The most instances alive at once, leased or idle.
+        warm_spares (int): Idle instances kept ready for the next lease.
+        idle_timeout (float): Seconds an idle instance may sit unused before being stopped.
+        health_check (callable, optional): Returns True if an instance is usable.
+            Defaults to ``screenshot_health_check``.
+        health_check_interval (float): Only re-check instances idle for at least this long.
+        clock (callable, optional): Monotonic time source. Defaults to ``time.monotonic``.
+    """
+
+    def __init__(
+        self,
+        factory,
+        max_size=4,
+        warm_spares=1,
+        idle_timeout=600,
+        health_check=screenshot_health_check,
+        health_check_interval=30,
+        clock=time.monotonic,
+    ):
+        self.factory = factory
+        self.max_size = max_size
+        self.warm_spares = min(warm_spares, max_size)
+        self.idle_timeout = idle_timeout
+        self.health_check = health_check
+        self.health_check_interval = health_check_interval
+        self.clock = clock
+        self._idle = deque()
+        self._leased = set()
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._started_total = 0
+        self._reused_total = 0
+
+    def acquire(self, timeout=None):
+        """
+        Lease an instance, reusing an idle one when possible.
+
+        Args:
+            timeout (float, optional): The longest to wait for a free instance, in seconds.
+
+        Returns:
+            The leased instance.
+
+        Raises:
+            PoolExhaustedError: If no instance became available before the timeout.
+        """
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            with self._condition:
+                if self._closed:
+                    raise RuntimeError("InstancePool is closed")
+                if self._idle:
+                    instance, idle_since = self._idle.pop()
+                    self._leased.add(id(instance))
+                    create = False
+                elif self._size < self.max_size:
+                    self._size += 1
+                    create = True
+                else:
+                    remaining = None if deadline is None else deadline - self.clock()
+                    if remaining is not None and remaining <= 0:
+                        raise PoolExhaustedError(f"No instance available within {timeout} seconds")
+                    self._condition.wait(remaining)
+                    continue
+
+            if create:
+                instance = self._start_instance()
+                with self._condition:
+                    self._leased.add(id(instance))
+                return instance
+
+            if self.clock() - idle_since < self.health_check_interval or self._is_healthy(instance):
+                with self._condition:
+                    self._reused_total += 1
+                return instance
+
+            logger.warning("Discarding unhealthy idle instance.")
+            with self._condition:
+                self._leased.discard(id(instance))
+            self._discard(instance)
+
+    def release(self, instance, healthy=True):
+        """
+        Return a leased instance to the pool.
+
+        Args:
+            instance: The instance returned by ``acquire``.
+            healthy (bool): Stop the instance instead of reusing it if False.
+        """
+        with self._condition:
+            self._leased.discard(id(instance))
+            keep = healthy and not self._closed
+            if keep:
+                self._idle.append((instance, self.clock()))
+                self._condition.notify()
+        if not keep:
+            self._discard(instance)
+
+    @asynccontextmanager
+    async def lease(self, timeout=None):
+        """
+        Lease an instance for the duration of an ``async with`` block.
+
+        If the block raises, the instance is health-checked before it is returned so a
+        crashed VM is not handed to the next caller. A lease cancelled while waiting for
+        an instance returns it to the pool once the acquiring thread gets one.
+        """
+        # The acquiring thread can't be interrupted, so it is shielded and its instance released if nobody takes it
+        acquiring = asyncio.ensure_future(asyncio.to_thread(self.acquire, timeout))
+        try:
+            instance = await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            acquiring.add_done_callback(self._release_abandoned)
+            raise
+        healthy = True
+        try:
+            yield instance
+        except BaseException:
+            healthy = await asyncio.to_thread(self._is_healthy, instance)
+            raise
+        finally:
+            await asyncio.to_thread(self.release, instance, healthy)
+
+    def _release_abandoned(self, acquiring):
+        if acquiring.cancelled() or acquiring.exception() is not None:
+            return
+        logger.info("Returning an instance acquired for a cancelled lease.")
+        acquiring.get_loop().run_in_executor(None, self.release, acquiring.result())
+
+    def evict_idle(self):
+        """
+        Stop instances that have been idle longer than ``idle_timeout``, keeping the warm spares.
+
+        Returns:
+            int: The number of instances stopped.
+        """
+        cutoff = self.clock() - self.idle_timeout
+        evicted = []
+        with self._condition:
+            # The oldest idle instances sit at the left of the deque
+            while len(self._idle) > self.warm_spares and self._idle[0][1] < cutoff:
+                evicted.append(self._idle.popleft()[0])
+        for instance in evicted:
+            self._discard(instance)
+        return len(evicted)
+
+    def ensure_spares(self):
+        """
+        Start instances until ``warm_spares`` are idle, without exceeding ``max_size``.
+
+        Returns:
+            int: The number of instances started.
+        """
+        started = 0
+        while True:
+            with self._condition:
+                if self._closed or len(self._idle) >= self.warm_spares or self._size >= self.max_size:
+                    return started
+                self._size += 1
+            try:
+                instance = self._start_instance()
+            except Exception as e:
+                logger.error(f"Error starting warm spare instance: {e}")
+                return started
+            self.release(instance)
+            started += 1
+
+    def metrics(self):
+        """
+        Return a snapshot of the pool's size and reuse counters.
+
+        Returns:
+            dict: Live, idle and leased instance counts plus lifetime totals.
+        """
+        with self._condition:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "leased": len(self._leased),
+                "max_size": self.max_size,
+                "started_total": self._started_total,
+                "reused_total": self._reused_total,
+            }
+
+    def start(self, maintenance_interval=30):
+        """Start the background thread that keeps warm spares and evicts idle instances."""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._maintain,
+            args=(maintenance_interval,),
+            name="instance-pool",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def close(self):
+        """Stop the maintenance thread and every idle instance. Leased instances stop on release."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._condition:
+            self._closed = True
+            idle = [instance for instance, _ in self._idle]
+            self._idle.clear()
+            self._condition.notify_all()
+        for instance in idle:
+            self._discard(instance)
+
+    def _maintain(self, interval):
+        while not self._stopped.is_set():
+            try:
+                self.evict_idle()
+                self.ensure_spares()
+            except Exception as e:
+                logger.error(f"Error maintaining instance pool: {e}")
+            self._stopped.wait(interval)
+
+    def _start_instance(self):
+        # The caller has already reserved a slot in self._size
+        try:
+            instance = self.factory()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._started_total += 1
+        logger.info("Started a new pooled instance.")
+        return instance
+
+    def _is_healthy(self, instance):
+        if self.health_check is None:
+            return True
+        try:
+            return bool(self.health_check(instance))
+        except Exception as e:
+            logger.warning(f"Instance health check failed: {e}")
+            return False
+
+    def _discard(self, instance):
+        try:
+            instance.stop()
+        except Exception as e:
+            logger.warning(f"Error stopping instance: {e}")
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
@@ -0,0 +1,150 @@
+import fcntl
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLock:
+    """
+    Exclusive advisory lock on a file, held by the one process that runs the background services.
+
+    The operating system releases the lock when the holding process exits, however it
+    exits, so another process can take over. It is never released earlier, so no other
+    process starts running listeners while the leader is still draining its own.
+
+    Args:
+        path (str): The lock file; created if missing. Every process must use the same path.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    @property
+    def held(self):
+        return self._file is not None
+
+    def try_acquire(self):
+        """Take the lock if no other process holds it. Returns True if this process holds it."""
+        if self._file is not None:
+            return True
+        lock_file = open(self.path, "a+")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(f"{os.getpid()}\n")
+        lock_file.flush()
+        self._file = lock_file
+        return True
+
+
+class LeaderElection:
+    """
+    Makes one of several processes on a host the leader and calls ``on_elected`` in it.
+
+    The first process to take the lock is elected straight away. The others keep trying
+    every ``interval`` seconds from a background thread, so when the leader exits one of
+    them takes over.
+
+    Args:
+        lock (LeaderLock): The lock shared by the candidates.
+        on_elected (callable): Called once, in the elected process.
+        interval (float): Seconds between attempts while another process leads.
+    """
+
+    def __init__(self, lock, on_elected, interval=5.0):
+        self.lock = lock
+        self.on_elected = on_elected
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def is_leader(self):
+        return self.lock.held
+
+    def start(self):
+        """Try to become the leader now, and keep trying in the background if another process leads."""
+        if self._try_elect():
+            return
+        logger.info(f"Another process holds {self.lock.path}; following and retrying every {self.interval}s.")
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="leader-election", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop campaigning. A leader keeps the lock until it exits."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _try_elect(self):
+        if not self.lock.try_acquire():
+            return False
+        logger.info(f"Process {os.getpid()} elected leader.")
+        self.on_elected()
+        return True
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                if self._try_elect():
+                    return
+            except Exception as e:
+                logger.error(f"Error taking over as leader: {e}")
+
+
+class LeaderMetricsServer:
+    """
+    Serves the leader's metrics routes on a port of their own.
+
+    Under gunicorn every worker answers on the same port, and only the leader runs the
+    components the metrics describe, so a scraper there would reach whichever worker the
+    kernel picked. The leader starts this server on ``bind`` instead; it passes only
+    ``paths`` on to the app and answers everything else with 404.
+
+    Args:
+        app (Flask): The app whose routes are served.
+        bind (str): The 'host:port' to listen on.
+        paths (tuple): The paths served.
+    """
+
+    def __init__(self, app, bind, paths=("/metrics", "/worker-metrics")):
+        self.app = app
+        self.bind = bind
+        self.paths = paths
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """Start serving from a background thread."""
+        from werkzeug.serving import make_server
+
+        if self._thread is not None:
+            return
+        host, _, port = self.bind.rpartition(":")
+        self._server = make_server(host or "0.0.0.0", int(port), self._dispatch, threaded=True)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="leader-metrics", daemon=True)
+        self._thread.start()
+        logger.info(f"Serving leader metrics on {self.bind}.")
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._server.shutdown()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+
+    def _dispatch(self, environ, start_response):
+        if environ.get("PATH_INFO") in self.paths:
+            return self.app(environ, start_response)
+        start_response("404 Not Found", [("Content-Type", "text/plain")])
+        return [b"Not Found"]
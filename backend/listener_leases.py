@@ -0,0 +1,239 @@
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import timedelta
+
+from scheduler import SCHEDULER_COLUMNS, SCHEDULER_FIELDS, SystemClock
+from utils import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Seconds before claiming again a listener whose lease this node handed back in a write not yet flushed
+OWN_LEASE_RETRY_SECONDS = 1
+
+
+def default_owner():
+    """Identify this process among the nodes sharing the listener table."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def refresh_listener(listener, row):
+    """Bring a listener the scheduler kept in memory up to date with its stored row. Returns the listener."""
+    listener.update({column: row[column] for column in SCHEDULER_FIELDS if column in row})
+    return listener
+
+
+class ListenerLeases:
+    """
+    Lease-based claiming of due listeners, so several backend nodes can share one table.
+
+    A node claims due listeners with a single conditional update that sets 'lease_owner'
+    and moves 'next_trigger_at' to the end of the lease. The update only matches rows that
+    are still due, so when several nodes claim the same listener exactly one gets it.
+    While the listener runs, heartbeats push the end of the lease forward; the reschedule
+    after the run clears the owner and stores the real next trigger time. If the node dies
+    its leases run out, the listeners are due again and another node reclaims them. This
+    is the scheme ``SupabaseOutbox`` uses for notifications.
+
+    A node never holds more than ``max_held`` leases, so work spreads over the nodes with
+    free capacity instead of queueing on whichever node claimed first.
+
+    Another node may have run a listener since this node loaded it, so claimed and
+    contested listeners are refreshed from their stored rows: the page fingerprint, retry
+    count and adapted interval are the ones the last run left, wherever it ran.
+
+    See migrations/007_listener_leases.sql.
+
+    Args:
+        supabase (Client): The Supabase client instance.
+        owner (str, optional): This node's identity. Defaults to host, pid and a random suffix.
+        lease_seconds (float): How long a claim lasts without a heartbeat.
+        heartbeat_interval (float): Seconds between lease extensions; well under ``lease_seconds``.
+        clock (object, optional): Provides ``now()``. Defaults to ``SystemClock``.
+        max_held (int, optional): The most listeners this node runs or queues at once. None is unbounded.
+    """
+
+    def __init__(self, supabase, owner=None, lease_seconds=120, heartbeat_interval=30, clock=None, max_held=None):
+        self.supabase = supabase
+        self.owner = owner or default_owner()
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval
+        self.clock = clock or SystemClock()
+        self.max_held = max_held
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._claimed = 0
+        self._contested = 0
+        self._heartbeats = 0
+        self._lost = 0
+
+    def claim(self, listeners):
+        """
+        Claim due listeners for this node.
+
+        Args:
+            listeners (list[dict]): Listeners the local scheduler found due.
+
+        Returns:
+            tuple: The claimed listeners, and ``(listener, next_trigger_at)`` pairs for the
+            ones another node holds or already ran, with the time they should be looked at
+            again. Both are refreshed from their stored rows. Listeners that no longer exist
+            are in neither.
+        """
+        if not listeners:
+            return [], []
+        now = self.clock.now()
+        lease_until = now + timedelta(seconds=self.lease_seconds)
+        ids = [listener["id"] for listener in listeners]
+        # The update returns the claimed rows as stored, with whatever other nodes last wrote to them
+        claimed_rows = {
+            row["id"]: row for row in (
+                self.supabase.table("event_listeners")
+                .update({"lease_owner": self.owner, "next_trigger_at": lease_until.isoformat()})
+                .in_("id", ids)
+                .lte("next_trigger_at", now.isoformat())
+                .execute()
+            ).data or []
+        }
+        claimed_ids = set(claimed_rows)
+
+        claimed = [
+            refresh_listener(listener, claimed_rows[listener["id"]])
+            for listener in listeners if listener["id"] in claimed_ids
+        ]
+        contested = [listener for listener in listeners if listener["id"] not in claimed_ids]
+        later = []
+        if contested:
+            # Look again when the other node's lease runs out or the listener is next due
+            rows = (
+                self.supabase.table("event_listeners")
+                .select(f"{SCHEDULER_COLUMNS}, lease_owner")
+                .in_("id", [listener["id"] for listener in contested])
+                .not_.is_("next_trigger_at", "null")
+                .execute()
+            ).data or []
+            own_retry_at = now + timedelta(seconds=OWN_LEASE_RETRY_SECONDS)
+            next_trigger = {
+                # Still leased to this node: the reschedule handing it back is waiting in the status writer
+                row["id"]: own_retry_at if row.get("lease_owner") == self.owner else parse_timestamp(row["next_trigger_at"])
+                for row in rows
+            }
+            stored = {row["id"]: row for row in rows}
+            later = [
+                (refresh_listener(listener, stored[listener["id"]]), next_trigger[listener["id"]])
+                for listener in contested if listener["id"] in stored
+            ]
+
+        with self._lock:
+            self._held.update(claimed_ids)
+            self._claimed += len(claimed)
+            self._contested += len(contested)
+        return claimed, later
+
+    def room(self):
+        """Return how many more listeners this node may claim, or None if unbounded."""
+        if self.max_held is None:
+            return None
+        with self._lock:
+            return max(self.max_held - len(self._held), 0)
+
+    def release_fields(self, listener):
+        """
+        Stop heartbeating a finished listener and return the columns that hand its lease back.
+
+        They are written together with the listener's next trigger time, so the row is
+        never unleased while still due.
+        """
+        with self._lock:
+            self._held.discard(listener["id"])
+        return {"lease_owner": None}
+
+    def release(self, listener, next_trigger_at):
+        """
+        Give up a claimed listener that won't run now, making it due again at ``next_trigger_at``.
+
+        Returns:
+            bool: True if this node still held the lease.
+        """
+        with self._lock:
+            self._held.discard(listener["id"])
+        released = (
+            self.supabase.table("event_listeners")
+            .update({"lease_owner": None, "next_trigger_at": next_trigger_at.isoformat()})
+            .eq("id", listener["id"])
+            .eq("lease_owner", self.owner)
+            .execute()
+        ).data
+        return bool(released)
+
+    def heartbeat(self):
+        """
+        Extend the lease of every listener this node is running, in one update.
+
+        Returns:
+            int: The number of leases extended. Leases found taken over are dropped.
+        """
+        with self._lock:
+            held = list(self._held)
+        if not held:
+            return 0
+        lease_until = self.clock.now() + timedelta(seconds=self.lease_seconds)
+        extended = {
+            row["id"] for row in (
+                self.supabase.table("event_listeners")
+                .update({"next_trigger_at": lease_until.isoformat()})
+                .in_("id", held)
+                .eq("lease_owner", self.owner)
+                .execute()
+            ).data or []
+        }
+        with self._lock:
+            # A listener may have finished while the update was in flight; only count real losses
+            lost = [listener_id for listener_id in held if listener_id not in extended and listener_id in self._held]
+            self._held.difference_update(lost)
+            self._heartbeats += 1
+            self._lost += len(lost)
+        for listener_id in lost:
+            logger.warning(f"Lease on listener {listener_id} expired and was taken over by another node.")
+        return len(extended)
+
+    def metrics(self):
+        """
+        Return lease counters.
+
+        Returns:
+            dict: Leases held now and lifetime totals.
+        """
+        with self._lock:
+            return {
+                "held": len(self._held),
+                "claimed": self._claimed,
+                "contested": self._contested,
+                "heartbeats": self._heartbeats,
+                "lost": self._lost,
+            }
+
+    def start(self):
+        """Start sending heartbeats from a background thread."""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="listener-leases", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.heartbeat_interval):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"Error extending listener leases: {e}")
@@ -0,0 +1,137 @@
+import json
+
+# Columns returned by /manage-listeners when the client doesn't ask for specific ones;
+# 'result' holds the full agent transcript and is left out unless requested
+DEFAULT_LIST_COLUMNS = (
+    "id", "event", "url", "interval", "notification_type", "status", "trigger_status",
+    "last_triggered_at", "next_trigger_at",
+)
+
+# Every column a client may project
+LISTABLE_COLUMNS = DEFAULT_LIST_COLUMNS + (
+    "result", "user_id", "retry_count", "max_retries", "content_hash", "page_etag", "page_last_modified",
+)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class ListenerQuery:
+    """
+    A validated /manage-listeners query: projection, filters and page size.
+
+    Args:
+        columns (tuple[str]): The columns to return; 'id' is always included for the cursor.
+        statuses (tuple[str]): Only return listeners with one of these statuses.
+        user_id (str, optional): Only return this user's listeners.
+        limit (int): Rows per page.
+    """
+
+    def __init__(self, columns=DEFAULT_LIST_COLUMNS, statuses=(), user_id=None, limit=DEFAULT_PAGE_SIZE):
+        self.columns = columns if "id" in columns else ("id",) + tuple(columns)
+        self.statuses = statuses
+        self.user_id = user_id
+        self.limit = limit
+
+    @classmethod
+    def from_args(cls, args):
+        """
+        Build a query from request arguments.
+
+        Accepts 'fields' and 'status' as comma-separated lists, 'user_id' and 'limit'.
+
+        Args:
+            args (Mapping): The query string arguments.
+
+        Returns:
+            ListenerQuery: The parsed query.
+
+        Raises:
+            ValueError: If a field is unknown or the limit is not a positive integer.
+        """
+        columns = DEFAULT_LIST_COLUMNS
+        if args.get("fields"):
+            columns = tuple(dict.fromkeys(field.strip() for field in args["fields"].split(",") if field.strip()))
+            unknown = [column for column in columns if column not in LISTABLE_COLUMNS]
+            if unknown:
+                raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+        statuses = tuple(status.strip() for status in args.get("status", "").split(",") if status.strip())
+
+        try:
+            limit = int(args.get("limit", DEFAULT_PAGE_SIZE))
+        except ValueError:
+            raise ValueError("limit must be an integer")
+        if limit < 1:
+            raise ValueError("limit must be positive")
+
+        return cls(columns, statuses, args.get("user_id") or None, min(limit, MAX_PAGE_SIZE))
+
+    def fetch_page(self, supabase, after=None, limit=None):
+        """
+        Fetch the next page in id order.
+
+        Args:
+            supabase (Client): The Supabase client instance.
+            after (int, optional): Return listeners with an id greater than this cursor.
+            limit (int, optional): Overrides the query's page size.
+
+        Returns:
+            tuple[list[dict], int or None]: The rows and the cursor of the next page, if there is one.
+        """
+        limit = limit or self.limit
+        # One extra row tells us whether another page exists without a count(*)
+        builder = supabase.table("event_listeners").select(", ".join(self.columns))
+        if self.statuses:
+            builder = builder.in_("status", list(self.statuses))
+        if self.user_id is not None:
+            builder = builder.eq("user_id", self.user_id)
+        if after is not None:
+            builder = builder.gt("id", after)
+        rows = builder.order("id").limit(limit + 1).execute().data or []
+
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, rows[-1]["id"]
+        return rows, None
+
+    def iter_ndjson(self, supabase, after=None):
+        """
+        Yield every matching listener from the cursor on as newline-delimited JSON.
+
+        Rows are fetched a page at a time, so memory stays bounded however many match.
+
+        Args:
+            supabase (Client): The Supabase client instance.
+            after (int, optional): Start after this cursor.
+
+        Yields:
+            str: One JSON object per line.
+        """
+        while True:
+            rows, after = self.fetch_page(supabase, after, MAX_PAGE_SIZE)
+            for row in rows:
+                yield json.dumps(row, default=str) + "\n"
+            if after is None:
+                return
+
+
+def parse_cursor(value):
+    """
+    Parse a pagination cursor.
+
+    Args:
+        value (str, optional): The 'cursor' argument, the last id of the previous page.
+
+    Returns:
+        int or None: The cursor.
+
+    Raises:
+        ValueError: If the cursor is not an integer.
+    """
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError("cursor must be an integer")
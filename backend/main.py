@@ -1,41 +1,135 @@
+from __future__ import annotations
+
 import asyncio
 import os
 import json
-import base64
-from io import BytesIO
-from PIL import Image
-from IPython.display import display
-from typing import Any, cast
+import logging
+import random
+import re
+import threading
+import time
+from typing import TYPE_CHECKING, Any, cast
 from datetime import datetime
 from dotenv import load_dotenv
-from anthropic import Anthropic
-from anthropic.types.beta import (
-    BetaContentBlockParam,
-    BetaTextBlockParam,
-    BetaImageBlockParam,
-    BetaToolResultBlockParam,
-    BetaToolUseBlockParam,
-    BetaMessageParam,
-)
 
-from scrapybara.anthropic import BashTool, ComputerTool, EditTool, ToolResult
-from scrapybara import Scrapybara
+from budget import AgentBudget
+from config import Config
+from conversation import CACHE_CONTROL, Conversation
+from instance_pool import InstancePool
+from metrics import count, span
+from observers import CompositeObserver, LoggingObserver, LoopObserver, ScreenshotDirectorySink
+from retries import InstanceFailure, is_transient
+from trajectories import Trajectory, TrajectoryDiverged, screenshot_distance, screenshot_fingerprint
+
+# The SDKs, PIL and IPython are imported where they are first used, so importing this
+# module (and the server) stays cheap and never starts a VM or builds an API client.
+if TYPE_CHECKING:
+    from scrapybara.anthropic import ToolResult
 
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Access API keys from .env
 SCRAPYBARA_API_KEY = os.getenv("SCRAPYBARA_API_KEY")
 CLAUDE_API_KEY = os.getenv("CLAUDE_API_KEY")
 
+# Model request settings
+MODEL = "claude-3-5-sonnet-20241022"
+MAX_TOKENS = 4096
+BETAS = ["computer-use-2024-10-22"] + (["prompt-caching-2024-07-31"] if Config.PROMPT_CACHING else [])
+
+# Cache breakpoints placed on the conversation: the latest user message, and the one
+# before it so the prefix written by the previous request is read back. With the system
+# prompt and tools that makes four, the most one request may carry.
+HISTORY_CACHE_BREAKPOINTS = 2
+
+# Retry settings for rate limits, overloads and connection errors
+MAX_MODEL_RETRIES = Config.MODEL_MAX_RETRIES
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+# The verdict line the listener prompt asks for, at the start of a line; a positive or negative verdict
+# ends the session. Text that only mentions the format mid-sentence, e.g. restating the prompt, doesn't
+DECISIVE_ANSWER = re.compile(r"^\s*Answer Type:\s*(positive|negative)\b", re.IGNORECASE | re.MULTILINE)
+
+
+def has_decisive_answer(text: str) -> bool:
+    """Whether a text block states a positive or negative verdict on a line of its own."""
+    return bool(DECISIVE_ANSWER.search(text))
+
+# Clients are created on first use or by startup_agent(), and torn down by shutdown_agent()
+_clients_lock = threading.Lock()
+_anthropic_client = None
+_instance_pool = None
+
+
+def get_anthropic_client():
+    """
+    Return the shared async Anthropic client, creating it on first use.
+
+    ANTHROPIC_BASE_URL points it at a local mock of the messages endpoint. The SDK's own
+    retries are disabled because sampling_loop retries with jittered backoff itself.
+    """
+    global _anthropic_client
+    with _clients_lock:
+        if _anthropic_client is None:
+            from anthropic import AsyncAnthropic
+
+            _anthropic_client = AsyncAnthropic(
+                api_key=CLAUDE_API_KEY,
+                base_url=Config.ANTHROPIC_BASE_URL,
+                max_retries=0,
+            )
+        return _anthropic_client
+
+
+def get_instance_pool(scrapybara_client=None):
+    """
+    Return the shared Scrapybara instance pool, creating it on first use. No VM is started here.
+
+    A stand-in client such as ``fakes.FakeScrapybara`` can be given when the pool is created.
+    """
+    global _instance_pool
+    with _clients_lock:
+        if _instance_pool is None:
+            if scrapybara_client is None:
+                from scrapybara import Scrapybara
+
+                scrapybara_client = Scrapybara(api_key=SCRAPYBARA_API_KEY)
+            _instance_pool = InstancePool(
+                lambda: scrapybara_client.start(instance_type="medium"),
+                max_size=Config.INSTANCE_POOL_MAX_SIZE,
+                warm_spares=Config.INSTANCE_POOL_WARM_SPARES,
+                idle_timeout=Config.INSTANCE_POOL_IDLE_TIMEOUT,
+            )
+        return _instance_pool
+
 
-# Initialize Scrapybara
-scrapybara_client = Scrapybara(api_key=SCRAPYBARA_API_KEY)
-instance = scrapybara_client.start(instance_type="medium")
+def startup_agent(scrapybara_client=None):
+    """
+    Build the API clients and start the instance pool's maintenance thread.
 
-# Initialize Anthropic
-anthropic_client = Anthropic(api_key=CLAUDE_API_KEY)
+    Warm spares are started from that thread, so this returns without waiting for a VM.
+    ``scrapybara_client`` replaces the real client, e.g. with ``fakes.FakeScrapybara``.
+    """
+    get_anthropic_client()
+    get_instance_pool(scrapybara_client).start()
+    logger.info("Agent runtime started.")
+
+
+def shutdown_agent():
+    """Stop every pooled instance and drop the API clients."""
+    global _anthropic_client, _instance_pool
+    with _clients_lock:
+        pool, _instance_pool = _instance_pool, None
+        # The async client's connections belong to the worker event loop and are released with it
+        _anthropic_client = None
+    if pool is not None:
+        pool.close()
+    logger.info("Agent runtime stopped.")
 
 # System prompt from original Computer Use implementation
 SYSTEM_PROMPT = """<SYSTEM_CAPABILITY>
@@ -57,12 +151,31 @@ class ToolCollection:
     """A collection of anthropic-defined tools."""
     def __init__(self, *tools):
         self.tools = tools
-        self.tool_map = {tool.to_params()["name"]: tool for tool in tools}
+        # Tool definitions never change during a session, so build their params once
+        self._params = [tool.to_params() for tool in tools]
+        self._cached_params = list(self._params)
+        if self._cached_params:
+            self._cached_params[-1] = {**self._cached_params[-1], "cache_control": CACHE_CONTROL}
+        self.tool_map = {params["name"]: tool for params, tool in zip(self._params, tools)}
+
+    def to_params(self, cache: bool = False) -> list:
+        """
+        Return the tool params, with a cache breakpoint after the last tool if ``cache`` is set.
 
-    def to_params(self) -> list:
-        return [tool.to_params() for tool in self.tools]
+        The same list is returned every time; don't mutate it.
+        """
+        return self._cached_params if cache else self._params
 
     async def run(self, *, name: str, tool_input: dict[str, Any]) -> ToolResult:
+        """
+        Run a tool call.
+
+        A tool that fails is reported back to the model as an error result, so it can try
+        something else. Connection errors and timeouts mean the VM itself is gone, and
+        raise ``InstanceFailure`` instead.
+        """
+        from scrapybara.anthropic import ToolResult
+
         tool = self.tool_map.get(name)
         if not tool:
             return None
@@ -70,198 +183,502 @@ class ToolCollection:
             r = await tool(**tool_input)
             return r
         except Exception as e:
-            print(f"Error running tool {name}: {e}")
-            return None
+            if is_transient(e):
+                raise InstanceFailure(f"Tool {name} failed: {e}") from e
+            logger.warning(f"Error running tool {name}: {e}")
+            return ToolResult(error=f"Error running tool {name}: {e}")
 
-def _make_api_tool_result(result: ToolResult, tool_use_id: str) -> BetaToolResultBlockParam:
-    tool_result_content: list[BetaTextBlockParam | BetaImageBlockParam] | str = []  # Changed this line
-    is_error = False
-    if result.error:
-        is_error = True
-        tool_result_content = result.error
-    else:
-        if result.output:
-            tool_result_content.append({
-                "type": "text",
-                "text": result.output,
-            })
-        if result.base64_image:
-            tool_result_content.append({
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/png",
-                    "data": result.base64_image,
-                },
-            })
-    return {
-        "type": "tool_result",
-        "content": tool_result_content,
-        "tool_use_id": tool_use_id,
-        "is_error": is_error,
-    }
-
-def _response_to_params(response):
+def _response_to_params(content):
     res = []
-    for block in response.content:
+    for block in content:
         if block.type == "text":
             res.append({"type": "text", "text": block.text})
         else:
             res.append(block.model_dump())
     return res
 
-def _maybe_filter_to_n_most_recent_images(
-    messages: list[BetaMessageParam],
-    images_to_keep: int,
-    min_removal_threshold: int,
-):
-    if images_to_keep is None:
-        return messages
-
-    tool_result_blocks = cast(
-        list[BetaToolResultBlockParam],
-        [
-            item
-            for message in messages
-            for item in (
-                message["content"] if isinstance(message["content"], list) else []
-            )
-            if isinstance(item, dict) and item.get("type") == "tool_result"
-        ],
-    )
+class SessionStats:
+    """Measurements and budget usage collected over one sampling_loop session."""
+
+    def __init__(self):
+        self.turns = []
+        self.retries = 0
+        self.input_tokens = 0
+        self.cache_read_input_tokens = 0
+        self.cache_creation_input_tokens = 0
+        self.output_tokens = 0
+        self.screenshots = 0
+        self.seconds = 0.0
+        self.stop_reason = None
+        # Turns run from a recorded trajectory instead of asked of the model
+        self.replayed_turns = 0
+
+    @property
+    def total_tokens(self) -> int:
+        """Every token billed so far: uncached, cache-read and cache-write input, plus output."""
+        return self.input_tokens + self.cache_read_input_tokens + self.cache_creation_input_tokens + self.output_tokens
+
+    def record_usage(self, usage) -> dict:
+        """
+        Add a response's token usage.
+
+        Returns:
+            dict: The request's uncached input, cache-read input, cache-write input and output tokens.
+        """
+        request_tokens = {
+            "input_tokens": getattr(usage, "input_tokens", None) or 0,
+            "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", None) or 0,
+            "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+            "output_tokens": getattr(usage, "output_tokens", None) or 0,
+        }
+        self.input_tokens += request_tokens["input_tokens"]
+        self.cache_read_input_tokens += request_tokens["cache_read_input_tokens"]
+        self.cache_creation_input_tokens += request_tokens["cache_creation_input_tokens"]
+        self.output_tokens += request_tokens["output_tokens"]
+        return request_tokens
+
+    def record_turn(self, **measurements):
+        """Record a turn's timings and, when given, its request's token counts."""
+        self.turns.append(measurements)
+        logger.info(
+            "Turn %d: first token %.2fs, model %.2fs, tool wait %.2fs, total %.2fs; "
+            "input tokens %d uncached, %d cache read, %d cache write; output tokens %d",
+            len(self.turns),
+            measurements["first_token_seconds"],
+            measurements["model_seconds"],
+            measurements["tool_wait_seconds"],
+            measurements["turn_seconds"],
+            measurements.get("input_tokens", 0),
+            measurements.get("cache_read_input_tokens", 0),
+            measurements.get("cache_creation_input_tokens", 0),
+            measurements.get("output_tokens", 0),
+        )
 
-    total_images = sum(
-        1
-        for tool_result in tool_result_blocks
-        for content in tool_result.get("content", [])
-        if isinstance(content, dict) and content.get("type") == "image"
-    )
+    def summary(self) -> dict:
+        prompt_tokens = self.input_tokens + self.cache_read_input_tokens + self.cache_creation_input_tokens
+        return {
+            "turns": len(self.turns),
+            "retries": self.retries,
+            "model_seconds": sum(turn["model_seconds"] for turn in self.turns),
+            "tool_wait_seconds": sum(turn["tool_wait_seconds"] for turn in self.turns),
+            "input_tokens": self.input_tokens,
+            "cache_read_input_tokens": self.cache_read_input_tokens,
+            "cache_creation_input_tokens": self.cache_creation_input_tokens,
+            "output_tokens": self.output_tokens,
+            "cache_hit_ratio": self.cache_read_input_tokens / prompt_tokens if prompt_tokens else 0.0,
+        }
+
+    def usage(self) -> dict:
+        """What the session consumed of its budget and why it stopped, as stored on the listener row."""
+        return {
+            "turns": len(self.turns),
+            "input_tokens": self.input_tokens,
+            "cache_read_input_tokens": self.cache_read_input_tokens,
+            "cache_creation_input_tokens": self.cache_creation_input_tokens,
+            "output_tokens": self.output_tokens,
+            "screenshots": self.screenshots,
+            "seconds": round(self.seconds, 3),
+            "stop_reason": self.stop_reason,
+            "replayed_turns": self.replayed_turns,
+        }
+
+def default_observer() -> LoopObserver:
+    """
+    Return the observer used when sampling_loop is not given one.
 
-    images_to_remove = total_images - images_to_keep
-    images_to_remove -= images_to_remove % min_removal_threshold
-
-    for tool_result in tool_result_blocks:
-        if isinstance(tool_result.get("content"), list):
-            new_content = []
-            for content in tool_result.get("content", []):
-                if isinstance(content, dict) and content.get("type") == "image":
-                    if images_to_remove > 0:
-                        images_to_remove -= 1
-                        continue
-                new_content.append(content)
-            tool_result["content"] = new_content
-def display_base64_image(base64_string, max_size=(800, 800)):
-    image_data = base64.b64decode(base64_string)
-    image = Image.open(BytesIO(image_data))
-
-    # Resize if larger than max_size while maintaining aspect ratio
-    if image.size[0] > max_size[0] or image.size[1] > max_size[1]:
-        image.thumbnail(max_size, Image.Resampling.LANCZOS)
-
-    display(image)
-
-async def sampling_loop(command: str) -> str:
+    Servers get the no-op observer; setting SCREENSHOT_DIR also writes every screenshot to disk.
+    """
+    if Config.SCREENSHOT_DIR:
+        return ScreenshotDirectorySink(Config.SCREENSHOT_DIR)
+    return LoopObserver()
+
+async def sampling_loop(
+    command: str,
+    stats: SessionStats | None = None,
+    observer: LoopObserver | None = None,
+    budget: AgentBudget | None = None,
+    is_decisive=has_decisive_answer,
+    trajectory: Trajectory | None = None,
+    replay: Trajectory | None = None,
+) -> str:
     """
-    Run the sampling loop for a single command until completion.
+    Run the sampling loop for a single command on a VM leased from the instance pool.
     Returns the final assistant response for logging or saving in the database.
+    Per-turn timings and budget usage are recorded on ``stats`` and loop events are
+    reported to ``observer`` when given. The session stops at the first limit of
+    ``budget`` it reaches, which defaults to the configured one, or once the model
+    completes a text block that passes ``is_decisive``.
+
+    The session's tool-using turns are recorded in ``trajectory`` when given. A ``replay``
+    trajectory recorded by an earlier session of the same command is run first without
+    the model, which is then usually asked only for the verdict; if the page no longer
+    matches the recording, the full agent runs instead.
+
+    If the VM fails mid-session, the session carries on on a fresh one from the last
+    completed turn, up to AGENT_MAX_INSTANCE_RESTARTS times, within the same budget.
     """
-    messages: list[BetaMessageParam] = []
-    tool_collection = ToolCollection(
-        ComputerTool(instance)
-    )
+    stats = stats if stats is not None else SessionStats()
+    conversation = None
+    restarts = 0
+    while True:
+        try:
+            async with get_instance_pool().lease(timeout=Config.INSTANCE_POOL_ACQUIRE_TIMEOUT) as instance:
+                return await _run_sampling_loop(
+                    command, instance, stats, observer, budget, conversation, is_decisive, trajectory, replay
+                )
+        except InstanceFailure as e:
+            if restarts >= Config.AGENT_MAX_INSTANCE_RESTARTS:
+                raise
+            restarts += 1
+            conversation = e.conversation
+            logger.warning(f"VM failed after {len(stats.turns)} turns, resuming on another instance: {e}")
+            count("instance_restart")
+
+async def _run_tool(tool_collection: ToolCollection, name: str, tool_input: dict[str, Any], previous=None):
+    """
+    Run one tool call, after the previous call in the same turn has finished.
 
-    # Add initial command to messages
-    messages.append({
-        "role": "user",
-        "content": [{"type": "text", "text": command}],
-    })
+    Tool calls are started as soon as their block finishes streaming, but they still run
+    in the order the model issued them because they drive the same desktop.
+    """
+    if previous is not None:
+        await previous
+
+    with span("tool", name):
+        result = await tool_collection.run(name=name, tool_input=tool_input)
+    if name == 'bash' and not result:
+        with span("tool", "computer"):
+            result = await tool_collection.run(
+                name="computer",
+                tool_input={"action": "screenshot"}
+            )
+    return result
+
+async def _replay_trajectory(
+    replay: Trajectory,
+    tool_collection: ToolCollection,
+    conversation: Conversation,
+    stats: SessionStats,
+    observer: LoopObserver,
+    trajectory: Trajectory | None = None,
+):
+    """
+    Run a recorded trajectory's tool calls again and add them to the conversation as if the model had made them.
 
-    final_response = ""  # Variable to store the assistant's last response
+    A step's assistant content and tool results are appended once all its calls have run,
+    so the conversation always ends on a completed turn. Steps are TRAJECTORY_STEP_DELAY
+    seconds apart to give the page the time it had between model turns.
 
-    while True:
-        _maybe_filter_to_n_most_recent_images(messages, 2, 2)
-
-        # Get Claude's response
-        response = anthropic_client.beta.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=4096,
-            messages=messages,
-            system=[{"type": "text", "text": SYSTEM_PROMPT}],
-            tools=tool_collection.to_params(),
-            betas=["computer-use-2024-10-22"]
-        )
+    Raises:
+        TrajectoryDiverged: A screenshot differs from the recorded one by more than
+            TRAJECTORY_DIVERGENCE_THRESHOLD.
+    """
+    for number, step in enumerate(replay.steps, start=1):
+        if number > 1:
+            await asyncio.sleep(Config.TRAJECTORY_STEP_DELAY)
+        tool_results = []
+        for block in step["content"]:
+            if block["type"] != "tool_use":
+                continue
+            observer.on_tool_call(block["id"], block["name"], block["input"])
+            result = await _run_tool(tool_collection, block["name"], block["input"])
+            if not result:
+                continue
+            observer.on_tool_result(block["id"], result)
+            if result.base64_image:
+                stats.screenshots += 1
+                observer.on_screenshot(result.base64_image)
+                recorded = step["screenshots"].get(block["id"])
+                if recorded is not None:
+                    replayed = await asyncio.to_thread(screenshot_fingerprint, result.base64_image)
+                    distance = screenshot_distance(recorded, replayed) if replayed else 1.0
+                    if distance > Config.TRAJECTORY_DIVERGENCE_THRESHOLD:
+                        raise TrajectoryDiverged(
+                            f"screenshot of step {number} differs from the recording by {distance:.2f}"
+                        )
+            tool_results.append((block["id"], result))
+
+        conversation.add_assistant(step["content"])
+        conversation.add_tool_results(tool_results)
+        if trajectory is not None:
+            trajectory.record(step["content"], step["screenshots"])
+
+async def _fingerprint_screenshots(tool_results: list) -> dict:
+    """Fingerprint the screenshots among a turn's tool results, by tool_use id, off the event loop."""
+    return {
+        tool_use_id: await asyncio.to_thread(screenshot_fingerprint, result.base64_image)
+        for tool_use_id, result in tool_results
+        if result.base64_image
+    }
+
+async def _cancel_tool_tasks(tool_tasks: list):
+    """Cancel tool calls that are still running and wait until they have all stopped."""
+    for _, task in tool_tasks:
+        task.cancel()
+    await asyncio.gather(*(task for _, task in tool_tasks), return_exceptions=True)
+
+async def _stream_turn(client, tool_collection: ToolCollection, conversation: Conversation, tool_tasks: list, observer: LoopObserver, is_decisive=has_decisive_answer):
+    """
+    Stream one model response, starting each tool call as soon as its tool_use block is complete.
 
-        # Convert response to params
-        response_params = _response_to_params(response)
+    Started tool calls are appended to ``tool_tasks`` as ``(tool_use_id, task)`` pairs.
+    Text is watched for a verdict that passes ``is_decisive`` as it streams. Once the text
+    block holding it is complete the stream is closed, so the rest of the response isn't
+    generated and any tool calls the model would have made after the verdict never start.
 
-        # Process response content and handle tools before adding to messages
-        tool_result_content: list[BetaToolResultBlockParam] = []
+    Returns:
+        tuple: The response content as params, its usage, whether it ended on a decisive
+        verdict, and the seconds until the first streamed token.
+    """
+    started_at = time.perf_counter()
+    first_token_seconds = None
+    verdict_index = None
+    cache = Config.PROMPT_CACHING
+    system = {"type": "text", "text": SYSTEM_PROMPT}
+    async with client.beta.messages.stream(
+        model=MODEL,
+        max_tokens=MAX_TOKENS,
+        messages=conversation.to_params(cache_breakpoints=HISTORY_CACHE_BREAKPOINTS if cache else 0),
+        system=[{**system, "cache_control": CACHE_CONTROL} if cache else system],
+        tools=tool_collection.to_params(cache=cache),
+        betas=BETAS,
+    ) as stream:
+        async for event in stream:
+            if event.type == "content_block_delta":
+                if first_token_seconds is None:
+                    first_token_seconds = time.perf_counter() - started_at
+                if verdict_index is None and event.delta.type == "text_delta":
+                    block = stream.current_message_snapshot.content[event.index]
+                    if is_decisive(block.text):
+                        verdict_index = event.index
+            elif event.type == "content_block_stop":
+                block = stream.current_message_snapshot.content[event.index]
+                # Confirmed on the complete block, as a verdict word seen mid-stream may still run on
+                if event.index == verdict_index and is_decisive(block.text):
+                    # Leaving the stream closes the connection; tool calls already started are cancelled by the caller
+                    response = stream.current_message_snapshot
+                    content = response.content[:verdict_index + 1]
+                    return _response_to_params(content), response.usage, True, first_token_seconds or 0.0
+                if event.index == verdict_index:
+                    verdict_index = None
+                elif block.type == "tool_use":
+                    observer.on_tool_call(block.id, block.name, block.input)
+                    previous = tool_tasks[-1][1] if tool_tasks else None
+                    task = asyncio.create_task(
+                        _run_tool(tool_collection, block.name, cast(dict[str, Any], block.input), previous)
+                    )
+                    tool_tasks.append((block.id, task))
 
-        for content_block in response_params:
-            if content_block["type"] == "text":
-                print(f"\nAssistant: {content_block['text']}")
-                final_response = content_block["text"]  # Save the assistant's response
+        response = await stream.get_final_message()
+
+    return _response_to_params(response.content), response.usage, False, first_token_seconds or 0.0
+
+def _retry_delay(attempt: int, error: Exception) -> float:
+    """Honor the server's retry-after header if present, otherwise use full-jitter exponential backoff."""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), RETRY_MAX_DELAY)
+        except ValueError:
+            pass
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+async def _stream_turn_with_retries(client, tool_collection: ToolCollection, conversation: Conversation, stats: SessionStats, observer: LoopObserver, is_decisive=has_decisive_answer):
+    """
+    Stream one model response, retrying rate limits, overloads and connection errors.
 
-            elif content_block["type"] == "tool_use":
+    A turn is only retried if none of its tool calls has started yet, so no action is
+    ever performed twice.
 
-                # Execute the tool
-                result = await tool_collection.run(
-                    name=content_block["name"],
-                    tool_input=cast(dict[str, Any], content_block["input"])
+    Returns:
+        tuple: The response content as params, its usage, whether it ended on a decisive
+        verdict, the started tool calls, and the seconds until the first token.
+    """
+    import anthropic
+
+    retryable = (anthropic.RateLimitError, anthropic.InternalServerError, anthropic.APIConnectionError)
+    attempt = 0
+    while True:
+        tool_tasks = []
+        try:
+            with span("model_call", MODEL):
+                response_params, usage, decisive, first_token_seconds = await _stream_turn(
+                    client, tool_collection, conversation, tool_tasks, observer, is_decisive
                 )
+            return response_params, usage, decisive, tool_tasks, first_token_seconds
+        except BaseException as e:
+            if tool_tasks or not isinstance(e, retryable) or attempt >= MAX_MODEL_RETRIES:
+                await _cancel_tool_tasks(tool_tasks)
+                raise
+            delay = _retry_delay(attempt, e)
+            logger.warning(f"Model request failed ({e.__class__.__name__}), retrying in {delay:.1f}s.")
+            count("model_retry", e.__class__.__name__)
+            attempt += 1
+            stats.retries += 1
+            await asyncio.sleep(delay)
+
+def _new_conversation(command: str) -> Conversation:
+    conversation = Conversation(
+        images_to_keep=Config.SCREENSHOTS_TO_KEEP,
+        min_removal_threshold=2,
+        jpeg_quality=Config.SCREENSHOT_JPEG_QUALITY,
+    )
+    # Add initial command to messages
+    conversation.add_user_text(command)
+    return conversation
+
+async def _run_sampling_loop(
+    command: str,
+    instance,
+    stats: SessionStats | None = None,
+    observer: LoopObserver | None = None,
+    budget: AgentBudget | None = None,
+    conversation: Conversation | None = None,
+    is_decisive=has_decisive_answer,
+    trajectory: Trajectory | None = None,
+    replay: Trajectory | None = None,
+) -> str:
+    """
+    Run the sampling loop for a single command until completion on the given instance.
 
-                print(f"Result: {result}")
-                if content_block['name'] == 'bash' and not result:
-                    result = await tool_collection.run(
-                        name="computer",
-                        tool_input={"action": "screenshot"}
-                    )
-                    print("Updated result: ", result)
-
-                if result:
-                    print("Converting tool result: ", result)
-                    tool_result = _make_api_tool_result(result, content_block["id"])
-
-                    if result.output:
-                        print(f"\nTool Output: {result.output}")
-                    if result.error:
-                        print(f"\nTool Error: {result.error}")
-                    if result.base64_image:
-                        print("\nTool generated an image (base64 data available)")
-                        display_base64_image(result.base64_image)
-
-                    tool_result_content.append(tool_result)
-
-                    print("\n---")
-
-        # Add assistant's response to messages
-        messages.append({
-            "role": "assistant",
-            "content": response_params,
-        })
-
-        # If tools were used, add their results to messages
-        if tool_result_content:
-            messages.append({
-                "role": "user",
-                "content": tool_result_content
-            })
-        else:
-            # No tools used, task is complete
-            break
+    The loop ends when the model stops calling tools, states a decisive verdict, or a
+    budget limit is reached. In-flight tool calls are cancelled when the session ends
+    early, and a session cut short by its budget returns a neutral answer saying so.
+
+    A ``conversation`` from a session whose VM failed is continued instead of starting
+    over; ``InstanceFailure`` carries the conversation up to the last completed turn.
+
+    Completed tool-using turns are recorded in ``trajectory``. A new session replays
+    ``replay`` first; if it diverges, the session starts over as the full agent.
+    """
+    from scrapybara.anthropic import ComputerTool
+
+    client = get_anthropic_client()
+    stats = stats if stats is not None else SessionStats()
+    observer = observer if observer is not None else default_observer()
+    budget = budget if budget is not None else AgentBudget.default()
+    tool_collection = ToolCollection(
+        ComputerTool(instance)
+    )
+
+    resumed = conversation is not None
+    if not resumed:
+        conversation = _new_conversation(command)
+        if trajectory is not None:
+            trajectory.clear()
+
+    final_response = ""  # Variable to store the assistant's last response
+    tool_tasks = []
+    session_started_at = time.perf_counter()
+
+    # A resumed session only has what is left of its time budget
+    max_seconds = None if budget.max_seconds is None else max(budget.max_seconds - stats.seconds, 0)
+
+    try:
+        async with asyncio.timeout(max_seconds):
+            if replay is not None and not resumed:
+                try:
+                    await _replay_trajectory(replay, tool_collection, conversation, stats, observer, trajectory)
+                    stats.replayed_turns = len(replay)
+                    count("trajectory_replay", "replayed")
+                except TrajectoryDiverged as e:
+                    logger.info(f"Replay diverged, running the full agent: {e}")
+                    count("trajectory_replay", "diverged")
+                    conversation = _new_conversation(command)
+                    if trajectory is not None:
+                        trajectory.clear()
+
+            while True:
+                stats.stop_reason = budget.exhausted(stats)
+                if stats.stop_reason:
+                    break
+
+                # Stream Claude's response; tool calls start while the rest of the message is still arriving
+                turn_started_at = time.perf_counter()
+                response_params, usage, decisive, tool_tasks, first_token_seconds = await _stream_turn_with_retries(
+                    client, tool_collection, conversation, stats, observer, is_decisive
+                )
+                model_finished_at = time.perf_counter()
+                request_tokens = stats.record_usage(usage)
+                for kind, tokens in request_tokens.items():
+                    count("model_tokens", kind, tokens)
+
+                for content_block in response_params:
+                    if content_block["type"] == "text":
+                        observer.on_assistant_text(content_block["text"])
+                        final_response = content_block["text"]  # Save the assistant's response
+
+                # Collect tool results in the order the model issued the calls; after a verdict they can't change the answer
+                tool_results = []
+
+                for tool_use_id, task in ([] if decisive else tool_tasks):
+                    result = await task
+
+                    if result:
+                        # Screenshots are handed over as-is; nothing on this path decodes them
+                        observer.on_tool_result(tool_use_id, result)
+                        if result.base64_image:
+                            stats.screenshots += 1
+                            observer.on_screenshot(result.base64_image)
+
+                        tool_results.append((tool_use_id, result))
+
+                turn_finished_at = time.perf_counter()
+                timings = {
+                    "first_token_seconds": first_token_seconds,
+                    "model_seconds": model_finished_at - turn_started_at,
+                    "tool_wait_seconds": turn_finished_at - model_finished_at,
+                    "turn_seconds": turn_finished_at - turn_started_at,
+                }
+                stats.record_turn(**timings, **request_tokens)
+                observer.on_turn_complete(len(stats.turns), timings)
+
+                if decisive:
+                    stats.stop_reason = "answer"
+                    break
+
+                if trajectory is not None and tool_results:
+                    trajectory.record(response_params, await _fingerprint_screenshots(tool_results))
+
+                # Add assistant's response to messages
+                conversation.add_assistant(response_params)
+
+                # If tools were used, add their results to messages; old screenshots are evicted here
+                if tool_results:
+                    conversation.add_tool_results(tool_results)
+                else:
+                    # No tools used, task is complete
+                    stats.stop_reason = "complete"
+                    break
+    except TimeoutError:
+        stats.stop_reason = "deadline"
+    except InstanceFailure as e:
+        # Nothing of the failed turn was added, so the conversation ends on a completed turn
+        e.conversation = conversation
+        raise
+    finally:
+        stats.seconds += time.perf_counter() - session_started_at
+        await _cancel_tool_tasks(tool_tasks)
+        count("agent_session", stats.stop_reason or "error")
+
+    if stats.stop_reason not in ("answer", "complete"):
+        logger.warning(f"Agent stopped before a verdict, {stats.stop_reason} limit reached: {stats.usage()}")
+        return (
+            "Answer Type: neutral\n"
+            f"Stopped before reaching a verdict because the {stats.stop_reason} limit was reached.\n"
+            f"{final_response}"
+        )
 
-    # Stop the instance after completing the loop
-    instance.stop()
-    print("Scrapybara instance stopped.")
-    
     # Return the final response from the assistant
     return final_response
 
 
 # Main function
 async def main():
+    logging.basicConfig(level=logging.INFO)
     command = "Open supabase.com and tell me what you see on that."
-    await sampling_loop(command)
+    await sampling_loop(command, observer=CompositeObserver(LoggingObserver(), default_observer()))
 
 # Ensure this only runs when main.py is executed directly
 if __name__ == "__main__":
@@ -0,0 +1,340 @@
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Spans kept per listener trace, so a runaway session can't bloat the row
+MAX_TRACE_SPANS = 500
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing count per label combination."""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Observations bucketed by upper bound, with their sum and count, per label combination."""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts, one extra for +Inf, then the sum
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), series):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, [("le", bound)])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Holds the process's metrics and renders them in the Prometheus text format.
+
+    Besides counters and histograms, collectors can be registered: callables returning
+    a flat dict of numbers, such as ``TaskExecutor.metrics``, exported as gauges.
+
+    Args:
+        namespace (str): Prefix of every metric name.
+    """
+
+    def __init__(self, namespace="event_listener"):
+        self.namespace = namespace
+        self._metrics = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._get_or_create(Counter, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, labelnames, buckets)
+
+    def register_collector(self, subsystem, collect):
+        """Export the numeric values of ``collect()`` as gauges named ``<namespace>_<subsystem>_<key>``."""
+        with self._lock:
+            self._collectors[subsystem] = collect
+
+    def collect(self):
+        """Return the current values of every registered collector, keyed on subsystem."""
+        with self._lock:
+            collectors = list(self._collectors.items())
+        return {subsystem: collect() for subsystem, collect in collectors}
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors.items())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for subsystem, collect in collectors:
+            for key, value in _flatten(collect()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{self.namespace}_{subsystem}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _get_or_create(self, cls, name, help_text, labelnames, *args):
+        full_name = f"{self.namespace}_{name}"
+        with self._lock:
+            metric = self._metrics.get(full_name)
+            if metric is None:
+                metric = self._metrics[full_name] = cls(full_name, help_text, tuple(labelnames), *args)
+            return metric
+
+
+def _flatten(values, prefix=""):
+    for key, value in values.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}_")
+        else:
+            yield f"{prefix}{key}", value
+
+
+REGISTRY = MetricsRegistry()
+
+SPAN_SECONDS = REGISTRY.histogram(
+    "operation_seconds",
+    "Duration of instrumented operations.",
+    ("operation", "name", "outcome"),
+)
+
+EVENTS = REGISTRY.counter("events_total", "Counts of notable pipeline events.", ("event", "kind"))
+
+# Spans cost nothing beyond this check while metrics and tracing are both off
+_enabled = True
+
+
+def set_enabled(enabled):
+    """Turn recording of spans and counters on or off for the whole process."""
+    global _enabled
+    _enabled = enabled
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("operation", "name", "trace", "started_at")
+
+    def __init__(self, operation, name, trace):
+        self.operation = operation
+        self.name = name
+        self.trace = trace
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.started_at
+        if exc_type is None:
+            outcome = "ok"
+        elif issubclass(exc_type, asyncio.CancelledError):
+            outcome = "cancelled"
+        else:
+            outcome = "error"
+        if _enabled:
+            SPAN_SECONDS.observe(seconds, operation=self.operation, name=self.name, outcome=outcome)
+        if self.trace is not None:
+            self.trace.add(self.operation, self.name, self.started_at, seconds, outcome)
+        return False
+
+
+def span(operation, name=""):
+    """
+    Time a block as one operation, e.g. ``with span("tool", "computer"):``.
+
+    The duration goes to the operation histogram and to the current listener trace, if any.
+
+    Args:
+        operation (str): The kind of work, such as 'model_call', 'tool' or 'supabase'.
+        name (str): What it was done on, such as a tool name or table.
+    """
+    trace = _current_trace.get()
+    if not _enabled and trace is None:
+        return _NOOP_SPAN
+    return _Span(operation, name, trace)
+
+
+def count(event, kind="", amount=1):
+    """Increment the events counter, e.g. ``count("listener_run", "completed")``."""
+    if _enabled:
+        EVENTS.inc(amount, event=event, kind=kind)
+
+
+class Trace:
+    """
+    The spans recorded while handling one listener, in start order.
+
+    Spans opened in tasks and ``asyncio.to_thread`` calls started inside ``trace()``
+    belong to it, because both inherit the context.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.spans = []
+        self.dropped = 0
+
+    def add(self, operation, name, started_at, seconds, outcome):
+        if len(self.spans) >= MAX_TRACE_SPANS:
+            self.dropped += 1
+            return
+        self.spans.append({
+            "operation": operation,
+            "name": name,
+            "start": round(started_at - self.started_at, 4),
+            "seconds": round(seconds, 4),
+            "outcome": outcome,
+        })
+
+    def to_dict(self):
+        return {
+            "seconds": round(time.perf_counter() - self.started_at, 4),
+            "spans": sorted(self.spans, key=lambda item: item["start"]),
+            "dropped_spans": self.dropped,
+        }
+
+
+@contextlib.contextmanager
+def trace(enabled=True):
+    """
+    Record spans into a new ``Trace`` for the duration of the block.
+
+    Args:
+        enabled (bool): When False, no trace is kept and the block gets None.
+    """
+    if not enabled:
+        yield None
+        return
+    current = Trace()
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+
+
+_WRITE_OPERATIONS = ("select", "insert", "update", "upsert", "delete")
+
+
+class _TimedQuery:
+    """Wraps a Supabase query builder so ``execute()`` is timed as a 'supabase' span."""
+
+    __slots__ = ("_builder", "_table", "_operation")
+
+    def __init__(self, builder, table, operation="select"):
+        self._builder = builder
+        self._table = table
+        self._operation = operation
+
+    def __getattr__(self, attribute):
+        value = getattr(self._builder, attribute)
+        if attribute == "execute":
+            def execute():
+                with span("supabase", f"{self._table}.{self._operation}"):
+                    return value()
+            return execute
+        if not callable(value):
+            # Properties such as 'not_' return the builder itself
+            return _TimedQuery(value, self._table, self._operation) if hasattr(value, "execute") else value
+
+        def call(*args, **kwargs):
+            result = value(*args, **kwargs)
+            if not hasattr(result, "execute"):
+                return result
+            operation = attribute if attribute in _WRITE_OPERATIONS else self._operation
+            return _TimedQuery(result, self._table, operation)
+        return call
+
+
+class InstrumentedSupabase:
+    """
+    Supabase client wrapper that times every query as a 'supabase' span named '<table>.<operation>'.
+
+    Args:
+        client (Client): The Supabase client to wrap.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, name):
+        return _TimedQuery(self._client.table(name), name)
+
+    def __getattr__(self, attribute):
+        return getattr(self._client, attribute)
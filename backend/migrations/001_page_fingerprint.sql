@@ -0,0 +1,5 @@
+-- Fingerprint of the monitored page as of the last completed check, used by the HTTP pre-check
+alter table event_listeners
+    add column if not exists content_hash text,
+    add column if not exists page_etag text,
+    add column if not exists page_last_modified text;
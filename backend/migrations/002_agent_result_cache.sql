@@ -0,0 +1,8 @@
+-- Agent results shared across listeners and backend processes, keyed on (url, event, page fingerprint)
+create table if not exists agent_result_cache (
+    key text primary key,
+    value text not null,
+    expires_at timestamptz not null
+);
+
+create index if not exists agent_result_cache_expires_at_idx on agent_result_cache (expires_at);
@@ -0,0 +1,7 @@
+-- Owner of a listener, for filtering /manage-listeners by user
+alter table event_listeners
+    add column if not exists user_id text;
+
+-- Keyset pagination walks the primary key; these keep filtered pages index-only range scans
+create index if not exists event_listeners_status_id_idx on event_listeners (status, id);
+create index if not exists event_listeners_user_id_id_idx on event_listeners (user_id, id);
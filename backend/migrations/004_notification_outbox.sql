@@ -0,0 +1,16 @@
+-- Notifications waiting to be sent; rows in 'sending' whose next_attempt_at has passed were abandoned and are due again
+create table if not exists notification_outbox (
+    id bigserial primary key,
+    listener_id bigint,
+    channel text not null,
+    recipient text not null,
+    payload jsonb not null,
+    status text not null default 'pending',
+    attempts integer not null default 0,
+    last_error text,
+    created_at timestamptz not null default now(),
+    next_attempt_at timestamptz not null default now(),
+    sent_at timestamptz
+);
+
+create index if not exists notification_outbox_due_idx on notification_outbox (status, next_attempt_at);
@@ -0,0 +1,7 @@
+-- Per-listener overrides of the agent budget (null uses the server default) and the last run's usage
+alter table event_listeners
+    add column if not exists agent_max_turns integer,
+    add column if not exists agent_max_tokens integer,
+    add column if not exists agent_max_screenshots integer,
+    add column if not exists agent_max_seconds integer,
+    add column if not exists budget_usage jsonb;
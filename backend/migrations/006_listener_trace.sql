@@ -0,0 +1,3 @@
+-- Timing spans of the most recent check, recorded when LISTENER_TRACE_ENABLED is set
+alter table event_listeners
+    add column if not exists last_trace jsonb;
@@ -0,0 +1,4 @@
+-- Node holding a listener's lease; while it is set, next_trigger_at is when the lease runs out
+alter table event_listeners add column if not exists lease_owner text;
+
+create index if not exists event_listeners_next_trigger_idx on event_listeners (next_trigger_at) where next_trigger_at is not null;
@@ -0,0 +1,8 @@
+-- Tool calls of each listener's last successful check, replayed so later checks only ask the model for the verdict
+create table if not exists listener_trajectories (
+    listener_id bigint primary key references event_listeners (id) on delete cascade,
+    version integer not null,
+    command_hash text not null,
+    steps jsonb not null,
+    recorded_at timestamptz not null
+);
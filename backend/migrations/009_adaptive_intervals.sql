@@ -0,0 +1,5 @@
+-- Interval bounds the user allows (null keeps the listener's interval) and the interval the scheduling policy adapted to, in seconds
+alter table event_listeners
+    add column if not exists min_interval text,
+    add column if not exists max_interval text,
+    add column if not exists check_interval integer;
@@ -0,0 +1,17 @@
+-- Time of each listener's last write, so processes that don't run listeners can poll for status changes
+alter table event_listeners
+    add column if not exists updated_at timestamptz not null default now();
+
+create or replace function event_listeners_touch_updated_at() returns trigger as $$
+begin
+    new.updated_at = now();
+    return new;
+end;
+$$ language plpgsql;
+
+drop trigger if exists event_listeners_touch_updated_at on event_listeners;
+create trigger event_listeners_touch_updated_at
+    before update on event_listeners
+    for each row execute function event_listeners_touch_updated_at();
+
+create index if not exists event_listeners_updated_at_idx on event_listeners (updated_at, id);
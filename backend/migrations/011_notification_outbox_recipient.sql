@@ -0,0 +1,4 @@
+-- Lets enqueue find the recipient's pending notification whose coalescing window a new one joins
+create index if not exists notification_outbox_recipient_idx
+    on notification_outbox (channel, recipient, next_attempt_at)
+    where status = 'pending';
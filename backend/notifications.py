@@ -0,0 +1,477 @@
+import logging
+import random
+import threading
+import time
+from datetime import timedelta
+
+from metrics import count, span
+from scheduler import SystemClock
+from utils import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Resend accepts at most this many emails per batch request
+RESEND_MAX_BATCH = 100
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter, safe to share between threads.
+
+    Args:
+        rate (float): Tokens added per second.
+        capacity (float, optional): The most tokens that can accumulate. Defaults to ``rate``.
+        clock (callable, optional): Time source in seconds. Defaults to ``time.monotonic``.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens=1):
+        """
+        Take tokens if they are available.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise the seconds until they will be available.
+        """
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens=1, stopped=None):
+        """
+        Block until tokens are available.
+
+        Args:
+            tokens (float): The tokens to take.
+            stopped (threading.Event, optional): Give up early once this is set.
+
+        Returns:
+            bool: True if the tokens were taken.
+        """
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return True
+            if stopped is not None:
+                if stopped.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+
+def render_alert(payload):
+    """Build the subject and HTML body of a single positive-result alert."""
+    event, url, result = payload["event"], payload["url"], payload["result"]
+    subject = "Your Website Monitor Alert - Positive Result"
+    html_content = f"""
+    <p>Hello,</p>
+    <p>The event you are monitoring has occurred:</p>
+    <p><strong>Event:</strong> {event}</p>
+    <p><strong>Result:</strong> {result}</p>
+    <p>Visit the website for more details: <a href="{url}">{url}</a></p>
+    <p>Best regards,<br>Your App Team</p>
+    """
+    return subject, html_content
+
+
+def render_digest(payloads):
+    """Build the subject and HTML body of one email covering several positive results."""
+    subject = f"Your Website Monitor Alert - {len(payloads)} Positive Results"
+    sections = "".join(
+        f"""
+    <hr>
+    <p><strong>Event:</strong> {payload["event"]}</p>
+    <p><strong>Result:</strong> {payload["result"]}</p>
+    <p>Visit the website for more details: <a href="{payload["url"]}">{payload["url"]}</a></p>"""
+        for payload in payloads
+    )
+    html_content = f"""
+    <p>Hello,</p>
+    <p>{len(payloads)} events you are monitoring have occurred:</p>{sections}
+    <hr>
+    <p>Best regards,<br>Your App Team</p>
+    """
+    return subject, html_content
+
+
+class NotificationChannel:
+    """
+    A way of delivering notifications, selected by a listener's 'notification_type'.
+
+    Subclasses resolve the recipient for a listener and deliver messages in batches of
+    at most ``max_batch``.
+    """
+
+    max_batch = 1
+
+    def recipient_for(self, listener):
+        """Return the address to notify for a listener, or None if it can't be notified."""
+        raise NotImplementedError
+
+    def send(self, deliveries):
+        """
+        Deliver a batch of messages. Raising fails the whole batch, which is retried.
+
+        Args:
+            deliveries (list): ``(recipient, payloads)`` pairs. Several payloads for one
+                recipient are sent as a single digest.
+        """
+        raise NotImplementedError
+
+
+class ResendProvider:
+    """Sends emails through Resend's batch API."""
+
+    def send_batch(self, emails):
+        import resend
+
+        return resend.Batch.send(emails)
+
+
+class EmailChannel(NotificationChannel):
+    """
+    Delivers notifications by email, one provider request per batch.
+
+    Args:
+        provider (object): Has ``send_batch(emails)``, such as ``ResendProvider``.
+        sender (str): The verified sender address.
+        recipient (str): Where every listener's notifications go until listeners carry their own address.
+    """
+
+    max_batch = RESEND_MAX_BATCH
+
+    def __init__(self, provider, sender, recipient):
+        self.provider = provider
+        self.sender = sender
+        self.recipient = recipient
+
+    def recipient_for(self, listener):
+        return self.recipient
+
+    def send(self, deliveries):
+        emails = []
+        for recipient, payloads in deliveries:
+            subject, html_content = render_alert(payloads[0]) if len(payloads) == 1 else render_digest(payloads)
+            emails.append({"from": self.sender, "to": [recipient], "subject": subject, "html": html_content})
+        return self.provider.send_batch(emails)
+
+
+class SupabaseOutbox:
+    """
+    Durable queue of notifications in a Supabase table; see migrations/004_notification_outbox.sql.
+
+    Rows are claimed by moving them to 'sending' with a lease, so a crashed sender's
+    notifications become due again once the lease expires. Claiming only succeeds for
+    rows that are still due, so several processes can share the outbox.
+
+    Args:
+        supabase (Client): The Supabase client instance.
+        table (str): The table name.
+    """
+
+    def __init__(self, supabase, table="notification_outbox"):
+        self.supabase = supabase
+        self.table = table
+
+    def add(self, row):
+        response = self.supabase.table(self.table).insert(row).execute()
+        return response.data[0] if response.data else row
+
+    def pending_due(self, channel, recipient):
+        """Return when the recipient's earliest pending notification on a channel is due, or None."""
+        rows = (
+            self.supabase.table(self.table)
+            .select("next_attempt_at")
+            .eq("channel", channel)
+            .eq("recipient", recipient)
+            .eq("status", "pending")
+            .order("next_attempt_at")
+            .limit(1)
+            .execute()
+        ).data
+        return parse_timestamp(rows[0]["next_attempt_at"]) if rows else None
+
+    def claim(self, now, limit, lease_until):
+        due = now.isoformat()
+        candidates = (
+            self.supabase.table(self.table)
+            .select("id")
+            .in_("status", ["pending", "sending"])
+            .lte("next_attempt_at", due)
+            .order("next_attempt_at")
+            .limit(limit)
+            .execute()
+        ).data
+        if not candidates:
+            return []
+        return (
+            self.supabase.table(self.table)
+            .update({"status": "sending", "next_attempt_at": lease_until.isoformat()})
+            .in_("id", [row["id"] for row in candidates])
+            .in_("status", ["pending", "sending"])
+            .lte("next_attempt_at", due)
+            .execute()
+        ).data or []
+
+    def mark_sent(self, ids, now):
+        self.supabase.table(self.table).update({
+            "status": "sent",
+            "sent_at": now.isoformat(),
+        }).in_("id", ids).execute()
+
+    def mark_retry(self, ids, attempts, next_attempt_at, error):
+        self.supabase.table(self.table).update({
+            "status": "pending",
+            "attempts": attempts,
+            "next_attempt_at": next_attempt_at.isoformat(),
+            "last_error": error,
+        }).in_("id", ids).execute()
+
+    def mark_failed(self, ids, attempts, error):
+        self.supabase.table(self.table).update({
+            "status": "failed",
+            "attempts": attempts,
+            "last_error": error,
+        }).in_("id", ids).execute()
+
+
+class NotificationDispatcher:
+    """
+    Sends queued notifications from a background thread.
+
+    ``enqueue`` writes the notification to the outbox and returns. The first notification
+    to a recipient is due after ``coalesce_window`` seconds and later ones join its window,
+    so they are claimed together. The dispatcher claims due rows, groups them per channel and
+    recipient so that several hits within the window go out as one digest, and sends
+    each channel's messages in batches. Every provider request takes a token from the
+    rate limiter. Failed batches are retried with exponential backoff and full jitter
+    until ``max_attempts`` is reached.
+
+    Args:
+        outbox (SupabaseOutbox): Durable storage for queued notifications.
+        channels (dict): ``NotificationChannel`` instances keyed on notification type.
+        default_channel (str): Used for listeners whose type has no channel.
+        rate_limiter (TokenBucket, optional): Limits provider requests.
+        coalesce_window (float): Seconds a notification waits for others to the same recipient.
+        max_attempts (int): Attempts before a notification is marked failed.
+        retry_base_delay (float): Backoff before the first retry, in seconds.
+        retry_max_delay (float): The longest backoff, in seconds.
+        poll_interval (float): Seconds between outbox polls.
+        claim_limit (int): Rows claimed per poll.
+        lease_seconds (float): How long claimed rows are reserved for sending.
+        clock (object, optional): Provides ``now()``. Defaults to ``SystemClock``.
+    """
+
+    def __init__(
+        self,
+        outbox,
+        channels,
+        default_channel="email",
+        rate_limiter=None,
+        coalesce_window=60,
+        max_attempts=5,
+        retry_base_delay=30,
+        retry_max_delay=3600,
+        poll_interval=5,
+        claim_limit=500,
+        lease_seconds=300,
+        clock=None,
+    ):
+        self.outbox = outbox
+        self.channels = channels
+        self.default_channel = default_channel
+        self.rate_limiter = rate_limiter
+        self.coalesce_window = coalesce_window
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.poll_interval = poll_interval
+        self.claim_limit = claim_limit
+        self.lease_seconds = lease_seconds
+        self.clock = clock or SystemClock()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._enqueued = 0
+        self._sent = 0
+        self._digests = 0
+        self._requests = 0
+        self._retried = 0
+        self._failed = 0
+
+    def channel_name_for(self, listener):
+        notification_type = listener.get("notification_type") or self.default_channel
+        if notification_type not in self.channels:
+            logger.warning(
+                f"No '{notification_type}' channel for listener {listener['id']}, using '{self.default_channel}'."
+            )
+            return self.default_channel
+        return notification_type
+
+    def enqueue(self, listener, payload):
+        """
+        Queue a notification for a listener. Blocks on the outbox insert, so call it off the event loop.
+
+        Args:
+            listener (dict): The listener row.
+            payload (dict): 'event', 'url' and 'result' of the positive check.
+
+        Returns:
+            dict or None: The outbox row, or None if the listener has no recipient.
+        """
+        channel_name = self.channel_name_for(listener)
+        recipient = self.channels[channel_name].recipient_for(listener)
+        if recipient is None:
+            logger.warning(f"Listener {listener['id']} has no '{channel_name}' recipient, not notifying.")
+            return None
+
+        now = self.clock.now()
+        due = now + timedelta(seconds=self.coalesce_window)
+        # Join the window of a notification already waiting for this recipient
+        pending = self.outbox.pending_due(channel_name, recipient)
+        if pending is not None:
+            due = min(due, pending)
+        row = self.outbox.add({
+            "listener_id": listener["id"],
+            "channel": channel_name,
+            "recipient": recipient,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "created_at": now.isoformat(),
+            "next_attempt_at": due.isoformat(),
+        })
+        self._count("_enqueued")
+        return row
+
+    def dispatch_due(self):
+        """
+        Claim and send every notification that is due.
+
+        Returns:
+            int: The number of notifications delivered.
+        """
+        now = self.clock.now()
+        rows = self.outbox.claim(now, self.claim_limit, now + timedelta(seconds=self.lease_seconds))
+        if not rows:
+            return 0
+
+        groups = {}
+        for row in rows:
+            groups.setdefault((row["channel"], row["recipient"]), []).append(row)
+
+        by_channel = {}
+        for (channel_name, recipient), group in groups.items():
+            by_channel.setdefault(channel_name, []).append((recipient, group))
+
+        delivered = 0
+        for channel_name, deliveries in by_channel.items():
+            channel = self.channels.get(channel_name)
+            if channel is None:
+                self._fail([row for _, group in deliveries for row in group], f"No '{channel_name}' channel")
+                continue
+            for start in range(0, len(deliveries), channel.max_batch):
+                batch = deliveries[start:start + channel.max_batch]
+                if self.rate_limiter is not None and not self.rate_limiter.acquire(stopped=self._stopped):
+                    # Shutting down; the claimed rows become due again when their lease expires
+                    return delivered
+                delivered += self._send_batch(channel_name, channel, batch)
+        return delivered
+
+    def metrics(self):
+        """
+        Return delivery counters.
+
+        Returns:
+            dict: Lifetime totals.
+        """
+        with self._lock:
+            return {
+                "enqueued": self._enqueued,
+                "sent": self._sent,
+                "digests": self._digests,
+                "requests": self._requests,
+                "retried": self._retried,
+                "failed": self._failed,
+            }
+
+    def start(self):
+        """Start polling the outbox in a background thread."""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="notification-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop polling; queued notifications stay in the outbox for the next start."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.dispatch_due()
+            except Exception as e:
+                logger.error(f"Error dispatching notifications: {e}")
+            self._stopped.wait(self.poll_interval)
+
+    def _send_batch(self, channel_name, channel, batch):
+        rows = [row for _, group in batch for row in group]
+        try:
+            with span("notification", channel_name):
+                channel.send([(recipient, [row["payload"] for row in group]) for recipient, group in batch])
+        except Exception as e:
+            logger.warning(f"Error sending {len(batch)} notifications: {e}")
+            self._count("_requests")
+            self._retry(rows, str(e))
+            return 0
+
+        self.outbox.mark_sent([row["id"] for row in rows], self.clock.now())
+        with self._lock:
+            self._requests += 1
+            self._sent += len(rows)
+            self._digests += sum(1 for _, group in batch if len(group) > 1)
+        count("notification_sent", channel_name, len(rows))
+        return len(rows)
+
+    def _retry(self, rows, error):
+        # Rows claimed together may have different attempt counts; back off each group separately
+        by_attempts = {}
+        for row in rows:
+            by_attempts.setdefault(row.get("attempts", 0) + 1, []).append(row)
+        for attempts, group in by_attempts.items():
+            ids = [row["id"] for row in group]
+            if attempts >= self.max_attempts:
+                logger.error(f"Giving up on notifications {ids} after {attempts} attempts: {error}")
+                self.outbox.mark_failed(ids, attempts, error)
+                self._count("_failed", len(ids))
+                continue
+            delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempts - 1)))
+            self.outbox.mark_retry(ids, attempts, self.clock.now() + timedelta(seconds=delay), error)
+            self._count("_retried", len(ids))
+
+    def _fail(self, rows, error):
+        by_attempts = {}
+        for row in rows:
+            by_attempts.setdefault(row.get("attempts", 0) + 1, []).append(row["id"])
+        for attempts, ids in by_attempts.items():
+            self.outbox.mark_failed(ids, attempts, error)
+            self._count("_failed", len(ids))
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
@@ -0,0 +1,146 @@
+import base64
+import itertools
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+
+class LoopObserver:
+    """
+    Receives events from the agent loop.
+
+    Every method is a no-op, so this class doubles as the default observer for servers.
+    Subclasses override the events they care about. Observers are called on the event
+    loop and must not block; screenshots arrive as the base64 string the tool returned
+    and are never decoded unless an observer chooses to.
+    """
+
+    def on_assistant_text(self, text):
+        pass
+
+    def on_tool_call(self, tool_use_id, name, tool_input):
+        pass
+
+    def on_tool_result(self, tool_use_id, result):
+        pass
+
+    def on_screenshot(self, base64_image):
+        pass
+
+    def on_turn_complete(self, turn, timings):
+        pass
+
+
+class CompositeObserver(LoopObserver):
+    """Forwards every event to several observers."""
+
+    def __init__(self, *observers):
+        self.observers = observers
+
+    def on_assistant_text(self, text):
+        for observer in self.observers:
+            observer.on_assistant_text(text)
+
+    def on_tool_call(self, tool_use_id, name, tool_input):
+        for observer in self.observers:
+            observer.on_tool_call(tool_use_id, name, tool_input)
+
+    def on_tool_result(self, tool_use_id, result):
+        for observer in self.observers:
+            observer.on_tool_result(tool_use_id, result)
+
+    def on_screenshot(self, base64_image):
+        for observer in self.observers:
+            observer.on_screenshot(base64_image)
+
+    def on_turn_complete(self, turn, timings):
+        for observer in self.observers:
+            observer.on_turn_complete(turn, timings)
+
+
+class LoggingObserver(LoopObserver):
+    """Logs a one-line summary of each event. Screenshot payloads are reported by size only."""
+
+    def __init__(self, log=logger, level=logging.INFO):
+        self.log = log
+        self.level = level
+
+    def on_assistant_text(self, text):
+        self.log.log(self.level, f"Assistant: {text}")
+
+    def on_tool_call(self, tool_use_id, name, tool_input):
+        self.log.log(self.level, f"Tool call {name}: {tool_input}")
+
+    def on_tool_result(self, tool_use_id, result):
+        if result.error:
+            self.log.log(self.level, f"Tool error: {result.error}")
+        elif result.output:
+            self.log.log(self.level, f"Tool output: {result.output}")
+
+    def on_screenshot(self, base64_image):
+        self.log.log(self.level, f"Screenshot received ({len(base64_image) * 3 // 4} bytes)")
+
+
+class ScreenshotDirectorySink(LoopObserver):
+    """
+    Writes every screenshot to a directory from a background thread.
+
+    Args:
+        directory (str): Where to write the files; created if missing.
+        prefix (str, optional): File name prefix. Defaults to the current Unix time and a
+            random suffix, so sessions started in the same second don't overwrite each other.
+    """
+
+    _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="screenshot-sink")
+
+    def __init__(self, directory, prefix=None):
+        self.directory = directory
+        self.prefix = prefix or f"{int(time.time())}_{uuid.uuid4().hex[:8]}"
+        self._counter = itertools.count(1)
+        os.makedirs(directory, exist_ok=True)
+
+    def on_screenshot(self, base64_image):
+        path = os.path.join(self.directory, f"{self.prefix}_{next(self._counter):04d}")
+        self._executor.submit(self._write, path, base64_image)
+
+    @staticmethod
+    def _write(path, base64_image):
+        data = base64.b64decode(base64_image)
+        extension = ".jpg" if data[:2] == b"\xff\xd8" else ".png"
+        try:
+            with open(path + extension, "wb") as f:
+                f.write(data)
+        except OSError as e:
+            logger.warning(f"Error writing screenshot {path}{extension}: {e}")
+
+
+class DisplayObserver(LoopObserver):
+    """
+    Shows screenshots inline in a Jupyter notebook, for interactive debugging.
+
+    Args:
+        max_size (tuple[int, int]): Thumbnails larger screenshots to fit this size.
+    """
+
+    def __init__(self, max_size=(800, 800)):
+        self.max_size = max_size
+
+    def on_assistant_text(self, text):
+        print(f"\nAssistant: {text}")
+
+    def on_screenshot(self, base64_image):
+        from PIL import Image
+        from IPython.display import display
+
+        image = Image.open(BytesIO(base64.b64decode(base64_image)))
+
+        # Resize if larger than max_size while maintaining aspect ratio
+        if image.size[0] > self.max_size[0] or image.size[1] > self.max_size[1]:
+            image.thumbnail(self.max_size, Image.Resampling.LANCZOS)
+
+        display(image)
@@ -0,0 +1,144 @@
+import hashlib
+import html
+import ipaddress
+import logging
+import re
+import socket
+import urllib.error
+import urllib.request
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Listener columns that hold the fingerprint of the page as of the last completed check
+FINGERPRINT_COLUMNS = ("content_hash", "page_etag", "page_last_modified")
+
+# Pages larger than this are hashed on their first MAX_CONTENT_BYTES only
+MAX_CONTENT_BYTES = 5 * 1024 * 1024
+
+USER_AGENT = "EventListener-PreCheck/1.0"
+
+_INVISIBLE_BLOCKS = re.compile(
+    r"<(script|style|noscript|template|svg)\b.*?</\1\s*>|<!--.*?-->",
+    re.IGNORECASE | re.DOTALL,
+)
+_TAGS = re.compile(r"<[^>]+>")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class BlockedURLError(urllib.error.URLError):
+    """Raised for a URL the pre-check won't fetch: not http(s), or resolving to an internal address."""
+
+
+def check_destination(url):
+    """
+    Make sure a URL is http(s) and its host resolves only to public addresses.
+
+    Loopback, private, link-local and other non-global addresses are refused, so a listener
+    can't make the server fetch internal services or cloud metadata endpoints.
+
+    Raises:
+        BlockedURLError: If the URL may not be fetched or its host doesn't resolve.
+    """
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError as e:
+        raise BlockedURLError(f"invalid URL: {e}") from None
+    if parts.scheme.lower() not in ("http", "https") or not parts.hostname:
+        raise BlockedURLError(f"only http and https URLs can be fetched, not {url!r}")
+    try:
+        addresses = socket.getaddrinfo(parts.hostname, port or 80, proto=socket.IPPROTO_TCP)
+    except OSError as e:
+        raise BlockedURLError(f"can't resolve {parts.hostname}: {e}") from None
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        if not address.is_global:
+            raise BlockedURLError(f"{parts.hostname} resolves to the non-public address {address}")
+
+
+class _CheckedRedirectHandler(urllib.request.HTTPRedirectHandler):
+    # Every redirect target is checked like the original URL
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_destination(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+_opener = urllib.request.build_opener(_CheckedRedirectHandler)
+
+
+def normalize_content(body):
+    """
+    Reduce an HTML document to its visible text so that markup-only changes don't count.
+
+    Scripts, styles and comments are dropped, tags are stripped, entities are unescaped
+    and whitespace is collapsed.
+
+    Args:
+        body (str): The page body.
+
+    Returns:
+        str: The normalized text.
+    """
+    text = _INVISIBLE_BLOCKS.sub(" ", body)
+    text = _TAGS.sub(" ", text)
+    text = html.unescape(text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def hash_content(body):
+    """Return the SHA-256 hex digest of the normalized page body."""
+    return hashlib.sha256(normalize_content(body).encode("utf-8")).hexdigest()
+
+
+def fingerprint_of(listener):
+    """Return the stored page fingerprint of a listener row, or None if it has never been checked."""
+    if not listener.get("content_hash"):
+        return None
+    return {column: listener.get(column) for column in FINGERPRINT_COLUMNS}
+
+
+def check_page(url, previous=None, timeout=10):
+    """
+    Fetch a page with a conditional request and compare it with the previous fingerprint.
+
+    Only http(s) pages on public addresses are fetched, redirects included; see ``check_destination``.
+
+    Args:
+        url (str): The page to fetch.
+        previous (dict, optional): The fingerprint from the last completed check.
+        timeout (float): Request timeout in seconds.
+
+    Returns:
+        dict: 'changed' (bool) and 'fingerprint' (dict) describing the page now.
+
+    Raises:
+        urllib.error.URLError: If the page could not be fetched, or ``BlockedURLError`` if it may not be.
+    """
+    check_destination(url)
+    headers = {"User-Agent": USER_AGENT, "Accept": "text/html,*/*;q=0.8"}
+    if previous:
+        if previous.get("page_etag"):
+            headers["If-None-Match"] = previous["page_etag"]
+        if previous.get("page_last_modified"):
+            headers["If-Modified-Since"] = previous["page_last_modified"]
+
+    request = urllib.request.Request(url, headers=headers)
+    try:
+        with _opener.open(request, timeout=timeout) as response:
+            charset = response.headers.get_content_charset() or "utf-8"
+            body = response.read(MAX_CONTENT_BYTES).decode(charset, errors="replace")
+            fingerprint = {
+                "content_hash": hash_content(body),
+                "page_etag": response.headers.get("ETag"),
+                "page_last_modified": response.headers.get("Last-Modified"),
+            }
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and previous:
+            return {"changed": False, "fingerprint": previous}
+        raise
+
+    changed = previous is None or previous.get("content_hash") != fingerprint["content_hash"]
+    return {"changed": changed, "fingerprint": fingerprint}
@@ -0,0 +1,227 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from utils import normalize_url, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_event(event):
+    """Normalize an event description so that case and whitespace differences compare equal."""
+    return " ".join(event.split()).casefold()
+
+
+def result_cache_key(url, event, content_hash):
+    """
+    Build the cache key for an agent check.
+
+    Args:
+        url (str): The monitored URL; normalized before hashing.
+        event (str): The event description; case and whitespace are ignored.
+        content_hash (str): The fingerprint of the page the check ran against.
+
+    Returns:
+        str: A SHA-256 hex digest.
+    """
+    raw = "\n".join((normalize_url(url), normalize_event(event), content_hash))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryLRUBackend:
+    """
+    In-process LRU store with per-entry expiry.
+
+    Args:
+        max_entries (int): Least recently used entries are evicted beyond this size.
+        clock (callable, optional): Time source in seconds. Defaults to ``time.monotonic``.
+    """
+
+    def __init__(self, max_entries=1024, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, self.clock() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SupabaseCacheBackend:
+    """
+    Persistent store in a Supabase table, shared by every backend process.
+
+    The table needs 'key' (primary key), 'value' and 'expires_at' columns; see
+    migrations/002_agent_result_cache.sql.
+
+    Args:
+        supabase (Client): The Supabase client instance.
+        table (str): The table name.
+    """
+
+    def __init__(self, supabase, table="agent_result_cache"):
+        self.supabase = supabase
+        self.table = table
+
+    def get(self, key):
+        response = self.supabase.table(self.table).select("value, expires_at").eq("key", key).execute()
+        if not response.data:
+            return None
+        row = response.data[0]
+        if parse_timestamp(row["expires_at"]) <= datetime.now(timezone.utc):
+            return None
+        return row["value"]
+
+    def set(self, key, value, ttl):
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+        self.supabase.table(self.table).upsert({
+            "key": key,
+            "value": value,
+            "expires_at": expires_at.isoformat(),
+        }).execute()
+
+
+class ResultCache:
+    """
+    Caches agent results in front of ``sampling_loop`` and single-flights identical checks.
+
+    Lookups go to the in-memory backend first and then to the optional persistent backend.
+    Concurrent misses for the same key wait on the one computation already in progress
+    instead of starting their own agent session.
+
+    Args:
+        ttl (float): Seconds a result stays valid. Keep it shorter than the shortest listener interval.
+        memory (MemoryLRUBackend, optional): The in-process backend.
+        persistent (object, optional): A backend with ``get(key)`` and ``set(key, value, ttl)``,
+            such as ``SupabaseCacheBackend``. Its calls run off the event loop.
+    """
+
+    def __init__(self, ttl=600, memory=None, persistent=None):
+        self.ttl = ttl
+        self.memory = memory if memory is not None else MemoryLRUBackend()
+        self.persistent = persistent
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+
+    async def get_or_compute(self, key, compute, cacheable=None):
+        """
+        Return the cached result for the key, or run ``compute()`` once and cache its result.
+
+        Failed computations are not cached; every caller waiting on them gets the exception.
+        Callers already waiting get the result either way.
+
+        Args:
+            key (str): The cache key, see ``result_cache_key``.
+            compute (callable): Returns an awaitable producing the result.
+            cacheable (callable, optional): Whether a result may be cached. Defaults to any result.
+
+        Returns:
+            The cached or freshly computed result.
+        """
+        value = await self._lookup(key)
+        if value is not None:
+            self._count("_hits")
+            return value
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            self._count("_coalesced")
+            return await asyncio.shield(future)
+
+        self._count("_misses")
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await compute()
+            if cacheable is None or cacheable(value):
+                await self._store(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; don't let the loop warn about an unretrieved exception
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    async def get(self, key):
+        """Return the cached result for the key, or None."""
+        value = await self._lookup(key)
+        self._count("_hits" if value is not None else "_misses")
+        return value
+
+    async def put(self, key, value):
+        """Cache a result computed outside ``get_or_compute``, e.g. by a batched agent session."""
+        await self._store(key, value)
+
+    def metrics(self):
+        """
+        Return the cache's hit, miss and single-flight counters.
+
+        Returns:
+            dict: Lifetime counters and the number of in-memory entries.
+        """
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "coalesced": self._coalesced,
+                "in_flight": len(self._in_flight),
+                "entries": len(self.memory),
+            }
+
+    async def _lookup(self, key):
+        value = self.memory.get(key)
+        if value is not None or self.persistent is None:
+            return value
+        try:
+            value = await asyncio.to_thread(self.persistent.get, key)
+        except Exception as e:
+            logger.warning(f"Error reading persistent result cache: {e}")
+            return None
+        if value is not None:
+            self.memory.set(key, value, self.ttl)
+        return value
+
+    async def _store(self, key, value):
+        self.memory.set(key, value, self.ttl)
+        if self.persistent is None:
+            return
+        try:
+            await asyncio.to_thread(self.persistent.set, key, value, self.ttl)
+        except Exception as e:
+            logger.warning(f"Error writing persistent result cache: {e}")
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
@@ -0,0 +1,109 @@
+import random
+from datetime import timedelta
+
+from instance_pool import PoolExhaustedError
+
+# HTTP statuses worth retrying: timeouts, conflicts under load, rate limits, server errors and overloads
+TRANSIENT_STATUS_CODES = frozenset({408, 409, 425, 429, 500, 502, 503, 504, 529})
+
+# How far down __cause__/__context__ to look for the underlying error
+MAX_CAUSE_DEPTH = 5
+
+
+class TransientError(Exception):
+    """A failure expected to clear up on its own, so the run is worth retrying."""
+
+
+class InstanceFailure(TransientError):
+    """The VM stopped responding to tool calls; the session can carry on on another one."""
+
+    # The agent's conversation up to its last completed turn, attached by the sampling loop
+    conversation = None
+
+
+def _transport_errors():
+    # The SDKs' connection and timeout errors, when they are installed
+    errors = []
+    try:
+        import httpx
+        errors.append(httpx.TransportError)
+    except ImportError:
+        pass
+    try:
+        import anthropic
+        errors.append(anthropic.APIConnectionError)
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+def is_transient(error):
+    """
+    Check whether an error is a rate limit, timeout, dropped connection or crashed VM.
+
+    The error's cause and context are checked too, so wrapped errors classify like the
+    error they wrap.
+    """
+    transport_errors = _transport_errors()
+    seen = 0
+    while error is not None and seen < MAX_CAUSE_DEPTH:
+        if isinstance(error, (TransientError, TimeoutError, ConnectionError, PoolExhaustedError) + transport_errors):
+            return True
+        if getattr(error, "status_code", None) in TRANSIENT_STATUS_CODES:
+            return True
+        error = error.__cause__ or error.__context__
+        seen += 1
+    return False
+
+
+def classify_failure(error):
+    """Return 'transient' if retrying the failed run may succeed, otherwise 'permanent'."""
+    return "transient" if is_transient(error) else "permanent"
+
+
+class RetryPolicy:
+    """
+    When to retry a listener run that failed, using the listener's 'retry_count' and 'max_retries'.
+
+    Transient failures are retried after an exponential backoff with jitter: the n-th retry
+    waits between half and all of ``base_delay * 2 ** n``, capped at ``max_delay``. The
+    jitter keeps listeners that failed together (an API outage, say) from all coming back
+    at once. Permanent failures, and transient ones once the retries are used up, are not
+    retried; the listener waits for its next interval instead.
+
+    Args:
+        base_delay (float): Seconds before the first retry.
+        max_delay (float): The longest wait between retries, in seconds.
+        default_max_retries (int): Used for listeners without a 'max_retries' value.
+    """
+
+    def __init__(self, base_delay=30, max_delay=1800, default_max_retries=3):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.default_max_retries = default_max_retries
+
+    def delay(self, retry_count):
+        """Seconds to wait before retry number ``retry_count`` (counting from 0)."""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** retry_count)
+        return random.uniform(ceiling / 2, ceiling)
+
+    def next_attempt(self, listener, error, now):
+        """
+        Decide whether a failed run is retried.
+
+        Args:
+            listener (dict): The listener row; 'retry_count' is the retries already made.
+            error (Exception): What the run failed with.
+            now (datetime): When it failed.
+
+        Returns:
+            datetime or None: When to retry, or None if the failure is permanent or the
+            listener has no retries left.
+        """
+        retry_count = listener.get("retry_count") or 0
+        max_retries = listener.get("max_retries")
+        if max_retries is None:
+            max_retries = self.default_max_retries
+        if retry_count >= max_retries or not is_transient(error):
+            return None
+        return now + timedelta(seconds=self.delay(retry_count))
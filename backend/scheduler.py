@@ -0,0 +1,460 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from budget import BUDGET_COLUMNS
+from precheck import FINGERPRINT_COLUMNS
+from scheduling_policy import POLICY_COLUMNS
+from utils import calculate_next_trigger_time, normalize_url, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Columns loaded for every listener the scheduler keeps in memory
+SCHEDULER_FIELDS = (
+    ("id", "event", "url", "interval", "notification_type", "next_trigger_at", "user_id", "retry_count", "max_retries")
+    + FINGERPRINT_COLUMNS
+    + BUDGET_COLUMNS
+    + POLICY_COLUMNS
+)
+SCHEDULER_COLUMNS = ", ".join(SCHEDULER_FIELDS)
+
+# Rows fetched per round trip when bulk-loading listeners at startup
+LOAD_PAGE_SIZE = 1000
+
+# Seconds before due listeners are claimed again after the claim itself failed
+CLAIM_RETRY_DELAY = 5
+
+
+class SystemClock:
+    """Wall clock used by the scheduler in production."""
+
+    def now(self):
+        return datetime.now(timezone.utc)
+
+
+class FakeClock:
+    """
+    Manually advanced clock so the scheduler can be driven without real time.
+
+    Args:
+        start (datetime, optional): The initial time. Defaults to the current UTC time.
+    """
+
+    def __init__(self, start=None):
+        self._now = start or datetime.now(timezone.utc)
+
+    def now(self):
+        return self._now
+
+    def advance(self, seconds):
+        """Move the clock forward by the given number of seconds."""
+        self._now += timedelta(seconds=seconds)
+
+
+class ListenerScheduler:
+    """
+    Keeps listeners in a min-heap keyed on their next trigger time and dispatches them when due.
+
+    Scheduling and cancelling are O(log n). Replaced or removed entries are invalidated
+    lazily and skipped when they reach the top of the heap. Scheduled listeners are also
+    indexed by page, so ``has_companion`` can tell a batcher whether holding a listener
+    for others on its page is worth it.
+
+    Args:
+        supabase (Client): The Supabase client used to load listeners and persist reschedules.
+        dispatch (callable): Called with the listener dict when it becomes due.
+        clock (object, optional): Provides ``now()``. Defaults to ``SystemClock``.
+        status_writer (StatusWriter, optional): Persists reschedules write-behind instead of one update each.
+        sync_interval (float, optional): Seconds between ``sync()`` calls from the background
+            thread, for listeners that other processes insert. None never syncs.
+        leases (ListenerLeases, optional): Claim due listeners before dispatching them, for
+            when several nodes share the table. Listeners another node holds are looked at
+            again when its lease runs out, and no more are popped than the leases have room for.
+        policy (SchedulingPolicy, optional): Decides each listener's next run after one
+            finishes. Without one, listeners run exactly their interval apart.
+    """
+
+    def __init__(
+        self, supabase, dispatch, clock=None, status_writer=None, sync_interval=None, leases=None, policy=None
+    ):
+        self.supabase = supabase
+        self.dispatch = dispatch
+        self.clock = clock or SystemClock()
+        self.status_writer = status_writer
+        self.sync_interval = sync_interval
+        self.leases = leases
+        self.policy = policy
+        # The highest listener id read from the table, where sync() continues from
+        self._last_id = None
+        self._heap = []
+        self._entries = {}
+        # Normalized URL -> ids of the scheduled listeners on that page
+        self._pages = {}
+        # Pages of the listeners popped by run_pending and not yet dispatched
+        self._dispatching = Counter()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self):
+        """
+        Bulk-load every recurring listener from the 'event_listeners' table.
+
+        Returns:
+            int: The number of listeners scheduled.
+        """
+        loaded = 0
+        offset = 0
+        while True:
+            response = (
+                self.supabase.table("event_listeners")
+                .select(SCHEDULER_COLUMNS)
+                .not_.is_("next_trigger_at", "null")
+                .order("id")
+                .range(offset, offset + LOAD_PAGE_SIZE - 1)
+                .execute()
+            )
+            rows = response.data or []
+            for listener in rows:
+                self._schedule_stored(listener)
+                self._last_id = max(self._last_id or listener["id"], listener["id"])
+            loaded += len(rows)
+            if len(rows) < LOAD_PAGE_SIZE:
+                break
+            offset += LOAD_PAGE_SIZE
+
+        logger.info(f"Scheduler loaded {loaded} listeners.")
+        return loaded
+
+    def sync(self):
+        """
+        Schedule listeners inserted since the last ``load()`` or ``sync()``, e.g. by another process.
+
+        New rows are found by id. Listeners this scheduler already holds keep their entry,
+        so a listener scheduled to run right away isn't pushed back to its stored time.
+
+        Returns:
+            int: The number of listeners scheduled.
+        """
+        scheduled = 0
+        while True:
+            builder = (
+                self.supabase.table("event_listeners")
+                .select(SCHEDULER_COLUMNS)
+                .not_.is_("next_trigger_at", "null")
+            )
+            if self._last_id is not None:
+                builder = builder.gt("id", self._last_id)
+            rows = builder.order("id").limit(LOAD_PAGE_SIZE).execute().data or []
+            for listener in rows:
+                self._last_id = listener["id"]
+                with self._lock:
+                    known = listener["id"] in self._entries
+                if not known:
+                    self._schedule_stored(listener)
+                    scheduled += 1
+            if len(rows) < LOAD_PAGE_SIZE:
+                break
+
+        if scheduled:
+            logger.info(f"Scheduler picked up {scheduled} new listeners.")
+        return scheduled
+
+    @property
+    def running(self):
+        """True while the background thread is dispatching listeners."""
+        return self._thread is not None
+
+    def schedule(self, listener, when):
+        """
+        Schedule a listener to be dispatched at the given time, replacing any existing entry.
+
+        Args:
+            listener (dict): The listener row. Must contain 'id'.
+            when (datetime): When the listener becomes due.
+        """
+        # The page is kept on the entry, so the index is cleaned up under the key it was added with
+        entry = [when.timestamp(), next(self._counter), listener, True, _page(listener)]
+        with self._lock:
+            previous = self._entries.get(listener["id"])
+            if previous is not None:
+                previous[3] = False
+                self._unindex(previous)
+            self._entries[listener["id"]] = entry
+            self._pages.setdefault(entry[4], set()).add(listener["id"])
+            heapq.heappush(self._heap, entry)
+            self._maybe_compact()
+            is_next = self._heap[0] is entry
+        if is_next:
+            self._wakeup.set()
+
+    def remove(self, listener_id):
+        """Cancel a scheduled listener. Returns True if it was scheduled."""
+        if self.policy is not None:
+            self.policy.release(listener_id)
+        with self._lock:
+            entry = self._entries.pop(listener_id, None)
+            if entry is None:
+                return False
+            entry[3] = False
+            self._unindex(entry)
+            self._maybe_compact()
+            return True
+
+    def reschedule(self, listener, when=None):
+        """
+        Schedule the listener's next run from its interval and persist 'next_trigger_at'.
+
+        With a policy, the interval is adapted to the run's 'last_outcome', jittered and
+        fitted under the start cap, and the adapted interval is persisted alongside.
+        One-off listeners, or listeners with an unknown interval, are not rescheduled.
+
+        Args:
+            listener (dict): The listener row that just finished running.
+            when (datetime, optional): Run it at this time instead, e.g. to retry a failed run.
+
+        Returns:
+            datetime or None: The next trigger time, if the listener was rescheduled.
+        """
+        policy_fields = {}
+        try:
+            if when is not None:
+                next_trigger_time = when
+            elif self.policy is not None:
+                next_trigger_time, policy_fields = self.policy.next_trigger_time(listener, self.clock.now())
+            else:
+                next_trigger_time = calculate_next_trigger_time(listener.get("interval"), now=self.clock.now())
+        except ValueError as e:
+            logger.info(f"Not rescheduling listener {listener['id']}: {e}")
+            if self.leases is not None:
+                # Clear the lease end too, or the listener would be claimed again once it passes
+                self._persist(listener, {"next_trigger_at": None, **self.leases.release_fields(listener)})
+            return None
+
+        listener.pop("last_outcome", None)
+        listener.update(policy_fields)
+        fields = {"next_trigger_at": next_trigger_time.isoformat(), "trigger_status": "pending", **policy_fields}
+        if self.leases is not None:
+            fields.update(self.leases.release_fields(listener))
+            # The lease handed back makes room for another due listener
+            self._wakeup.set()
+        self._persist(listener, fields)
+
+        listener["next_trigger_at"] = next_trigger_time.isoformat()
+        self.schedule(listener, next_trigger_time)
+        return next_trigger_time
+
+    def defer(self, listener, when):
+        """Put a due listener off until ``when``, handing back its lease so any node can run it then."""
+        if self.leases is not None:
+            try:
+                self.leases.release(listener, when)
+            except Exception as e:
+                logger.error(f"Error releasing the lease on listener {listener['id']}: {e}")
+            self._wakeup.set()
+        self.schedule(listener, when)
+
+    def _schedule_stored(self, listener):
+        # A listener loaded from the table keeps its stored time, and counts against the start cap there
+        when = parse_timestamp(listener["next_trigger_at"])
+        if self.policy is not None:
+            self.policy.book(listener, when, move=False)
+        self.schedule(listener, when)
+
+    def _persist(self, listener, fields):
+        if self.status_writer is not None:
+            self.status_writer.record(listener, **fields)
+        else:
+            try:
+                self.supabase.table("event_listeners").update(fields).eq("id", listener["id"]).execute()
+            except Exception as e:
+                logger.error(f"Error persisting next trigger time for listener {listener['id']}: {e}")
+
+    def next_due(self):
+        """Return the time of the earliest scheduled listener, or None if the heap is empty."""
+        with self._lock:
+            self._drop_invalid_head()
+            if not self._heap:
+                return None
+            return datetime.fromtimestamp(self._heap[0][0], timezone.utc)
+
+    def pop_due(self, limit=None):
+        """
+        Remove and return every listener that is due at the current clock time.
+
+        Args:
+            limit (int, optional): Return at most this many, leaving the rest scheduled.
+
+        Returns:
+            list[dict]: Due listeners, earliest first.
+        """
+        now = self.clock.now().timestamp()
+        due = []
+        with self._lock:
+            while self._heap and (limit is None or len(due) < limit):
+                entry = self._heap[0]
+                if not entry[3]:
+                    heapq.heappop(self._heap)
+                    continue
+                if entry[0] > now:
+                    break
+                heapq.heappop(self._heap)
+                del self._entries[entry[2]["id"]]
+                self._unindex(entry)
+                due.append(entry[2])
+        return due
+
+    def run_pending(self):
+        """
+        Dispatch every listener that is due now.
+
+        Returns:
+            int: The number of listeners dispatched.
+        """
+        due = self.pop_due(self.leases.room() if self.leases is not None else None)
+        if self.leases is not None and due:
+            try:
+                due, later = self.leases.claim(due)
+            except Exception as e:
+                logger.error(f"Error claiming {len(due)} due listeners, retrying shortly: {e}")
+                due, later = [], [(listener, self.clock.now() + timedelta(seconds=CLAIM_RETRY_DELAY)) for listener in due]
+            for listener, when in later:
+                self.schedule(listener, when)
+        pages = [_page(listener) for listener in due]
+        with self._lock:
+            self._dispatching = Counter(pages)
+        for listener, page in zip(due, pages):
+            with self._lock:
+                self._dispatching[page] -= 1
+            try:
+                self.dispatch(listener)
+            except Exception as e:
+                logger.error(f"Error dispatching listener {listener['id']}: {e}")
+        return len(due)
+
+    def has_companion(self, listener, within):
+        """
+        Whether another listener on the same page is due within ``within`` seconds.
+
+        Listeners popped by the current ``run_pending`` and not yet dispatched count as due.
+        """
+        page = _page(listener)
+        horizon = self.clock.now().timestamp() + within
+        with self._lock:
+            if self._dispatching[page] > 0:
+                return True
+            return any(
+                self._entries[listener_id][0] <= horizon
+                for listener_id in self._pages.get(page, ())
+                if listener_id != listener["id"]
+            )
+
+    def start(self):
+        """Start dispatching due listeners from a background thread."""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="listener-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the background thread."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        next_sync = time.monotonic()
+        while not self._stopped.is_set():
+            if self.sync_interval is not None and time.monotonic() >= next_sync:
+                try:
+                    self.sync()
+                except Exception as e:
+                    logger.error(f"Error syncing new listeners: {e}")
+                next_sync = time.monotonic() + self.sync_interval
+            self.run_pending()
+            next_due = self.next_due()
+            delay = None
+            if next_due is not None and not (self.leases is not None and self.leases.room() == 0):
+                # At capacity, wait for a lease to be handed back instead
+                delay = max(0.0, (next_due - self.clock.now()).total_seconds())
+            if self.sync_interval is not None:
+                delay = max(0.0, min(delay if delay is not None else self.sync_interval, next_sync - time.monotonic()))
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
+    def _unindex(self, entry):
+        listener_ids = self._pages.get(entry[4])
+        if listener_ids is not None:
+            listener_ids.discard(entry[2]["id"])
+            if not listener_ids:
+                del self._pages[entry[4]]
+
+    def _drop_invalid_head(self):
+        while self._heap and not self._heap[0][3]:
+            heapq.heappop(self._heap)
+
+    def _maybe_compact(self):
+        # Rebuild once invalidated entries dominate, so the heap stays O(live listeners)
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._entries):
+            self._heap = [entry for entry in self._heap if entry[3]]
+            heapq.heapify(self._heap)
+
+
+def _page(listener):
+    return normalize_url(listener.get("url") or "")
+
+
+class DueBacklog:
+    """
+    Tells a process that doesn't run listeners whether the leader's worker pool is saturated.
+
+    Listeners stay due in the table until the leader finishes them, or with leases until a
+    node claims them, so ``limit`` or more due rows mean a new listener's first check would
+    wait behind a full pool. Counting stops at ``limit``, and the answer is reused for
+    ``max_age`` seconds, so a burst of requests costs one bounded query.
+
+    Args:
+        supabase (Client): The Supabase client instance.
+        limit (int): The due listeners the pool can run and queue at once.
+        max_age (float): Seconds an answer is reused.
+    """
+
+    def __init__(self, supabase, limit, max_age=1.0):
+        self.supabase = supabase
+        self.limit = limit
+        self.max_age = max_age
+        self._full = False
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def full(self):
+        """Whether ``limit`` or more listeners are due. A failed count is taken as room, not as a reason to shed."""
+        with self._lock:
+            if self._checked_at is not None and time.monotonic() - self._checked_at < self.max_age:
+                return self._full
+            self._checked_at = time.monotonic()
+            try:
+                due = (
+                    self.supabase.table("event_listeners")
+                    .select("id")
+                    .lte("next_trigger_at", datetime.now(timezone.utc).isoformat())
+                    .limit(self.limit)
+                    .execute()
+                ).data or []
+            except Exception as e:
+                logger.warning(f"Error counting due listeners: {e}")
+                due = []
+            self._full = len(due) >= self.limit
+            return self._full
@@ -0,0 +1,208 @@
+import hashlib
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from utils import normalize_url, parse_interval
+
+# Listener columns the policy reads: the user's interval bounds and the adapted interval in seconds
+POLICY_COLUMNS = ("min_interval", "max_interval", "check_interval")
+
+
+def interval_bounds(listener):
+    """
+    Return the shortest and longest interval, in seconds, the user allows for a listener.
+
+    Either bound defaults to the listener's interval, so a listener without bounds keeps
+    its interval. Bounds given the wrong way round are swapped.
+
+    Raises:
+        ValueError: If the interval or a bound can't be parsed.
+    """
+    interval = parse_interval(listener.get("interval")).total_seconds()
+    shortest = parse_interval(listener["min_interval"]).total_seconds() if listener.get("min_interval") else interval
+    longest = parse_interval(listener["max_interval"]).total_seconds() if listener.get("max_interval") else interval
+    return min(shortest, longest), max(shortest, longest)
+
+
+class SchedulingPolicy:
+    """
+    Decides when a listener runs next: its adapted interval, a deterministic jitter and a global start cap.
+
+    The interval adapts to what the last run observed, within the bounds the user chose
+    (see ``interval_bounds``): a positive result drops it to the shortest bound, a changed
+    page shortens it by ``shrink``, and an unchanged page, or a result that can't tell,
+    lengthens it by ``growth``. The adapted interval is kept in the 'check_interval' column,
+    so it carries over restarts. Runs report what they observed in the listener's
+    'last_outcome' key: 'positive', 'changed', 'unchanged' or 'negative'.
+
+    Each run is then moved by up to ``jitter`` of its interval either way. The offset is a
+    hash of the page, the interval and the interval cycle, so it is reproducible, averages
+    out, and pulls apart pages whose listeners were created together instead of letting
+    them fire together forever. Listeners on the same page with the same interval get the
+    same offset, so they stay together and can keep running as one batch.
+
+    Finally, no more than ``max_starts_per_slot`` starts are booked in any ``slot_seconds``
+    slot, where the listeners on one page share a start as they run as one batch; a listener
+    landing in a full slot moves to the next one with room or with its page already booked.
+    As concurrency is starts times run length, this keeps the VMs and model calls the
+    schedule asks for within budget, rather than queueing bursts on the worker pool.
+    Bookings are per node, like the worker pool they protect.
+
+    Args:
+        jitter (float): The largest offset, as a fraction of the interval.
+        growth (float): Factor an unchanged page lengthens the interval by.
+        shrink (float): Factor a changed page shortens the interval by.
+        max_starts_per_slot (int, optional): Starts allowed per slot. None is unlimited.
+        slot_seconds (float): The slot length.
+    """
+
+    def __init__(self, jitter=0.1, growth=1.5, shrink=0.5, max_starts_per_slot=None, slot_seconds=60):
+        self.jitter = jitter
+        self.growth = growth
+        self.shrink = shrink
+        self.max_starts_per_slot = max_starts_per_slot
+        self.slot_seconds = slot_seconds
+        # Slot -> listeners booked in it per page; each page is one start
+        self._slots = {}
+        # Listener id -> (slot, page) of its booking
+        self._booked = {}
+        self._pruned_before = None
+        self._lock = threading.Lock()
+        self._lengthened = 0
+        self._shortened = 0
+        self._capped = 0
+
+    def interval(self, listener):
+        """
+        Return the listener's next interval in seconds, adapted to its last outcome and clamped to its bounds.
+
+        Raises:
+            ValueError: If the interval or a bound can't be parsed.
+        """
+        shortest, longest = interval_bounds(listener)
+        current = listener.get("check_interval") or parse_interval(listener.get("interval")).total_seconds()
+        outcome = listener.get("last_outcome")
+        if outcome == "positive":
+            adapted = shortest
+        elif outcome == "changed":
+            adapted = current * self.shrink
+        elif outcome in ("unchanged", "negative"):
+            adapted = current * self.growth
+        else:
+            adapted = current
+        adapted = min(max(adapted, shortest), longest)
+        if adapted != current:
+            with self._lock:
+                if adapted > current:
+                    self._lengthened += 1
+                else:
+                    self._shortened += 1
+        return adapted
+
+    def jitter_seconds(self, page, interval, now):
+        """Return the page's offset for the interval cycle ``now`` falls in, between -jitter and +jitter of it."""
+        cycle = int(now.timestamp() // interval)
+        digest = hashlib.sha256(f"{page}:{interval}:{cycle}".encode("utf-8")).digest()
+        fraction = int.from_bytes(digest[:8], "big") / 2 ** 64
+        return (2 * fraction - 1) * self.jitter * interval
+
+    def next_trigger_time(self, listener, now):
+        """
+        Work out a listener's next run after one that just finished.
+
+        Args:
+            listener (dict): The listener row, with 'last_outcome' set by the run.
+            now (datetime): When the run finished.
+
+        Returns:
+            tuple: The next trigger time, and the columns to store with it.
+
+        Raises:
+            ValueError: If the interval or a bound can't be parsed.
+        """
+        interval = self.interval(listener)
+        page = normalize_url(listener.get("url") or "")
+        when = now + timedelta(seconds=interval + self.jitter_seconds(page, interval, now))
+        shortest, longest = interval_bounds(listener)
+        fields = {"check_interval": round(interval)} if shortest != longest else {}
+        return self.book(listener, when, now), fields
+
+    def book(self, listener, when, now=None, move=True):
+        """
+        Book a start for the listener at ``when``, or in the first later slot with room.
+
+        Any earlier booking of the listener is released. A slot that already has a start
+        booked for the listener's page always has room, as the listener joins that batch.
+        With ``move`` unset the start is booked where it is, full slot or not, as for
+        listeners loaded with a stored time. Returns the booked time.
+        """
+        page = normalize_url(listener.get("url") or "")
+        with self._lock:
+            self._release(listener["id"])
+            slot = int(when.timestamp() // self.slot_seconds)
+            if self.max_starts_per_slot is not None and move:
+                self._prune(now)
+                first = slot
+                while self._full(slot, page):
+                    slot += 1
+                if slot != first:
+                    self._capped += 1
+                    offset = when.timestamp() - first * self.slot_seconds
+                    when = datetime.fromtimestamp(slot * self.slot_seconds + offset, timezone.utc)
+            self._slots.setdefault(slot, Counter())[page] += 1
+            self._booked[listener["id"]] = (slot, page)
+        return when
+
+    def release(self, listener_id):
+        """Drop the listener's booking, e.g. once it is removed."""
+        with self._lock:
+            self._release(listener_id)
+
+    def metrics(self):
+        """
+        Return policy counters.
+
+        Returns:
+            dict: Listeners booked now, and lifetime totals of intervals lengthened and shortened
+            and of starts moved to a later slot by the cap.
+        """
+        with self._lock:
+            return {
+                "booked": len(self._booked),
+                "lengthened": self._lengthened,
+                "shortened": self._shortened,
+                "capped": self._capped,
+            }
+
+    def _full(self, slot, page):
+        pages = self._slots.get(slot)
+        return pages is not None and page not in pages and len(pages) >= self.max_starts_per_slot
+
+    def _release(self, listener_id):
+        booking = self._booked.pop(listener_id, None)
+        if booking is None:
+            return
+        slot, page = booking
+        pages = self._slots.get(slot)
+        if pages is None:
+            return
+        pages[page] -= 1
+        if pages[page] <= 0:
+            del pages[page]
+            if not pages:
+                del self._slots[slot]
+
+    def _prune(self, now):
+        # Forget slots in the past once per slot; their starts can't be moved any more
+        if now is None:
+            return
+        current = int(now.timestamp() // self.slot_seconds)
+        if self._pruned_before == current:
+            return
+        self._pruned_before = current
+        for slot in [slot for slot in self._slots if slot < current]:
+            del self._slots[slot]
+        self._booked = {
+            listener_id: booking for listener_id, booking in self._booked.items() if booking[0] >= current
+        }
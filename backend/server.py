@@ -1,22 +1,40 @@
 # Standard library imports
-import threading
 import asyncio
+import atexit
+import threading
 from datetime import datetime, timedelta, timezone
 import logging  # Import the logging module
 
 # Third-party imports
-from flask import Flask, request, jsonify, abort
+from flask import Flask, Response, request, jsonify, abort, stream_with_context
 from flask_cors import CORS
-from supabase import create_client, Client
-import resend  # Add this import
 
 # Local application imports
-from main import sampling_loop  # Your sampling loop
+from main import SessionStats, get_instance_pool, has_decisive_answer, sampling_loop, startup_agent, shutdown_agent  # Your sampling loop
+from budget import AgentBudget
 from config import Config
+from scheduler import DueBacklog, ListenerScheduler
+from scheduling_policy import SchedulingPolicy, interval_bounds
+from executor import TaskExecutor, QueueFullError
+from precheck import check_page, fingerprint_of
+from result_cache import ResultCache, MemoryLRUBackend, SupabaseCacheBackend, normalize_event, result_cache_key
+from status_writer import StatusWriter, CompositeStatusWriter
+from status_events import StatusBroadcaster, StatusPoller
+from leader import LeaderElection, LeaderLock, LeaderMetricsServer
+from listener_leases import ListenerLeases
+from retries import RetryPolicy, classify_failure
+from batching import ListenerBatcher, batch_is_decisive, batch_prompt, parse_batch_verdicts
+from trajectories import Trajectory, TrajectoryStore
+from notifications import NotificationDispatcher, SupabaseOutbox, EmailChannel, ResendProvider, TokenBucket
+from notifications import render_alert
+from listener_queries import ListenerQuery, parse_cursor
+import metrics
+from metrics import InstrumentedSupabase, count, span, trace
 
 # helper functions
 from utils import calculate_next_trigger_time
 from utils import send_email_notification
+from utils import validate_url
 
 # Configure logging
 logging.basicConfig(
@@ -26,10 +44,20 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def create_app():
+def create_app(supabase_client=None, email_provider=None, scrapybara_client=None):
     """
     Factory function to create and configure the Flask app.
 
+    The scheduler, worker pool, VM pool and notification sender run in one process only.
+    With LEADER_LOCK_PATH set, as under gunicorn (see gunicorn.conf.py), each worker
+    process builds the app but only the one holding the lock starts them; the others
+    serve requests, and take over if the leader exits. Without it this process leads.
+
+    Args:
+        supabase_client (Client, optional): Replaces the Supabase client, e.g. with ``fakes.FakeSupabase``.
+        email_provider (object, optional): Replaces ``ResendProvider``, e.g. with ``fakes.FakeEmailProvider``.
+        scrapybara_client (object, optional): Replaces the Scrapybara client, e.g. with ``fakes.FakeScrapybara``.
+
     Returns:
         Flask app instance.
     """
@@ -37,40 +65,314 @@ def create_app():
     app = Flask(__name__)
     CORS(app)  # Enable CORS for requests from the Chrome extension
 
-    # Initialize Supabase client
-    supabase_client = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
+    # Initialize Supabase client, timing its queries when metrics or traces are recorded
+    metrics.set_enabled(Config.METRICS_ENABLED)
+    if supabase_client is None:
+        # The Supabase and Resend SDKs are slow to import, so load them here rather than at import time
+        from supabase import create_client
+        import resend
+
+        supabase_client = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
+
+        # Set Resend API key
+        resend.api_key = Config.RESEND_API_KEY
+    if Config.METRICS_ENABLED or Config.LISTENER_TRACE_ENABLED:
+        supabase_client = InstrumentedSupabase(supabase_client)
+
+    # The bounded worker pool that runs listener tasks
+    executor = TaskExecutor(
+        concurrency=Config.WORKER_CONCURRENCY,
+        max_queue_size=Config.WORKER_QUEUE_SIZE,
+        retry_after=Config.WORKER_RETRY_AFTER,
+    )
+
+    # Share agent results between listeners watching the same page for the same event
+    result_cache = ResultCache(
+        ttl=Config.RESULT_CACHE_TTL,
+        memory=MemoryLRUBackend(Config.RESULT_CACHE_MAX_ENTRIES),
+        persistent=SupabaseCacheBackend(supabase_client) if Config.RESULT_CACHE_PERSISTENT else None,
+    )
+
+    # Replay each listener's last successful trajectory so repeat checks only ask the model for the verdict
+    trajectories = None
+    if Config.TRAJECTORY_REPLAY_ENABLED:
+        trajectories = TrajectoryStore(
+            supabase_client, max_age=Config.TRAJECTORY_MAX_AGE, max_steps=Config.AGENT_MAX_TURNS
+        )
 
-    # Set Resend API key
-    resend.api_key = Config.RESEND_API_KEY
+    # Batch listener status updates into periodic writes instead of a round trip per transition
+    status_writer = StatusWriter(
+        supabase_client,
+        max_batch=Config.STATUS_WRITER_BATCH_SIZE,
+        flush_interval=Config.STATUS_WRITER_FLUSH_INTERVAL,
+    )
+
+    # Push the same status transitions to subscribed clients; followers poll for them instead
+    broadcaster = StatusBroadcaster(
+        buffer_size=Config.STATUS_EVENTS_BUFFER_SIZE,
+        history_size=Config.STATUS_EVENTS_HISTORY_SIZE,
+    )
+    status_updates = CompositeStatusWriter(status_writer, broadcaster)
+    status_poller = StatusPoller(supabase_client, broadcaster, interval=Config.STATUS_POLL_INTERVAL)
+
+    # Followers can't see the leader's worker pool; they shed load by the listeners left due in the table
+    due_backlog = None
+    if Config.LEADER_LOCK_PATH:
+        due_backlog = DueBacklog(supabase_client, Config.WORKER_CONCURRENCY + Config.WORKER_QUEUE_SIZE)
+
+    # Send notifications from a durable outbox, batched, rate limited and coalesced per recipient
+    notifier = NotificationDispatcher(
+        SupabaseOutbox(supabase_client),
+        channels={"email": EmailChannel(
+            email_provider or ResendProvider(), Config.NOTIFICATION_SENDER, Config.NOTIFICATION_EMAIL
+        )},
+        rate_limiter=TokenBucket(Config.NOTIFICATION_RATE_LIMIT),
+        coalesce_window=Config.NOTIFICATION_COALESCE_WINDOW,
+        max_attempts=Config.NOTIFICATION_MAX_ATTEMPTS,
+        poll_interval=Config.NOTIFICATION_POLL_INTERVAL,
+    )
+
+    # Claim due listeners under a lease, so any number of nodes can share the listener table
+    leases = None
+    if Config.LISTENER_LEASES_ENABLED:
+        leases = ListenerLeases(
+            supabase_client,
+            lease_seconds=Config.LISTENER_LEASE_SECONDS,
+            heartbeat_interval=Config.LISTENER_HEARTBEAT_INTERVAL,
+            max_held=Config.WORKER_CONCURRENCY + Config.WORKER_QUEUE_SIZE,
+        )
+
+    # Retry runs that failed on a rate limit, timeout or crashed VM, backing off between attempts
+    retry_policy = RetryPolicy(base_delay=Config.LISTENER_RETRY_BASE_DELAY, max_delay=Config.LISTENER_RETRY_MAX_DELAY)
+
+    # Spread and adapt listener intervals, and keep the starts the schedule asks for within the worker pool's budget
+    policy = SchedulingPolicy(
+        jitter=Config.SCHEDULE_JITTER,
+        growth=Config.SCHEDULE_INTERVAL_GROWTH,
+        shrink=Config.SCHEDULE_INTERVAL_SHRINK,
+        max_starts_per_slot=Config.SCHEDULE_MAX_STARTS_PER_MINUTE or None,
+    )
+
+    # Hold due listeners briefly so the ones watching the same page share one agent session
+    batcher = None
+    if Config.LISTENER_BATCH_WINDOW > 0:
+        batcher = ListenerBatcher(
+            lambda listeners: dispatch_listeners(
+                listeners, supabase_client, scheduler, executor, result_cache, status_updates, notifier, retry_policy,
+                trajectories,
+            ),
+            window=Config.LISTENER_BATCH_WINDOW,
+            max_size=Config.LISTENER_BATCH_MAX_SIZE,
+            has_companion=lambda listener: scheduler.has_companion(listener, Config.LISTENER_BATCH_WINDOW),
+        )
+
+    # Dispatch recurring listeners as they come due, picking up rows other processes insert
+    scheduler = ListenerScheduler(
+        supabase_client,
+        dispatch=batcher.add if batcher is not None else lambda listener: dispatch_listener(
+            listener, supabase_client, scheduler, executor, result_cache, status_updates, notifier, retry_policy,
+            trajectories,
+        ),
+        status_writer=status_updates,
+        sync_interval=Config.SCHEDULER_SYNC_INTERVAL if Config.LEADER_LOCK_PATH or leases else None,
+        leases=leases,
+        policy=policy,
+    )
+
+    leader = threading.Event()
+    shutdown_lock = threading.Lock()
+    metrics_server = LeaderMetricsServer(app, Config.METRICS_BIND) if Config.METRICS_BIND else None
+
+    def start_background_services():
+        leader.set()
+        status_poller.stop()
+        # Build the model client and start the VM pool; warm spares boot in the background
+        startup_agent(scrapybara_client)
+        executor.start()
+        status_writer.start()
+        notifier.start()
+        if leases is not None:
+            leases.start()
+        if batcher is not None:
+            batcher.start()
+        scheduler.load()
+        scheduler.start()
+        if metrics_server is not None:
+            metrics_server.start()
+
+    election = None
+    if Config.LEADER_LOCK_PATH:
+        status_poller.start()
+        election = LeaderElection(
+            LeaderLock(Config.LEADER_LOCK_PATH), start_background_services, interval=Config.LEADER_RETRY_INTERVAL
+        )
+        election.start()
+    else:
+        start_background_services()
+
+    def shutdown():
+        # Safe to call more than once; later calls wait for the first to finish
+        with shutdown_lock:
+            if election is not None:
+                election.stop()
+            status_poller.stop()
+            broadcaster.close()
+            if leader.is_set():
+                leader.clear()
+                if metrics_server is not None:
+                    metrics_server.stop()
+                shutdown_app(scheduler, executor, status_writer, notifier, Config.SHUTDOWN_TIMEOUT, batcher)
+
+    # Drain running listeners, flush their final statuses and stop the VMs when the process exits.
+    # gunicorn.conf.py starts this as soon as a worker is told to stop.
+    app.extensions["shutdown"] = shutdown
+    atexit.register(shutdown)
+
+    # Export each component's counters as gauges on /metrics
+    for subsystem, collect in (
+        ("worker", executor.metrics),
+        ("instance_pool", get_instance_pool(scrapybara_client).metrics),
+        ("result_cache", result_cache.metrics),
+        ("status_writer", status_writer.metrics),
+        ("status_events", broadcaster.metrics),
+        ("notifications", notifier.metrics),
+        ("scheduling", policy.metrics),
+        *((("leases", leases.metrics),) if leases is not None else ()),
+        *((("batching", batcher.metrics),) if batcher is not None else ()),
+        *((("trajectories", trajectories.metrics),) if trajectories is not None else ()),
+    ):
+        metrics.REGISTRY.register_collector(subsystem, collect)
 
     # Register routes
-    register_routes(app, supabase_client)
+    register_routes(app, supabase_client, scheduler, executor, status_writer, broadcaster, notifier, due_backlog)
 
     return app
 
-def register_routes(app, supabase):
+def register_routes(
+    app, supabase, scheduler, executor, status_writer=None, broadcaster=None, notifier=None, due_backlog=None
+):
     """
     Register route handlers with the Flask app.
 
     Args:
         app (Flask): The Flask app instance.
         supabase (Client): The Supabase client instance.
+        scheduler (ListenerScheduler): The scheduler that runs listeners.
+        executor (TaskExecutor): The worker pool listener tasks run on.
+        status_writer (StatusWriter, optional): The write-behind buffer for listener updates.
+        broadcaster (StatusBroadcaster, optional): Publishes listener status transitions.
+        notifier (NotificationDispatcher, optional): Sends notifications for positive results.
+        due_backlog (DueBacklog, optional): Tells whether the leader's worker pool is saturated,
+            for processes that don't run listeners.
     """
 
+    def follower_response():
+        # Another process runs the components the metrics describe; see Config.METRICS_BIND
+        response = jsonify({"error": "Metrics are served by the process running listeners."})
+        response.headers["Retry-After"] = "1"
+        return response, 503
+
+    @app.route('/worker-metrics', methods=['GET'])
+    def worker_metrics():
+        """
+        Report the worker pool's queue depth and in-flight tasks.
+
+        Returns:
+            Response: JSON response containing the executor metrics, or 503 in a process
+            that isn't running listeners.
+        """
+        if not scheduler.running:
+            return follower_response()
+        metrics = executor.metrics()
+        if status_writer is not None:
+            metrics["status_writer"] = status_writer.metrics()
+        if broadcaster is not None:
+            metrics["status_events"] = broadcaster.metrics()
+        if notifier is not None:
+            metrics["notifications"] = notifier.metrics()
+        return jsonify(metrics), 200
+
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        """
+        Expose operation latencies, event counters and component gauges for Prometheus.
+
+        Returns:
+            Response: The metrics in the Prometheus text format, 404 when metrics are disabled,
+            or 503 in a process that isn't running listeners.
+        """
+        if not Config.METRICS_ENABLED:
+            abort(404)
+        if not scheduler.running:
+            return follower_response()
+        return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+    @app.route('/listener-events', methods=['GET'])
+    def listener_events():
+        """
+        Stream listener status transitions as server-sent events.
+
+        Query parameters:
+            user_id: Only stream this user's listeners.
+            last_event_id: Resume after this event id. EventSource reconnects send the
+                Last-Event-ID header instead.
+
+        Each 'status' event carries the listener id and the changed status columns. A
+        'reset' event means events were missed, or the last event id came from another
+        process, and the list should be re-fetched; a
+        'dropped' event means the client fell behind and should reconnect.
+
+        Returns:
+            Response: A text/event-stream response, or an error message.
+        """
+        if broadcaster is None:
+            abort(404)
+        last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id") or None
+        subscription = broadcaster.subscribe(request.args.get("user_id") or None, last_event_id)
+        response = Response(subscription.iter_sse(Config.STATUS_EVENTS_HEARTBEAT), mimetype="text/event-stream")
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
+
     @app.route('/manage-listeners', methods=['GET'])
     def manage_listeners():
         """
-        Fetch all listeners from the 'event_listeners' table and return them as JSON.
+        Fetch a page of listeners from the 'event_listeners' table and return them as JSON.
+
+        Query parameters:
+            fields: Comma-separated columns to return. Defaults to everything but 'result'.
+            status: Comma-separated statuses to filter on.
+            user_id: Only return this user's listeners.
+            limit: Page size, at most 1000. Defaults to 100.
+            cursor: The 'next_cursor' of the previous page.
+            format: 'ndjson' streams every matching listener from the cursor on, one per line.
+
+        Pages are keyed on id rather than offset, so each one costs the same however
+        large the table is. JSON pages carry an ETag; a matching If-None-Match gets a 304.
 
         Returns:
-            Response: JSON response containing listeners or an error message.
+            Response: JSON response containing listeners and the next cursor, an NDJSON stream, or an error message.
         """
         try:
-            response = supabase.table("event_listeners").select("*").execute()
-            if response.data:
-                return jsonify({"listeners": response.data}), 200
-            else:
-                return jsonify({"message": "No listeners found."}), 200
+            query = ListenerQuery.from_args(request.args)
+            cursor = parse_cursor(request.args.get("cursor"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        try:
+            if request.args.get("format") == "ndjson" or request.accept_mimetypes.best == "application/x-ndjson":
+                return Response(
+                    stream_with_context(query.iter_ndjson(supabase, cursor)),
+                    mimetype="application/x-ndjson",
+                )
+
+            listeners, next_cursor = query.fetch_page(supabase, cursor)
+            body = {"listeners": listeners, "next_cursor": next_cursor}
+            if not listeners and cursor is None:
+                body["message"] = "No listeners found."
+            response = jsonify(body)
+            response.add_etag()
+            return response.make_conditional(request)
         except Exception as e:
             logger.error(f"Error fetching listeners: {e}")
             return jsonify({"error": str(e)}), 500
@@ -80,7 +382,8 @@ def register_routes(app, supabase):
         """
         Handle trigger requests from the frontend.
 
-        Expects JSON data with 'event', 'url', 'interval', and 'notificationType'.
+        Expects JSON data with 'event', 'url', 'interval', and 'notificationType', and optionally 'userId'
+        and the 'minInterval' and 'maxInterval' the check interval may adapt between.
 
         Returns:
             Response: JSON response indicating success or failure.
@@ -93,13 +396,35 @@ def register_routes(app, supabase):
         url = data.get("url")
         interval = data.get("interval")
         notification_type = data.get("notificationType")
+        user_id = data.get("userId")
+        bounds = {"min_interval": data.get("minInterval"), "max_interval": data.get("maxInterval")}
+        bounds = {column: value for column, value in bounds.items() if value}
 
         if not event or not url:
             abort(400, description="Event description and URL are required")
+        try:
+            validate_url(url)
+            calculate_next_trigger_time(interval)
+            interval_bounds({"interval": interval, **bounds})
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # Shed load before writing anything if the worker pool can't take the first run. Only the
+        # process running the scheduler sees the pool; the others go by the due listeners waiting for it
+        leads = scheduler.running
+        full = not executor.has_capacity() if leads else due_backlog is not None and due_backlog.full()
+        if full:
+            logger.warning("Worker queue is full, rejecting trigger request.")
+            response = jsonify({"error": "Too many listeners are being processed. Please retry later."})
+            response.headers["Retry-After"] = str(executor.retry_after)
+            return response, 429
 
         try:
             now = datetime.now(timezone.utc)
             next_trigger_time = calculate_next_trigger_time(interval)
+            # A process that isn't running the scheduler stores the listener as due now, for the leader to
+            # pick up; with leases it is stored as due either way, so the first check can be claimed
+            due_now = not leads or scheduler.leases is not None
 
             # Insert the data into Supabase
             insert_response = supabase.table("event_listeners").insert({
@@ -109,10 +434,12 @@ def register_routes(app, supabase):
                 "notification_type": notification_type,
                 "status": "pending",
                 "last_triggered_at": now.isoformat(),
-                "next_trigger_at": next_trigger_time.isoformat(),
+                "next_trigger_at": (now if due_now else next_trigger_time).isoformat(),
                 "retry_count": 0,
                 "max_retries": 3,
                 "trigger_status": "pending",
+                **({"user_id": user_id} if user_id else {}),
+                **bounds,
             }).execute()
 
             if insert_response.data:
@@ -122,11 +449,20 @@ def register_routes(app, supabase):
                 # Respond to the frontend immediately
                 response = {"message": "Listener added successfully", "listener_id": listener_id}
 
-                # Start a new thread to handle the async task
-                threading.Thread(
-                    target=run_async_task,
-                    args=(listener_id, event, url, supabase)
-                ).start()
+                # Run the first check right away; the scheduler reschedules it afterwards
+                if leads:
+                    scheduler.schedule({
+                        "id": listener_id,
+                        "event": event,
+                        "url": url,
+                        "interval": interval,
+                        "next_trigger_at": next_trigger_time.isoformat(),
+                        "notification_type": notification_type,
+                        "user_id": user_id,
+                        "retry_count": 0,
+                        "max_retries": 3,
+                        **bounds,
+                    }, now)
 
                 return jsonify(response), 200
             else:
@@ -138,85 +474,468 @@ def register_routes(app, supabase):
 
 
 
-def run_async_task(listener_id, event, url, supabase):
+def shutdown_app(scheduler, executor, status_writer=None, notifier=None, timeout=None, batcher=None):
     """
-    Run the async task in a new event loop inside a thread.
+    Stop scheduling new work, let in-flight listener tasks finish and release the VMs.
+
+    Lease heartbeats continue until the last status is flushed, so no other node reclaims
+    a listener that is still draining here.
 
     Args:
-        listener_id (int): The ID of the listener.
-        event (str): The event description.
-        url (str): The URL to monitor.
+        scheduler (ListenerScheduler): The scheduler to stop.
+        executor (TaskExecutor): The worker pool to drain.
+        status_writer (StatusWriter, optional): Flushed once the last task has finished.
+        notifier (NotificationDispatcher, optional): Stopped; unsent notifications stay in the outbox.
+        timeout (float, optional): The longest to wait for in-flight tasks, in seconds.
+        batcher (ListenerBatcher, optional): Stopped, handing the listeners it holds to the worker pool.
+    """
+    logger.info("Shutting down: draining listener tasks.")
+    scheduler.stop()
+    if batcher is not None:
+        batcher.stop()
+    executor.shutdown(wait=True, timeout=timeout)
+    if status_writer is not None:
+        status_writer.close()
+    if scheduler.leases is not None:
+        scheduler.leases.stop()
+    if notifier is not None:
+        notifier.stop()
+    shutdown_agent()
+
+def dispatch_listener(
+    listener, supabase, scheduler, executor, result_cache=None, status_writer=None, notifier=None, retry_policy=None,
+    trajectories=None,
+):
+    """
+    Queue a due listener on the worker pool, deferring it if the pool is saturated.
+
+    Args:
+        listener (dict): The listener row.
+        supabase (Client): The Supabase client instance.
+        scheduler (ListenerScheduler): The scheduler to put the listener back into.
+        executor (TaskExecutor): The worker pool to run the task on.
+        result_cache (ResultCache, optional): Shared cache of agent results.
+        status_writer (StatusWriter, optional): The write-behind buffer for listener updates.
+        notifier (NotificationDispatcher, optional): Queues notifications for positive results.
+        retry_policy (RetryPolicy, optional): When to retry a failed run.
+        trajectories (TrajectoryStore, optional): Recorded agent trajectories to replay.
+    """
+    try:
+        executor.submit(
+            run_listener, listener, supabase, scheduler, result_cache, status_writer, notifier, retry_policy,
+            trajectories,
+        )
+    except QueueFullError as e:
+        logger.warning(f"Worker queue is full, deferring listener {listener['id']} by {e.retry_after}s.")
+        scheduler.defer(listener, scheduler.clock.now() + timedelta(seconds=e.retry_after))
+
+def dispatch_listeners(
+    listeners, supabase, scheduler, executor, result_cache=None, status_writer=None, notifier=None, retry_policy=None,
+    trajectories=None,
+):
+    """
+    Queue a group of due listeners on the same page as one task, deferring them if the pool is saturated.
+
+    A group of one is dispatched as a single listener, and only it replays trajectories.
+    Takes the same arguments as ``dispatch_listener``, with a list of listener rows.
+    """
+    if len(listeners) == 1:
+        dispatch_listener(
+            listeners[0], supabase, scheduler, executor, result_cache, status_writer, notifier, retry_policy,
+            trajectories,
+        )
+        return
+    try:
+        executor.submit(
+            run_listener_batch, listeners, supabase, scheduler, result_cache, status_writer, notifier, retry_policy
+        )
+    except QueueFullError as e:
+        logger.warning(f"Worker queue is full, deferring {len(listeners)} listeners by {e.retry_after}s.")
+        for listener in listeners:
+            scheduler.defer(listener, scheduler.clock.now() + timedelta(seconds=e.retry_after))
+
+async def run_listener(
+    listener, supabase, scheduler, result_cache=None, status_writer=None, notifier=None, retry_policy=None,
+    trajectories=None,
+):
+    """
+    Process a listener on the worker pool and reschedule it once the task finishes.
+
+    A run that failed transiently is rescheduled for its retry rather than its next interval.
+    When listener traces are enabled, the timings of the run are stored in 'last_trace'.
+
+    Args:
+        listener (dict): The listener row.
         supabase (Client): The Supabase client instance.
+        scheduler (ListenerScheduler): The scheduler to put the listener back into.
+        result_cache (ResultCache, optional): Shared cache of agent results.
+        status_writer (StatusWriter, optional): The write-behind buffer for listener updates.
+        notifier (NotificationDispatcher, optional): Queues notifications for positive results.
+        retry_policy (RetryPolicy, optional): When to retry a failed run.
+        trajectories (TrajectoryStore, optional): Recorded agent trajectories to replay.
     """
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    retry_at = None
     try:
-        loop.run_until_complete(process_listener_task(listener_id, event, url, supabase))
+        with trace(Config.LISTENER_TRACE_ENABLED) as listener_trace:
+            with span("listener_run"):
+                retry_at = await process_listener_task(
+                    listener, supabase, result_cache, status_writer, notifier, retry_policy, trajectories
+                )
+        if listener_trace is not None:
+            await save_listener_fields(listener, {"last_trace": listener_trace.to_dict()}, supabase, status_writer)
     finally:
-        loop.close()
+        await asyncio.to_thread(scheduler.reschedule, listener, retry_at)
+
+async def run_listener_batch(
+    listeners, supabase, scheduler, result_cache=None, status_writer=None, notifier=None, retry_policy=None
+):
+    """
+    Process a group of listeners on the same page on the worker pool, then reschedule each.
 
-async def process_listener_task(listener_id, event, url, supabase):
+    Every listener in the group stores the same 'last_trace' when traces are enabled.
+    Takes the same arguments as ``run_listener``, with a list of listener rows.
+    """
+    retry_at = {}
+    try:
+        with trace(Config.LISTENER_TRACE_ENABLED) as listener_trace:
+            with span("listener_batch"):
+                retry_at = await process_listener_batch(
+                    listeners, supabase, result_cache, status_writer, notifier, retry_policy
+                )
+        if listener_trace is not None:
+            for listener in listeners:
+                await save_listener_fields(listener, {"last_trace": listener_trace.to_dict()}, supabase, status_writer)
+    finally:
+        for listener in listeners:
+            await asyncio.to_thread(scheduler.reschedule, listener, retry_at.get(listener["id"]))
+
+async def process_listener_task(
+    listener, supabase, result_cache=None, status_writer=None, notifier=None, retry_policy=None, trajectories=None
+):
     """
     Process the listener task asynchronously.
 
+    The page is first fetched over plain HTTP; the agent only runs if its content changed
+    since the last completed check. The new page fingerprint is stored on the listener.
+    When a result cache is given, listeners checking the same event on the same page
+    content share one agent run, and a positive or negative verdict is reused by later
+    checks; neutral answers are not cached. With a status writer, row updates are queued
+    and written in batches rather than awaited one by one. With a notifier, positive
+    results are queued in its outbox instead of emailed inline. The agent runs within the
+    listener's budget, and what it used is stored in 'budget_usage'.
+
+    A failure is classified as transient (rate limit, timeout, crashed VM) or permanent.
+    With a retry policy, transient failures set the status to 'retrying' and count
+    against the listener's 'max_retries'; the rest mark it 'failed'. A retry after the
+    agent already reached a verdict reuses that verdict instead of running it again. The
+    verdict is only kept in this process's memory, in the listener's 'pending_result' key:
+    if the process stops, or with leases another node reclaims the listener, before the
+    retry runs, the retry runs the agent again.
+
+    With a trajectory store, the tool calls of the listener's last successful check are
+    replayed and the model is asked only for the verdict, falling back to the full agent
+    if the page no longer matches. A run that reaches a verdict records the trajectory for
+    the next check.
+
     Args:
-        listener_id (int): The ID of the listener.
-        event (str): The event description.
-        url (str): The URL to monitor.
+        listener (dict): The listener row ('id', 'event', 'url' and the page fingerprint columns).
         supabase (Client): The Supabase client instance.
+        result_cache (ResultCache, optional): Shared cache of agent results.
+        status_writer (StatusWriter, optional): The write-behind buffer for listener updates.
+        notifier (NotificationDispatcher, optional): Queues notifications for positive results.
+        retry_policy (RetryPolicy, optional): When to retry a failed run.
+        trajectories (TrajectoryStore, optional): Recorded agent trajectories to replay.
+
+    Returns:
+        datetime or None: When to retry the run, if it failed and will be retried.
     """
+    listener_id, event, url = listener["id"], listener["event"], listener["url"]
+    now = datetime.now(timezone.utc)
     try:
-        now = datetime.now(timezone.utc)
-
-        # Update trigger status to "in_progress" and set last_triggered_at
-        supabase.table("event_listeners").update({
-            "trigger_status": "in_progress",
-            "last_triggered_at": now.isoformat()
-        }).eq("id", listener_id).execute()
-
-        # Construct the prompt for the sampling loop
-        prompt = (
-            f"Visit this {url} and your task is to {event}. "
-            "Carefully explore all visible sections, links, banners, and interactive elements on the page. "
-            "Ensure you gather as much relevant information as possible related to the task. "
-            "Do not navigate to external websites or perform searches outside this page. "
-            "Once you have completed your task, start your response with 'Answer Type: positive' if the event occurred, "
-            "'Answer Type: negative' if it did not occur, or 'Answer Type: neutral' if unsure. "
-            "Then provide your detailed findings."
-        )
-
-        # Call the sampling loop and capture the final response
-        final_result = await sampling_loop(prompt)
-
-        # Check if the output indicates a positive response
-        if "Answer Type: positive" in final_result:
-            # Send email notification to a hardcoded email address for now
-            to_email = "karandikarshreyash@gmail.com"
-            subject = "Your Website Monitor Alert - Positive Result"
-            html_content = f"""
-            <p>Hello,</p>
-            <p>The event you are monitoring has occurred:</p>
-            <p><strong>Event:</strong> {event}</p>
-            <p><strong>Result:</strong> {final_result}</p>
-            <p>Visit the website for more details: <a href="{url}">{url}</a></p>
-            <p>Best regards,<br>Your App Team</p>
-            """
-
-            # Send the email
-            send_email_notification(to_email, subject, html_content)
-            logger.info(f"Email sent for positive result for listener {listener_id}.")
+        # Cheap pre-check: skip the agent entirely if the page hasn't changed
+        page = None
+        if Config.PRECHECK_ENABLED and "pending_result" not in listener:
+            page = await precheck_page(listener, fingerprint_of(listener))
+
+        # A retry runs the agent even on an unchanged page, since the last run ended without a verdict
+        if page and not page["changed"] and not listener.get("retry_count"):
+            await skip_unchanged_listener(listener, page, now, supabase, status_writer)
+            return None
+
+        if "pending_result" in listener:
+            # Retrying a run that failed after its verdict, e.g. while queueing the notification
+            page, final_result, usage = listener["pending_result"]
         else:
-            logger.info(f"No email sent for listener {listener_id} as the result is not positive.")
+            # Update trigger status to "in_progress" and set last_triggered_at
+            await save_listener_fields(listener, {
+                "trigger_status": "in_progress",
+                "last_triggered_at": now.isoformat()
+            }, supabase, status_writer)
+
+            # Call the sampling loop and capture the final response, reusing a cached result for this page if there is one
+            budget = AgentBudget.for_listener(listener)
+            stats = SessionStats()
+            command = listener_prompt(url, event)
+            replay = await trajectories.get(listener_id, command) if trajectories is not None else None
+            trajectory = Trajectory() if trajectories is not None else None
+
+            def run_agent():
+                return sampling_loop(command, stats=stats, budget=budget, trajectory=trajectory, replay=replay)
+
+            if result_cache is not None and page:
+                cache_key = result_cache_key(url, event, page["fingerprint"]["content_hash"])
+                # Only a verdict is worth reusing; a neutral answer, e.g. from a session cut short, is asked again
+                final_result = await result_cache.get_or_compute(cache_key, run_agent, cacheable=has_decisive_answer)
+            else:
+                final_result = await run_agent()
+            if trajectories is not None and stats.turns:
+                await trajectories.update(listener_id, command, trajectory, has_decisive_answer(final_result), replay)
+            # A result served from the cache used none of this listener's budget
+            usage = stats.usage() if stats.turns else None
+            listener["pending_result"] = (page, final_result, usage)
 
-        # Update the listener status to "completed" with the final result
-        update_listener_status(listener_id, "completed", final_result, supabase)
+        await complete_listener(listener, final_result, page, usage, supabase, status_writer, notifier)
+        return None
 
     except Exception as e:
-        logger.error(f"Error processing listener {listener_id}: {e}")
-        # Update the listener status to "failed"
-        update_listener_status(listener_id, "failed", str(e), supabase)
+        return await fail_listener(listener, e, now, supabase, status_writer, retry_policy)
+
+async def process_listener_batch(
+    listeners, supabase, result_cache=None, status_writer=None, notifier=None, retry_policy=None
+):
+    """
+    Process several listeners on the same page with one agent session.
+
+    The page is fetched once and compared with each listener's own fingerprint, so
+    listeners whose page is unchanged are skipped as in ``process_listener_task``.
+    Listeners checking the same event share one question, and questions with a cached
+    result for this page content are answered from the cache. The remaining questions
+    go to the agent in one numbered prompt; the verdict for each is parsed out of the
+    answer and completes its listeners as a single check would, notification included.
+    The session runs within the most generous of the listeners' budgets, and each
+    listener stores its usage along with how many questions shared it.
+
+    Args:
+        listeners (list[dict]): Listener rows whose URLs normalize to the same page.
+        supabase (Client): The Supabase client instance.
+        result_cache (ResultCache, optional): Shared cache of agent results.
+        status_writer (StatusWriter, optional): The write-behind buffer for listener updates.
+        notifier (NotificationDispatcher, optional): Queues notifications for positive results.
+        retry_policy (RetryPolicy, optional): When to retry a failed run.
+
+    Returns:
+        dict: When to retry each listener that failed and will be retried, by listener id.
+    """
+    url = listeners[0]["url"]
+    now = datetime.now(timezone.utc)
+    retry_at = {}
+
+    # One unconditional fetch for the group; each listener compares it with its own last fingerprint
+    page = None
+    if Config.PRECHECK_ENABLED and any("pending_result" not in listener for listener in listeners):
+        page = await precheck_page(listeners[0], None)
+
+    questions = {}
+    for listener in listeners:
+        if "pending_result" in listener:
+            continue
+        unchanged = page and listener.get("content_hash") == page["fingerprint"]["content_hash"]
+        if unchanged and not listener.get("retry_count"):
+            try:
+                await skip_unchanged_listener(listener, page, now, supabase, status_writer)
+            except Exception as e:
+                retry_at[listener["id"]] = await fail_listener(listener, e, now, supabase, status_writer, retry_policy)
+            continue
+        questions.setdefault(normalize_event(listener["event"]), []).append(listener)
+
+    asked = [listener for group in questions.values() for listener in group]
+    try:
+        for listener in asked:
+            await save_listener_fields(listener, {
+                "trigger_status": "in_progress",
+                "last_triggered_at": now.isoformat()
+            }, supabase, status_writer)
+
+        # Answer what the cache already knows about this page content
+        cache_keys = {}
+        if result_cache is not None and page:
+            for question, group in list(questions.items()):
+                cache_keys[question] = result_cache_key(url, group[0]["event"], page["fingerprint"]["content_hash"])
+                cached = await result_cache.get(cache_keys[question])
+                if cached is not None:
+                    for listener in questions.pop(question):
+                        listener["pending_result"] = (page, cached, None)
+
+        if questions:
+            events = [group[0]["event"] for group in questions.values()]
+            budget = AgentBudget.for_listeners(asked)
+            stats = SessionStats()
+            if len(events) == 1:
+                answers = [await sampling_loop(listener_prompt(url, events[0]), stats=stats, budget=budget)]
+            else:
+                final_result = await sampling_loop(
+                    batch_prompt(url, events), stats=stats, budget=budget, is_decisive=batch_is_decisive(len(events))
+                )
+                answers = parse_batch_verdicts(final_result, len(events))
+            count("agent_batch", "questions", len(events))
+            usage = {**stats.usage(), "shared_by": len(events)} if stats.turns else None
+            for (question, group), answer in zip(questions.items(), answers):
+                # Events the batched answer left without a verdict are asked again rather than cached as neutral
+                if question in cache_keys and has_decisive_answer(answer):
+                    await result_cache.put(cache_keys[question], answer)
+                for listener in group:
+                    listener["pending_result"] = (page, answer, usage)
+    except Exception as e:
+        for listener in asked:
+            if "pending_result" not in listener:
+                retry_at[listener["id"]] = await fail_listener(listener, e, now, supabase, status_writer, retry_policy)
+
+    for listener in listeners:
+        if "pending_result" not in listener:
+            continue
+        try:
+            page, final_result, usage = listener["pending_result"]
+            await complete_listener(listener, final_result, page, usage, supabase, status_writer, notifier)
+        except Exception as e:
+            retry_at[listener["id"]] = await fail_listener(listener, e, now, supabase, status_writer, retry_policy)
+    return retry_at
+
+def listener_prompt(url, event):
+    """Build the agent prompt for checking one event on a page."""
+    return (
+        f"Visit this {url} and your task is to {event}. "
+        "Carefully explore all visible sections, links, banners, and interactive elements on the page. "
+        "Ensure you gather as much relevant information as possible related to the task. "
+        "Do not navigate to external websites or perform searches outside this page. "
+        "Once you have completed your task, start your response with 'Answer Type: positive' if the event occurred, "
+        "'Answer Type: negative' if it did not occur, or 'Answer Type: neutral' if unsure. "
+        "Then provide your detailed findings."
+    )
+
+async def precheck_page(listener, previous):
+    """Fetch the listener's page for the pre-check. Returns None if it could not be fetched."""
+    try:
+        with span("precheck"):
+            return await asyncio.to_thread(check_page, listener["url"], previous, Config.PRECHECK_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Pre-check failed for listener {listener['id']}, running the agent: {e}")
+        return None
+
+async def skip_unchanged_listener(listener, page, now, supabase, status_writer=None):
+    """Record a check that found the page unchanged since the last completed one."""
+    logger.info(f"Page unchanged for listener {listener['id']}, skipping the agent.")
+    count("listener_run", "unchanged")
+    listener["last_outcome"] = "unchanged"
+    await save_listener_fields(listener, {
+        "last_triggered_at": now.isoformat(),
+        **page["fingerprint"],
+    }, supabase, status_writer)
+    listener.update(page["fingerprint"])
+
+async def complete_listener(listener, final_result, page, usage, supabase, status_writer=None, notifier=None):
+    """
+    Act on a listener's verdict: notify on a positive result and store the result as 'completed'.
+
+    What the run observed is left in the listener's 'last_outcome' for the scheduling policy.
+
+    Args:
+        listener (dict): The listener row.
+        final_result (str): The agent's answer, starting with its 'Answer Type'.
+        page (dict, optional): The pre-check of the page the answer is about.
+        usage (dict, optional): The agent budget the answer used, stored in 'budget_usage'.
+        supabase (Client): The Supabase client instance.
+        status_writer (StatusWriter, optional): The write-behind buffer for listener updates.
+        notifier (NotificationDispatcher, optional): Queues notifications for positive results.
+    """
+    listener_id, event, url = listener["id"], listener["event"], listener["url"]
+    # Without a pre-check there is no telling whether the page changed
+    changed = page is not None and listener.get("content_hash") != page["fingerprint"]["content_hash"]
+    positive = "Answer Type: positive" in final_result
+
+    # Check if the output indicates a positive response
+    if positive:
+        payload = {"event": event, "url": url, "result": final_result}
+        if notifier is not None:
+            await asyncio.to_thread(notifier.enqueue, listener, payload)
+            logger.info(f"Notification queued for positive result for listener {listener_id}.")
+        else:
+            # Send the email directly to the configured address
+            subject, html_content = render_alert(payload)
+            with span("notification", "email"):
+                await asyncio.to_thread(send_email_notification, Config.NOTIFICATION_EMAIL, subject, html_content)
+            logger.info(f"Email sent for positive result for listener {listener_id}.")
+    else:
+        logger.info(f"No email sent for listener {listener_id} as the result is not positive.")
+
+    # Update the listener status to "completed" with the final result and the page it was based on
+    fingerprint = page["fingerprint"] if page else None
+    await save_listener_fields(listener, {
+        "status": "completed",
+        "result": final_result,
+        **(fingerprint or {}),
+        **({"budget_usage": usage} if usage else {}),
+        **({"retry_count": 0} if listener.get("retry_count") else {}),
+    }, supabase, status_writer)
+    if fingerprint:
+        listener.update(fingerprint)
+    listener.pop("pending_result", None)
+    listener["retry_count"] = 0
+    listener["last_outcome"] = "positive" if positive else "changed" if changed else "negative"
+    count("listener_run", "completed")
+
+async def fail_listener(listener, error, now, supabase, status_writer=None, retry_policy=None):
+    """
+    Record a failed run as 'retrying' if the retry policy retries it, otherwise as 'failed'.
+
+    Returns:
+        datetime or None: When to retry the run.
+    """
+    listener_id = listener["id"]
+    kind = classify_failure(error)
+    retry_at = retry_policy.next_attempt(listener, error, now) if retry_policy is not None else None
+    if retry_at is not None:
+        retry_count = (listener.get("retry_count") or 0) + 1
+        logger.warning(
+            f"Error processing listener {listener_id} ({kind}), retry {retry_count} at {retry_at.isoformat()}: {error}"
+        )
+        count("listener_run", "retrying")
+        listener["retry_count"] = retry_count
+        await save_listener_fields(listener, {
+            "status": "retrying", "result": str(error), "retry_count": retry_count,
+        }, supabase, status_writer)
+        return retry_at
+
+    logger.error(f"Error processing listener {listener_id} ({kind}): {error}")
+    count("listener_run", "failed")
+    listener.pop("pending_result", None)
+    # Update the listener status to "failed"; the next interval starts with its retries back
+    reset = {"retry_count": 0} if listener.get("retry_count") else {}
+    listener["retry_count"] = 0
+    await save_listener_fields(listener, {"status": "failed", "result": str(error), **reset}, supabase, status_writer)
+    return None
+
+async def save_listener_fields(listener, fields, supabase, status_writer=None):
+    """
+    Write columns of a listener row without blocking the event loop.
+
+    Args:
+        listener (dict): The listener row.
+        fields (dict): The columns to write.
+        supabase (Client): The Supabase client instance, used when there is no status writer.
+        status_writer (StatusWriter, optional): Queues the write for the next batch instead.
+    """
+    if status_writer is not None:
+        status_writer.record(listener, **fields)
+        return
+    if "status" in fields:
+        extra_fields = {column: value for column, value in fields.items() if column not in ("status", "result")}
+        await asyncio.to_thread(
+            update_listener_status, listener["id"], fields["status"], fields.get("result"), supabase, extra_fields
+        )
+        return
+    await asyncio.to_thread(supabase.table("event_listeners").update(fields).eq("id", listener["id"]).execute)
 
-def update_listener_status(listener_id, status, result, supabase):
+def update_listener_status(listener_id, status, result, supabase, extra_fields=None):
     """
     Update the status and result of a listener in the Supabase table.
 
@@ -225,11 +944,13 @@ def update_listener_status(listener_id, status, result, supabase):
         status (str): The new status ('completed', 'failed', etc.).
         result (str): The result or error message.
         supabase (Client): The Supabase client instance.
+        extra_fields (dict, optional): Additional columns to write in the same update.
     """
     try:
         update_data = {
             "status": status,
-            "result": result
+            "result": result,
+            **(extra_fields or {}),
         }
 
         # Execute the update query
@@ -0,0 +1,70 @@
+"""
+Measure import and startup time of the backend against a fixed budget.
+
+Each step runs in a fresh interpreter so module caching doesn't hide the cost.
+No VM is started and no network call is made.
+
+Usage:
+    python startup_budget.py
+
+Exits non-zero if any step is over budget. Budgets can be overridden with
+IMPORT_MAIN_BUDGET_MS, IMPORT_SERVER_BUDGET_MS and STARTUP_AGENT_BUDGET_MS.
+"""
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (name, setup code, measured code, budget env var, default budget in ms)
+STEPS = [
+    ("import main", "", "import main", "IMPORT_MAIN_BUDGET_MS", 150),
+    ("import server", "", "import server", "IMPORT_SERVER_BUDGET_MS", 750),
+    (
+        "startup_agent()",
+        "import main",
+        "main.startup_agent(); main.shutdown_agent()",
+        "STARTUP_AGENT_BUDGET_MS",
+        4000,
+    ),
+]
+
+TIMER = """
+import time
+{setup}
+start = time.perf_counter()
+{code}
+print((time.perf_counter() - start) * 1000)
+"""
+
+
+def measure(setup, code):
+    """Run the code in a fresh interpreter and return the elapsed milliseconds."""
+    # Placeholder keys let the clients be constructed; nothing is sent with them
+    env = dict(os.environ, INSTANCE_POOL_WARM_SPARES="0")
+    env.setdefault("CLAUDE_API_KEY", "budget-check")
+    env.setdefault("SCRAPYBARA_API_KEY", "budget-check")
+    output = subprocess.run(
+        [sys.executable, "-c", TIMER.format(setup=setup, code=code)],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    over_budget = False
+    for name, setup, code, budget_var, default_budget in STEPS:
+        budget = float(os.getenv(budget_var, default_budget))
+        elapsed = measure(setup, code)
+        status = "ok" if elapsed <= budget else "OVER BUDGET"
+        over_budget = over_budget or elapsed > budget
+        print(f"{name:<20} {elapsed:8.1f} ms  (budget {budget:.0f} ms)  {status}")
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
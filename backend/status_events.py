@@ -0,0 +1,396 @@
+import itertools
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from listener_queries import MAX_PAGE_SIZE
+from utils import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Columns whose changes are pushed to subscribers; 'result' is left for clients to fetch
+EVENT_COLUMNS = ("status", "trigger_status", "last_triggered_at", "next_trigger_at")
+
+# Seconds before the newest write seen that each poll reads again, for writes committed out of order
+POLL_OVERLAP_SECONDS = 5
+
+
+class Subscription:
+    """
+    One client's stream of status events.
+
+    Events are buffered up to ``buffer_size``. A subscriber that falls further behind is
+    dropped rather than allowed to hold up publishers or grow without bound; it can
+    reconnect with its last event id and resume from the broadcaster's history.
+
+    Args:
+        broadcaster (StatusBroadcaster): The broadcaster the subscription belongs to.
+        user_id (str, optional): Only receive this user's listeners. None receives everything.
+        buffer_size (int): Undelivered events kept before the subscriber is dropped.
+    """
+
+    def __init__(self, broadcaster, user_id=None, buffer_size=256):
+        self.broadcaster = broadcaster
+        self.user_id = user_id
+        self.buffer_size = buffer_size
+        self.dropped = False
+        self.closed = False
+        self._events = deque()
+        self._condition = threading.Condition()
+
+    def push(self, event):
+        """Queue an event for delivery. Returns False once the subscriber has been dropped."""
+        with self._condition:
+            if self.dropped or self.closed:
+                return False
+            if len(self._events) >= self.buffer_size:
+                self.dropped = True
+                self._events.clear()
+            else:
+                self._events.append(event)
+            self._condition.notify()
+            return not self.dropped
+
+    def get(self, timeout=None):
+        """
+        Wait for the next event.
+
+        Returns:
+            dict or None: The event, or None on timeout or once dropped or closed.
+        """
+        with self._condition:
+            if not self._events and not (self.dropped or self.closed):
+                self._condition.wait(timeout)
+            if self._events:
+                return self._events.popleft()
+            return None
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify()
+        self.broadcaster.unsubscribe(self)
+
+    def iter_sse(self, heartbeat=15.0):
+        """
+        Yield the subscription as server-sent events until it is dropped or closed.
+
+        A comment line is sent every ``heartbeat`` seconds without events, so proxies
+        keep the connection open and disconnected clients are noticed.
+
+        Yields:
+            str: SSE frames.
+        """
+        try:
+            while True:
+                event = self.get(timeout=heartbeat)
+                if event is not None:
+                    yield format_sse(event["type"], event["data"], event.get("id"))
+                elif self.dropped:
+                    yield format_sse("dropped", {"reason": "Subscriber fell behind; reconnect with Last-Event-ID."})
+                    return
+                elif self.closed:
+                    return
+                else:
+                    yield ": keepalive\n\n"
+        finally:
+            self.close()
+
+
+class StatusBroadcaster:
+    """
+    Fans listener status transitions out to subscribers, per user.
+
+    Implements the ``record(listener, **fields)`` interface of ``StatusWriter`` so it can
+    sit next to the writer in a ``CompositeStatusWriter``. Publishing never blocks: each
+    event is appended to every matching subscriber's bounded buffer. The most recent
+    ``history_size`` events are kept so reconnecting clients can resume from the id of
+    the last event they saw. Event ids are ``<boot id>-<sequence>``, the boot id being
+    random per broadcaster, so an id from another process or from before a restart is
+    recognised as unknown rather than mistaken for one of this broadcaster's.
+
+    Args:
+        buffer_size (int): Per-subscriber buffer, in events.
+        history_size (int): Events retained for resuming.
+        clock (callable, optional): Time source for event timestamps. Defaults to ``time.time``.
+    """
+
+    def __init__(self, buffer_size=256, history_size=10000, clock=time.time):
+        self.buffer_size = buffer_size
+        self.clock = clock
+        self._history = deque(maxlen=history_size)
+        self._subscribers = {}
+        self.boot_id = uuid.uuid4().hex[:12]
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._published = 0
+        self._dropped = 0
+
+    def record(self, listener, **fields):
+        """Publish an event if the update changes a listener's status."""
+        changes = {column: fields[column] for column in EVENT_COLUMNS if column in fields}
+        if "status" in changes or "trigger_status" in changes:
+            self.publish(listener, changes)
+
+    def publish(self, listener, changes):
+        """
+        Send a status event to the listener's owner and to unfiltered subscribers.
+
+        Args:
+            listener (dict): The listener row.
+            changes (dict): The changed columns.
+
+        Returns:
+            str: The event id.
+        """
+        user_id = listener.get("user_id")
+        with self._lock:
+            sequence = next(self._ids)
+            event = {
+                "id": f"{self.boot_id}-{sequence}",
+                "sequence": sequence,
+                "type": "status",
+                "user_id": user_id,
+                "data": {"listener_id": listener["id"], "at": self.clock(), **changes},
+            }
+            self._history.append(event)
+            self._published += 1
+            subscribers = list(self._subscribers.get(user_id, ()))
+            if user_id is not None:
+                subscribers.extend(self._subscribers.get(None, ()))
+
+        for subscription in subscribers:
+            if not subscription.push(event):
+                self._drop(subscription)
+        return event["id"]
+
+    def subscribe(self, user_id=None, last_event_id=None):
+        """
+        Open a subscription, replaying any retained events after ``last_event_id``.
+
+        If events after ``last_event_id`` have already left the history, or there are too
+        many to fit the buffer, the subscription starts with a single 'reset' event telling
+        the client to re-fetch the listener list instead.
+
+        Args:
+            user_id (str, optional): Only receive this user's listeners.
+            last_event_id (str, optional): The id of the last event the client saw.
+
+        Returns:
+            Subscription: The new subscription.
+        """
+        subscription = Subscription(self, user_id, self.buffer_size)
+        with self._lock:
+            if last_event_id is not None:
+                last_seen = self._sequence_of(last_event_id)
+                backlog = [
+                    event for event in self._history
+                    if last_seen is not None and event["sequence"] > last_seen
+                    and (user_id is None or event["user_id"] == user_id)
+                ]
+                # Sequences are consecutive, so a gap between the client's last one and the oldest retained one
+                # means missed events. An id this broadcaster never issued came from another process's broadcaster
+                oldest = self._history[0]["sequence"] if self._history else self._published + 1
+                unknown = last_seen is None or last_seen > self._published
+                if unknown or last_seen + 1 < oldest or len(backlog) >= self.buffer_size:
+                    subscription.push({"type": "reset", "data": {"reason": "Events were missed; re-fetch listeners."}})
+                else:
+                    for event in backlog:
+                        subscription.push(event)
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Remove a subscription. Returns True if it was subscribed."""
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is None or subscription not in subscribers:
+                return False
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.user_id]
+            return True
+
+    def close(self):
+        """End every subscription, e.g. so open event streams don't hold up a shutdown."""
+        with self._lock:
+            subscriptions = [subscription for subscribers in self._subscribers.values() for subscription in subscribers]
+        for subscription in subscriptions:
+            subscription.close()
+
+    def subscribed_users(self):
+        """Return the user ids with open subscriptions; None stands for an unfiltered subscription."""
+        with self._lock:
+            return set(self._subscribers)
+
+    def metrics(self):
+        """
+        Return subscriber and event counters.
+
+        Returns:
+            dict: Current subscribers, retained events and lifetime totals.
+        """
+        with self._lock:
+            return {
+                "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+                "history": len(self._history),
+                "published": self._published,
+                "dropped_subscribers": self._dropped,
+            }
+
+    def _sequence_of(self, event_id):
+        # The sequence number of an id this broadcaster issued, or None
+        boot_id, _, sequence = str(event_id).partition("-")
+        if boot_id != self.boot_id or not sequence.isdigit():
+            return None
+        return int(sequence)
+
+    def _drop(self, subscription):
+        if self.unsubscribe(subscription):
+            with self._lock:
+                self._dropped += 1
+
+
+class StatusPoller:
+    """
+    Publishes status changes made by other processes, found by polling the listener table.
+
+    Only the process that runs listeners sees their transitions as they are recorded. In
+    the others, this reads the subscribed users' listeners written since the last poll,
+    by their 'updated_at' column, every ``interval`` seconds and passes the changes to the
+    broadcaster. Each poll also reads again the last ``POLL_OVERLAP_SECONDS`` before the
+    newest write it saw, so a write that committed late is still found; rows read again
+    unchanged are not published twice. Nothing is read while there are no subscribers.
+
+    See migrations/010_listener_updated_at.sql.
+
+    Args:
+        supabase (Client): The Supabase client instance.
+        broadcaster (StatusBroadcaster): Publishes the changes found.
+        interval (float): Seconds between polls.
+        table (str): The listener table.
+    """
+
+    def __init__(self, supabase, broadcaster, interval=2.0, table="event_listeners"):
+        self.supabase = supabase
+        self.broadcaster = broadcaster
+        self.interval = interval
+        self.table = table
+        self._last_seen = None
+        self._seen = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def poll(self):
+        """
+        Read the subscribed users' listeners written since the last poll and publish what changed.
+
+        The first poll after subscribers appear only notes the newest write, as there is
+        nothing earlier to compare with.
+
+        Returns:
+            int: The number of listeners that changed.
+        """
+        users = self.broadcaster.subscribed_users()
+        if not users:
+            self._reset()
+            return 0
+        if self._last_seen is None:
+            self._last_seen = self._newest_write()
+            return 0
+
+        since = self._last_seen - timedelta(seconds=POLL_OVERLAP_SECONDS)
+        changed = 0
+        offset = 0
+        while True:
+            query = (
+                self.supabase.table(self.table)
+                .select(", ".join(("id", "user_id", "updated_at") + EVENT_COLUMNS))
+                .gt("updated_at", since.isoformat())
+            )
+            # An unfiltered subscriber already receives every user's events
+            if None not in users:
+                query = query.in_("user_id", sorted(users))
+            rows = query.order("updated_at").order("id").range(offset, offset + MAX_PAGE_SIZE - 1).execute().data or []
+            for row in rows:
+                updated_at = parse_timestamp(row["updated_at"])
+                self._last_seen = max(self._last_seen, updated_at)
+                state = tuple(row.get(column) for column in EVENT_COLUMNS)
+                previous = self._seen.get(row["id"])
+                self._seen[row["id"]] = (state, updated_at)
+                if previous is not None and previous[0] == state:
+                    continue
+                changes = {
+                    column: new for index, (column, new) in enumerate(zip(EVENT_COLUMNS, state))
+                    if previous is None or previous[0][index] != new
+                }
+                self.broadcaster.record(row, **changes)
+                changed += 1
+            if len(rows) < MAX_PAGE_SIZE:
+                break
+            offset += MAX_PAGE_SIZE
+
+        # Rows older than the next poll's window are never read again
+        horizon = self._last_seen - timedelta(seconds=POLL_OVERLAP_SECONDS)
+        self._seen = {listener_id: seen for listener_id, seen in self._seen.items() if seen[1] > horizon}
+        return changed
+
+    def start(self):
+        """Start polling from a background thread."""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="status-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._reset()
+
+    def _reset(self):
+        self._last_seen = None
+        self._seen = {}
+
+    def _newest_write(self):
+        rows = (
+            self.supabase.table(self.table)
+            .select("updated_at")
+            .order("updated_at", desc=True)
+            .limit(1)
+            .execute()
+        ).data
+        return parse_timestamp(rows[0]["updated_at"]) if rows else datetime.fromtimestamp(0, timezone.utc)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Error polling listener statuses: {e}")
+
+
+def format_sse(event_type, data, event_id=None):
+    """
+    Format one server-sent event frame.
+
+    Args:
+        event_type (str): The event name.
+        data (dict): The payload, sent as JSON.
+        event_id (str, optional): The id clients send back as Last-Event-ID.
+
+    Returns:
+        str: The frame.
+    """
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
@@ -0,0 +1,152 @@
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class StatusWriter:
+    """
+    Write-behind buffer for listener row updates.
+
+    ``record`` only merges the new column values into the pending changes for that listener,
+    so it never blocks the event loop and successive transitions of one listener collapse
+    into a single write. A background thread flushes pending changes when ``max_batch``
+    listeners are pending or every ``flush_interval`` seconds, and ``close`` flushes
+    whatever is left.
+
+    Changes are written as updates, never upserts, so a listener deleted meanwhile stays
+    deleted and a partial row is never taken for an insert.
+
+    Args:
+        supabase (Client): The Supabase client instance.
+        table (str): The table to write to.
+        max_batch (int): Flush as soon as this many listeners have pending changes.
+        flush_interval (float): The longest a change waits before being flushed, in seconds.
+    """
+
+    def __init__(self, supabase, table="event_listeners", max_batch=100, flush_interval=1.0):
+        self.supabase = supabase
+        self.table = table
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._recorded = 0
+        self._written_rows = 0
+        self._batches = 0
+        self._errors = 0
+
+    def record(self, listener, **fields):
+        """
+        Queue column updates for a listener.
+
+        Args:
+            listener (dict): The listener row.
+            **fields: The columns to update.
+        """
+        with self._lock:
+            self._pending.setdefault(listener["id"], {}).update(fields)
+            self._recorded += 1
+            full = len(self._pending) >= self.max_batch
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Write every pending change now.
+
+        Listeners with identical changes, such as a batch of them set 'in_progress' at once,
+        share one update filtered on their ids; every other listener gets its own update.
+
+        Returns:
+            int: The number of rows written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            groups = {}
+            for listener_id, fields in pending.items():
+                key = json.dumps(fields, sort_keys=True, default=str)
+                groups.setdefault(key, (fields, []))[1].append(listener_id)
+
+            written = 0
+            for fields, ids in groups.values():
+                for start in range(0, len(ids), self.max_batch):
+                    batch = ids[start:start + self.max_batch]
+                    try:
+                        self.supabase.table(self.table).update(fields).in_("id", batch).execute()
+                    except Exception as e:
+                        logger.error(f"Error flushing updates of {len(batch)} listeners: {e}")
+                        self._requeue(batch, fields)
+                        with self._lock:
+                            self._errors += 1
+                        continue
+                    written += len(batch)
+                    with self._lock:
+                        self._written_rows += len(batch)
+                        self._batches += 1
+            return written
+
+    def metrics(self):
+        """
+        Return the writer's queue and throughput counters.
+
+        Returns:
+            dict: Pending listeners and lifetime totals.
+        """
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "recorded": self._recorded,
+                "written_rows": self._written_rows,
+                "batches": self._batches,
+                "errors": self._errors,
+            }
+
+    def start(self):
+        """Start the background flush thread."""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="status-writer", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the flush thread and write everything still pending."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _requeue(self, ids, fields):
+        # Put failed changes back without overwriting anything recorded since the flush began
+        with self._lock:
+            for listener_id in ids:
+                self._pending[listener_id] = {**fields, **self._pending.get(listener_id, {})}
+
+
+class CompositeStatusWriter:
+    """Forwards every recorded update to several writers, such as a ``StatusWriter`` and a ``StatusBroadcaster``."""
+
+    def __init__(self, *writers):
+        self.writers = writers
+
+    def record(self, listener, **fields):
+        for writer in self.writers:
+            writer.record(listener, **fields)
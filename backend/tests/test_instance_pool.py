@@ -0,0 +1,35 @@
+import asyncio
+import threading
+
+from fakes import FakeInstance
+from instance_pool import InstancePool
+
+
+def test_cancelled_lease_returns_the_instance_it_was_waiting_for():
+    starting = threading.Event()
+    started = threading.Event()
+
+    def slow_factory():
+        starting.set()
+        started.wait(5)
+        return FakeInstance()
+
+    pool = InstancePool(slow_factory, max_size=1, warm_spares=0, health_check=None)
+
+    async def cancel_while_starting():
+        async def use():
+            async with pool.lease():
+                pass
+
+        task = asyncio.create_task(use())
+        await asyncio.to_thread(starting.wait, 5)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        started.set()
+        # The instance reaches the pool once the abandoned acquire finishes
+        async with pool.lease(timeout=5) as instance:
+            return instance
+
+    assert asyncio.run(cancel_while_starting()) is not None
+    metrics = pool.metrics()
+    assert (metrics["size"], metrics["idle"], metrics["leased"], metrics["started_total"]) == (1, 1, 0, 1)
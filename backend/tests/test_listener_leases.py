@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta, timezone
+
+from fakes import FakeSupabase
+from listener_leases import ListenerLeases
+from scheduler import FakeClock
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def make_nodes(*listener_ids, lease_seconds=120, max_held=None):
+    supabase = FakeSupabase(tables={"event_listeners": [
+        {"id": listener_id, "interval": "1-hour", "next_trigger_at": START.isoformat(), "lease_owner": None}
+        for listener_id in listener_ids
+    ]})
+    clock = FakeClock(START)
+    nodes = [
+        ListenerLeases(supabase, owner=owner, lease_seconds=lease_seconds, clock=clock, max_held=max_held)
+        for owner in ("node-a", "node-b")
+    ]
+    return supabase, clock, nodes
+
+
+def test_only_one_node_claims_a_due_listener():
+    supabase, _, (a, b) = make_nodes(1)
+
+    claimed, later = a.claim([{"id": 1}])
+    assert [listener["id"] for listener in claimed] == [1]
+    assert later == []
+
+    claimed, later = b.claim([{"id": 1}])
+    assert claimed == []
+    assert [(listener["id"], when) for listener, when in later] == [(1, START + timedelta(seconds=120))]
+    assert supabase.rows("event_listeners")[0]["lease_owner"] == "node-a"
+    assert b.metrics()["contested"] == 1
+
+
+def test_heartbeat_keeps_the_lease():
+    _, clock, (a, b) = make_nodes(1)
+    a.claim([{"id": 1}])
+
+    clock.advance(100)
+    assert a.heartbeat() == 1
+    clock.advance(100)
+    claimed, _ = b.claim([{"id": 1}])
+    assert claimed == []
+
+
+def test_expired_lease_is_claimed_by_another_node():
+    supabase, clock, (a, b) = make_nodes(1)
+    a.claim([{"id": 1}])
+
+    clock.advance(121)
+    claimed, _ = b.claim([{"id": 1}])
+    assert [listener["id"] for listener in claimed] == [1]
+    assert supabase.rows("event_listeners")[0]["lease_owner"] == "node-b"
+
+    assert a.heartbeat() == 0
+    assert a.metrics()["lost"] == 1
+    assert a.metrics()["held"] == 0
+
+
+def test_release_makes_the_listener_due_again():
+    supabase, clock, (a, b) = make_nodes(1)
+    a.claim([{"id": 1}])
+
+    assert a.release({"id": 1}, START + timedelta(seconds=10))
+    clock.advance(10)
+    claimed, _ = b.claim([{"id": 1}])
+    assert [listener["id"] for listener in claimed] == [1]
+
+
+def test_room_counts_held_leases():
+    _, _, (a, _) = make_nodes(1, 2, 3, max_held=2)
+    assert a.room() == 2
+
+    claimed, _ = a.claim([{"id": 1}, {"id": 2}])
+    assert a.room() == 0
+    a.release_fields(claimed[0])
+    assert a.room() == 1
@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta, timezone
+
+from fakes import FakeSupabase
+from scheduler import FakeClock, ListenerScheduler
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def make_scheduler(rows=()):
+    supabase = FakeSupabase(tables={"event_listeners": list(rows)})
+    clock = FakeClock(START)
+    dispatched = []
+    scheduler = ListenerScheduler(supabase, dispatch=lambda listener: dispatched.append(listener["id"]), clock=clock)
+    return scheduler, supabase, clock, dispatched
+
+
+def listener(listener_id, **fields):
+    return {"id": listener_id, "url": f"https://shop.example/{listener_id}", "interval": "1-hour", **fields}
+
+
+def test_dispatches_due_listeners_in_trigger_time_order():
+    scheduler, _, clock, dispatched = make_scheduler()
+    for listener_id, offset in ((1, 30), (2, 10), (3, 20)):
+        scheduler.schedule(listener(listener_id), START + timedelta(seconds=offset))
+
+    assert scheduler.next_due() == START + timedelta(seconds=10)
+    clock.advance(15)
+    assert scheduler.run_pending() == 1
+    clock.advance(15)
+    assert scheduler.run_pending() == 2
+    assert dispatched == [2, 3, 1]
+    assert len(scheduler) == 0
+
+
+def test_scheduling_again_replaces_the_earlier_entry():
+    scheduler, _, clock, dispatched = make_scheduler()
+    scheduler.schedule(listener(1), START + timedelta(seconds=10))
+    scheduler.schedule(listener(2), START + timedelta(seconds=20))
+    scheduler.schedule(listener(1), START + timedelta(seconds=30))
+
+    assert len(scheduler) == 2
+    assert scheduler.next_due() == START + timedelta(seconds=20)
+    clock.advance(60)
+    scheduler.run_pending()
+    assert dispatched == [2, 1]
+
+
+def test_removed_listener_is_not_dispatched():
+    scheduler, _, clock, dispatched = make_scheduler()
+    scheduler.schedule(listener(1), START)
+    scheduler.schedule(listener(2), START)
+
+    assert scheduler.remove(1)
+    assert not scheduler.remove(1)
+    scheduler.run_pending()
+    assert dispatched == [2]
+
+
+def test_reschedule_persists_and_dispatches_after_the_interval():
+    scheduler, supabase, clock, dispatched = make_scheduler([listener(1)])
+    scheduler.schedule(listener(1), START)
+    scheduler.run_pending()
+
+    next_trigger = scheduler.reschedule(listener(1))
+    assert next_trigger == START + timedelta(hours=1)
+    assert supabase.rows("event_listeners")[0]["next_trigger_at"] == next_trigger.isoformat()
+
+    clock.advance(3599)
+    assert scheduler.run_pending() == 0
+    clock.advance(1)
+    assert scheduler.run_pending() == 1
+    assert dispatched == [1, 1]
+
+
+def test_unknown_interval_is_not_rescheduled():
+    scheduler, _, _, _ = make_scheduler([listener(1, interval="once")])
+
+    assert scheduler.reschedule(listener(1, interval="once")) is None
+    assert scheduler.next_due() is None
+
+
+def test_load_schedules_stored_listeners_with_malformed_urls():
+    rows = [
+        listener(1, url="http://shop.example:abc/", next_trigger_at=START.isoformat()),
+        listener(2, url="http://shop.example:abc/", next_trigger_at=(START + timedelta(seconds=5)).isoformat()),
+    ]
+    scheduler, _, clock, dispatched = make_scheduler(rows)
+
+    assert scheduler.load() == 2
+    assert scheduler.has_companion(rows[0], within=10)
+    clock.advance(5)
+    scheduler.run_pending()
+    assert dispatched == [1, 2]
@@ -0,0 +1,75 @@
+from fakes import FakeSupabase
+from status_writer import StatusWriter
+
+
+def make_writer(*listener_ids, **kwargs):
+    supabase = FakeSupabase(tables={"event_listeners": [{"id": listener_id} for listener_id in listener_ids]})
+    return StatusWriter(supabase, **kwargs), supabase
+
+
+def stored(supabase):
+    return {row["id"]: row for row in supabase.rows("event_listeners")}
+
+
+def test_successive_changes_of_a_listener_collapse_into_one_write():
+    writer, supabase = make_writer(1)
+    writer.record({"id": 1}, status="in_progress")
+    writer.record({"id": 1}, status="completed", result="done")
+
+    assert writer.flush() == 1
+    assert stored(supabase)[1]["status"] == "completed"
+    assert stored(supabase)[1]["result"] == "done"
+    assert [call for call in supabase.calls if call[1] == "update"] == [("event_listeners", "update", 1)]
+    assert writer.metrics()["recorded"] == 2
+
+
+def test_identical_changes_share_one_update():
+    writer, supabase = make_writer(1, 2, 3)
+    for listener_id in (1, 2, 3):
+        writer.record({"id": listener_id}, status="in_progress")
+    writer.record({"id": 3}, result="done")
+
+    assert writer.flush() == 3
+    assert writer.metrics()["batches"] == 2
+    assert all(row["status"] == "in_progress" for row in stored(supabase).values())
+
+
+def test_close_flushes_pending_changes():
+    writer, supabase = make_writer(1, flush_interval=3600)
+    writer.start()
+    writer.record({"id": 1}, status="completed")
+    assert "status" not in stored(supabase)[1]
+
+    writer.close()
+    assert stored(supabase)[1]["status"] == "completed"
+    assert writer.metrics()["pending"] == 0
+
+
+def test_failed_flush_is_retried_without_overwriting_newer_changes():
+    writer, supabase = make_writer(1)
+    writer.record({"id": 1}, status="in_progress", result="partial")
+
+    # A transition recorded while the failing write is in flight must win over the requeued change
+    execute_query = supabase.execute_query
+
+    def fail_after_newer_change(table, query):
+        writer.record({"id": 1}, status="completed")
+        raise ConnectionError("connection reset")
+
+    supabase.execute_query = fail_after_newer_change
+    assert writer.flush() == 0
+    assert writer.metrics()["errors"] == 1
+
+    supabase.execute_query = execute_query
+    assert writer.flush() == 1
+    assert stored(supabase)[1]["status"] == "completed"
+    assert stored(supabase)[1]["result"] == "partial"
+
+
+def test_deleted_listener_is_not_recreated():
+    writer, supabase = make_writer(1)
+    writer.record({"id": 1}, status="completed")
+    supabase.table("event_listeners").delete().eq("id", 1).execute()
+
+    assert writer.flush() == 1
+    assert supabase.rows("event_listeners") == []
@@ -0,0 +1,218 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+
+from utils import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Bump when the recorded format, or how a replay uses it, changes; older recordings are then ignored
+TRAJECTORY_VERSION = 1
+
+# Screenshots are compared as grayscale thumbnails of this size, which keeps layout and drops text detail
+FINGERPRINT_SIZE = (32, 24)
+
+
+class TrajectoryDiverged(Exception):
+    """A replayed screenshot no longer looks like the recorded one, so the recording doesn't fit the page."""
+
+
+def screenshot_fingerprint(base64_image):
+    """
+    Reduce a screenshot to a small grayscale thumbnail, to compare a replay against its recording.
+
+    Returns:
+        str or None: The thumbnail's pixels as hex, or None if the image can't be decoded.
+    """
+    from PIL import Image
+
+    try:
+        image = Image.open(BytesIO(base64.b64decode(base64_image)))
+        thumbnail = image.convert("L").resize(FINGERPRINT_SIZE, Image.Resampling.BOX)
+    except Exception as e:
+        logger.warning(f"Could not fingerprint screenshot: {e}")
+        return None
+    return thumbnail.tobytes().hex()
+
+
+def screenshot_distance(recorded, replayed):
+    """
+    Compare two screenshot fingerprints.
+
+    Returns:
+        float: The mean pixel difference, from 0 for identical thumbnails to 1. Fingerprints
+        of different sizes are 1 apart.
+    """
+    recorded, replayed = bytes.fromhex(recorded), bytes.fromhex(replayed)
+    if len(recorded) != len(replayed) or not recorded:
+        return 1.0
+    return sum(abs(a - b) for a, b in zip(recorded, replayed)) / (255 * len(recorded))
+
+
+def command_hash(command):
+    """Identify the prompt a trajectory was recorded for; editing the listener's URL or event changes it."""
+    return hashlib.sha256(command.encode("utf-8")).hexdigest()
+
+
+class Trajectory:
+    """
+    The tool-using turns of an agent session, as replayed on later checks of the same listener.
+
+    Each step is one turn: the assistant content as sent back to the model, tool_use blocks
+    included, and the fingerprint of every screenshot its tool calls returned, by tool_use id.
+
+    Args:
+        steps (list[dict], optional): Recorded steps, e.g. loaded from the store.
+    """
+
+    def __init__(self, steps=None):
+        self.steps = steps if steps is not None else []
+
+    def __len__(self):
+        return len(self.steps)
+
+    def record(self, content, screenshots):
+        """
+        Add a completed turn.
+
+        Args:
+            content (list[dict]): The turn's assistant content params.
+            screenshots (dict): Screenshot fingerprints by tool_use id.
+        """
+        self.steps.append({"content": content, "screenshots": screenshots})
+
+    def clear(self):
+        self.steps = []
+
+
+class TrajectoryStore:
+    """
+    Trajectories of each listener's last successful check, kept in a Supabase table.
+
+    A stored trajectory is only returned for the prompt it was recorded with, in the current
+    ``TRAJECTORY_VERSION``, and while younger than ``max_age``, so edited listeners, format
+    changes and old recordings all fall back to a full agent run that records afresh.
+    Replays that diverged or ended without a verdict drop their trajectory. Reads and writes
+    run off the event loop, and a failing store only costs the replay, never the check.
+
+    A session that replays a trajectory and then needs more tool calls records both, so a
+    trajectory could grow with every check. One longer than ``max_steps`` is dropped instead
+    of saved, and the next check records afresh with the full agent, within its turn budget.
+
+    See migrations/008_listener_trajectories.sql.
+
+    Args:
+        supabase (Client): The Supabase client instance.
+        max_age (float): Seconds a recording is replayed before it is recorded again.
+        max_steps (int, optional): The longest trajectory kept. None is unbounded.
+        table (str): The table name.
+    """
+
+    def __init__(self, supabase, max_age=7 * 24 * 3600, max_steps=None, table="listener_trajectories"):
+        self.supabase = supabase
+        self.max_age = max_age
+        self.max_steps = max_steps
+        self.table = table
+        self._lock = threading.Lock()
+        self._loaded = 0
+        self._stale = 0
+        self._saved = 0
+        self._invalidated = 0
+
+    async def get(self, listener_id, command):
+        """Return the listener's trajectory for ``command``, or None if there is no usable one."""
+        try:
+            rows = await asyncio.to_thread(self._select, listener_id)
+        except Exception as e:
+            logger.warning(f"Error reading trajectory of listener {listener_id}: {e}")
+            return None
+        if not rows:
+            return None
+        row = rows[0]
+        expired = parse_timestamp(row["recorded_at"]) + timedelta(seconds=self.max_age) <= datetime.now(timezone.utc)
+        if row["version"] != TRAJECTORY_VERSION or row["command_hash"] != command_hash(command) or expired:
+            self._count("_stale")
+            return None
+        self._count("_loaded")
+        return Trajectory(row["steps"])
+
+    async def update(self, listener_id, command, trajectory, succeeded, replayed=None):
+        """
+        Keep what a finished session recorded for the listener's next check.
+
+        A session that reached a verdict stores its trajectory, unless it only replayed the
+        stored one unchanged or the trajectory is longer than ``max_steps``. A replay that
+        diverged, ended without a verdict or grew too long, and wasn't replaced, is invalidated.
+
+        Args:
+            listener_id: The listener's id.
+            command (str): The prompt the session ran.
+            trajectory (Trajectory): What the session recorded.
+            succeeded (bool): Whether the session ended with a positive or negative verdict.
+            replayed (Trajectory, optional): The stored trajectory the session was given to replay.
+        """
+        too_long = self.max_steps is not None and len(trajectory) > self.max_steps
+        if succeeded and trajectory.steps and not too_long:
+            if replayed is None or trajectory.steps != replayed.steps:
+                await self.save(listener_id, command, trajectory)
+        elif replayed is not None:
+            await self.invalidate(listener_id)
+
+    async def save(self, listener_id, command, trajectory):
+        row = {
+            "listener_id": listener_id,
+            "version": TRAJECTORY_VERSION,
+            "command_hash": command_hash(command),
+            "steps": trajectory.steps,
+            "recorded_at": datetime.now(timezone.utc).isoformat(),
+        }
+        try:
+            await asyncio.to_thread(
+                lambda: self.supabase.table(self.table).upsert(row, on_conflict="listener_id").execute()
+            )
+        except Exception as e:
+            logger.warning(f"Error saving trajectory of listener {listener_id}: {e}")
+            return
+        self._count("_saved")
+
+    async def invalidate(self, listener_id):
+        """Drop the listener's trajectory, so its next check runs the full agent."""
+        try:
+            await asyncio.to_thread(
+                lambda: self.supabase.table(self.table).delete().eq("listener_id", listener_id).execute()
+            )
+        except Exception as e:
+            logger.warning(f"Error invalidating trajectory of listener {listener_id}: {e}")
+            return
+        self._count("_invalidated")
+
+    def metrics(self):
+        """
+        Return trajectory store counters.
+
+        Returns:
+            dict: Lifetime totals of trajectories loaded for replay, found stale, saved and invalidated.
+        """
+        with self._lock:
+            return {
+                "loaded": self._loaded,
+                "stale": self._stale,
+                "saved": self._saved,
+                "invalidated": self._invalidated,
+            }
+
+    def _select(self, listener_id):
+        return (
+            self.supabase.table(self.table)
+            .select("version, command_hash, steps, recorded_at")
+            .eq("listener_id", listener_id)
+            .execute()
+        ).data
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
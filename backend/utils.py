@@ -1,15 +1,38 @@
 import logging
 from datetime import datetime, timedelta, timezone
-import resend
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 logger = logging.getLogger(__name__)
 
-def calculate_next_trigger_time(interval):
+# Seconds per interval unit; intervals are written '<count>-<unit>', e.g. '30-minutes' or '1-day'
+INTERVAL_UNITS = {"minute": 60, "hour": 3600, "day": 86400, "week": 604800}
+
+def parse_interval(interval):
+    """
+    Parse an interval string such as '30-minutes', '12-hours' or '1-week'.
+
+    Args:
+        interval (str): A positive count and a unit (minute, hour, day or week, singular or plural).
+
+    Returns:
+        timedelta: The interval.
+
+    Raises:
+        ValueError: If the interval is not in that form.
+    """
+    count, _, unit = (interval or "").partition("-")
+    seconds = INTERVAL_UNITS.get(unit[:-1] if unit.endswith("s") else unit)
+    if not count.isdigit() or int(count) == 0 or seconds is None:
+        raise ValueError(f"Unknown interval: {interval}")
+    return timedelta(seconds=int(count) * seconds)
+
+def calculate_next_trigger_time(interval, now=None):
     """
     Calculate the next trigger time based on the interval provided.
 
     Args:
-        interval (str): The interval string (e.g., '30-minutes', '1-hour').
+        interval (str): The interval string (e.g., '30-minutes', '1-hour'); see ``parse_interval``.
+        now (datetime, optional): The time to count from. Defaults to the current UTC time.
 
     Returns:
         datetime: The next trigger time as a datetime object.
@@ -17,18 +40,68 @@ def calculate_next_trigger_time(interval):
     Raises:
         ValueError: If an unknown interval is provided.
     """
-    now = datetime.now(timezone.utc)
-    intervals = {
-        "30-minutes": timedelta(minutes=30),
-        "1-hour": timedelta(hours=1),
-        "12-hours": timedelta(hours=12),
-        "1-day": timedelta(days=1),
-        "1-week": timedelta(weeks=1),
-    }
-    if interval in intervals:
-        return now + intervals[interval]
+    now = now or datetime.now(timezone.utc)
+    return now + parse_interval(interval)
+
+def parse_timestamp(value):
+    """
+    Parse a timestamp returned by Supabase into a timezone-aware datetime.
+
+    Args:
+        value (str or datetime): An ISO 8601 timestamp.
+
+    Returns:
+        datetime: The parsed time, assumed UTC when no offset is given.
+    """
+    if isinstance(value, datetime):
+        parsed = value
     else:
-        raise ValueError(f"Unknown interval: {interval}")
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+def normalize_url(url):
+    """
+    Normalize a URL so that equivalent spellings of the same page compare equal.
+
+    The scheme and host are lowercased, default ports and fragments are dropped,
+    query parameters are sorted and a trailing slash on the path is removed. A URL that
+    can't be parsed, e.g. with a malformed port, is returned stripped but otherwise as is.
+
+    Args:
+        url (str): The URL to normalize.
+
+    Returns:
+        str: The normalized URL.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url.strip()
+    scheme = parts.scheme.lower() or "http"
+    host = (parts.hostname or "").lower()
+    if port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{port}"
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ""))
+
+def validate_url(url):
+    """
+    Check that a URL can be monitored: http or https, with a host and a valid port.
+
+    Raises:
+        ValueError: If it can't.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        parts.port
+    except ValueError as e:
+        raise ValueError(f"Invalid URL {url!r}: {e}") from None
+    if parts.scheme.lower() not in ("http", "https") or not parts.hostname:
+        raise ValueError(f"Invalid URL {url!r}: only http and https URLs with a host can be monitored")
 
 def send_email_notification(to_email, subject, html_content):
     """
@@ -42,6 +115,8 @@ def send_email_notification(to_email, subject, html_content):
     Returns:
         dict or None: The response from the email service, or None if an error occurred.
     """
+    import resend
+
     try:
         response = resend.Emails.send({
             "from": "onboarding@resend.dev",  # Replace with your verified sender
@@ -0,0 +1,10 @@
+"""
+WSGI entry point for production servers:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+``python server.py`` still runs the single-process development server.
+"""
+from server import create_app
+
+app = create_app()